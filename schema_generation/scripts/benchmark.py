@@ -0,0 +1,257 @@
+"""
+Scaling micro-benchmarks of the pipeline building blocks, on synthetic inputs (see synthetic_inputs.py).
+
+For each scale, synthetic inputs are generated in a temporary directory and each benchmark is timed over several
+repeats. A benchmark may have several engines, i.e. implementations of the same step available in the code, so
+that they can be compared at each scale:
+* read_vd: reading the VD file of one scenario.
+* apply_rules:inplace, apply_rules:newrow, apply_rules:drop: applying the process rules, the emissions rules and
+  per-process drop rules to the schema rows, with and without prune_rules.
+* trace_commodities, end_use_fractions: tracing the synthetic blending chain in one scenario and period.
+* add_missing_periods: completing the periods of a combined-like DataFrame with add_missing_periods, or with
+  complete_periods (which also aggregates and sorts).
+* compare_tables: comparing two combined-like CSV files with compare_tables or compare_tables_keyed.
+* save: writing a combined-like DataFrame with save, with and without its manifest.
+
+The median and minimum times are appended to BENCHMARK_RESULTS_FILEPATH, with the scale, the engine and a label
+for the run (e.g. the branch being measured), so that scaling curves can be drawn and runs compared. A table of
+the median times against the varied parameter is logged.
+
+Usage:
+python scripts/benchmark.py [--vary PARAMETER VALUE ...] [--set PARAMETER=VALUE ...] [--benchmarks NAME ...]
+                            [--repeats N] [--label LABEL]
+
+e.g. python scripts/benchmark.py --vary processes 100 200 400 800 --benchmarks read_vd apply_rules:inplace
+
+See the README for the overall workflow.
+"""
+
+import argparse
+import gc
+import logging
+import os
+import statistics
+import tempfile
+import time
+from dataclasses import asdict, fields
+from functools import cached_property
+import numpy as np
+import pandas as pd
+
+from constants import *
+from helpers import *
+from pipeline import (PipelineInputs, build_context, read_schema_vd, prepare_schema_rows, read_raw_df,
+                      trace_commodities, end_use_fractions, complete_periods)
+from synthetic_inputs import SyntheticScale, SYNTHETIC_BLEND_SOURCE, write_synthetic_inputs, synthetic_combined_df
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class Workspace:
+    """
+    The synthetic inputs of one scale, and the DataFrames derived from them, built when first needed.
+    """
+
+    def __init__(self, scale, directory):
+        self.scale = scale
+        self.directory = directory
+        self.inputs = PipelineInputs(**write_synthetic_inputs(scale, directory))
+
+    @cached_property
+    def ctx(self):
+        return build_context(self.inputs)
+
+    @cached_property
+    def schema_rows(self):
+        return prepare_schema_rows(self.ctx, read_schema_vd(self.inputs))
+
+    @cached_property
+    def raw_df(self):
+        return read_raw_df(self.inputs)
+
+    @cached_property
+    def combined_df(self):
+        return synthetic_combined_df(self.scale)
+
+    @cached_property
+    def combined_filepaths(self):
+        # The combined-like DataFrame, and a copy with some values changed, written as CSV
+        output_filepath = os.path.join(self.directory, "output_combined_df.csv")
+        reference_filepath = os.path.join(self.directory, "reference_combined_df.csv")
+        save(self.combined_df, output_filepath)
+        reference_df = self.combined_df.copy()
+        reference_df.loc[reference_df.index[::50], "Value"] += 1
+        save(reference_df, reference_filepath)
+        return output_filepath, reference_filepath
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+
+def _no_arguments():
+    return ()
+
+
+def _drop_rules(workspace):
+    # A drop rule for the inputs of one in ten processes
+    processes = workspace.schema_rows.Process.dropna().unique()[::10]
+    return [({"Attribute": "VAR_FIn", "Process": process}, "drop", {}) for process in processes]
+
+
+def _apply_rules_cases(rules):
+    # The engines of an apply_rules benchmark: the rules applied as they are, or after pruning those that cannot match
+    def cases(workspace):
+        ruleset = rules(workspace)
+        rows = workspace.schema_rows
+        return [
+            ("apply_rules", lambda df: apply_rules(df, ruleset), lambda: (rows.copy(),), len(rows)),
+            ("prune_rules+apply_rules", lambda df: apply_rules(df, prune_rules(ruleset, df)), lambda: (rows.copy(),), len(rows)),
+        ]
+    return cases
+
+
+def _first_partition(workspace):
+    return workspace.scale.scenario_names[0], str(workspace.scale.period_values[0])
+
+
+def _trace_cases(workspace):
+    scenario, period = _first_partition(workspace)
+    raw_df = workspace.raw_df[workspace.raw_df.Period == period]
+    return [("trace_commodities", lambda: trace_commodities(workspace.ctx, SYNTHETIC_BLEND_SOURCE, scenario, period, raw_df),
+             _no_arguments, len(raw_df))]
+
+
+def _end_use_fractions_cases(workspace):
+    scenario, period = _first_partition(workspace)
+    raw_df = workspace.raw_df[workspace.raw_df.Period == period]
+    return [("end_use_fractions", lambda: end_use_fractions(workspace.ctx, SYNTHETIC_BLEND_SOURCE, scenario, period, raw_df),
+             _no_arguments, len(raw_df))]
+
+
+def _add_missing_periods_cases(workspace):
+    df = workspace.combined_df
+    all_periods = np.sort(df.Period.unique())
+    categories = [x for x in GROUP_COLUMNS if x != 'Period']
+    return [
+        ("add_missing_periods", lambda: df.groupby(categories).apply(add_missing_periods(all_periods)), _no_arguments, len(df)),
+        ("complete_periods", lambda: complete_periods(df, all_periods), _no_arguments, len(df)),
+    ]
+
+
+def _compare_tables_cases(workspace):
+    output_filepath, reference_filepath = workspace.combined_filepaths
+    return [
+        ("compare_tables", lambda: compare_tables(output_filepath, reference_filepath), _no_arguments, len(workspace.combined_df)),
+        ("compare_tables_keyed", lambda: compare_tables_keyed(output_filepath, reference_filepath, COMBINED_DF_KEY_COLUMNS),
+         _no_arguments, len(workspace.combined_df)),
+    ]
+
+
+def _save_cases(workspace):
+    df, path = workspace.combined_df, workspace.path("saved_combined_df.csv")
+    return [
+        ("save", lambda: save(df, path), _no_arguments, len(df)),
+        ("save+manifest", lambda: save(df, path, manifest=True), _no_arguments, len(df)),
+    ]
+
+
+def _read_vd_cases(workspace):
+    path = next(iter(workspace.inputs.scenario_files.values()))
+    with open(path, encoding="utf-8") as file:
+        rows = sum(1 for line in file if line.startswith('"'))
+    return [("read_vd", lambda: read_vd(path), _no_arguments, rows)]
+
+
+# Each benchmark returns its cases for a workspace: (engine, function, arguments factory, input rows).
+# The arguments are built before each repeat and are not timed.
+BENCHMARKS = {
+    "read_vd": _read_vd_cases,
+    "apply_rules:inplace": _apply_rules_cases(lambda workspace: workspace.ctx.rulesets["process_rules"]),
+    "apply_rules:newrow": _apply_rules_cases(lambda workspace: workspace.ctx.rulesets["EMISSIONS_RULES"]),
+    "apply_rules:drop": _apply_rules_cases(_drop_rules),
+    "trace_commodities": _trace_cases,
+    "end_use_fractions": _end_use_fractions_cases,
+    "add_missing_periods": _add_missing_periods_cases,
+    "compare_tables": _compare_tables_cases,
+    "save": _save_cases,
+}
+
+
+def time_case(function, arguments, repeats):
+    """
+    Time a function over several repeats, building its arguments before each repeat.
+
+    :return: The list of times in seconds.
+    """
+    times = []
+    for _ in range(repeats):
+        args = arguments()
+        gc.collect()
+        start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def run_benchmarks(scales, benchmarks=None, repeats=3, label=""):
+    """
+    Run benchmarks at several scales.
+
+    :param scales: List of SyntheticScale.
+    :param benchmarks: Names of the benchmarks in BENCHMARKS to run; all of them if not given.
+    :param repeats: Number of times each case is timed.
+    :param label: Label of the run, recorded with the results.
+    :return: DataFrame with a row per scale, benchmark and engine.
+    """
+    results = []
+    run = time.strftime("%Y-%m-%dT%H:%M:%S")
+    for scale in scales:
+        with tempfile.TemporaryDirectory() as directory:
+            workspace = Workspace(scale, directory)
+            for name in benchmarks or BENCHMARKS:
+                for engine, function, arguments, rows in BENCHMARKS[name](workspace):
+                    times = time_case(function, arguments, repeats)
+                    logging.info("%s [%s] at %s: median %.4fs", name, engine, scale, statistics.median(times))
+                    results.append(dict(
+                        Run=run, Label=label, Benchmark=name, Engine=engine, **asdict(scale), Rows=rows,
+                        Repeats=repeats, MedianSeconds=statistics.median(times), MinSeconds=min(times),
+                    ))
+    return pd.DataFrame(results)
+
+
+def record_results(results, path=BENCHMARK_RESULTS_FILEPATH):
+    """
+    Append benchmark results to the results file, creating it if needed.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    results.to_csv(path, mode="a", index=False, header=not os.path.exists(path))
+    logging.info("Benchmark results appended to %s", path)
+
+
+def scaling_table(results, parameter):
+    """
+    Return the median times of each benchmark and engine against the values of a scale parameter.
+    """
+    return results.pivot_table(index=["Benchmark", "Engine"], columns=parameter, values="MedianSeconds", sort=False)
+
+
+if __name__ == "__main__":
+    parameters = [scale_field.name for scale_field in fields(SyntheticScale)]
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--vary', nargs='+', default=["processes", "100", "200", "400", "800"],
+                        help=f"A scale parameter ({', '.join(parameters)}) and the values to benchmark")
+    parser.add_argument('--set', nargs='+', default=[], metavar="PARAMETER=VALUE",
+                        help="Values of the other scale parameters")
+    parser.add_argument('--benchmarks', nargs='+', choices=list(BENCHMARKS), help="Benchmarks to run (default: all)")
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--label', default="", help="Label of the run, e.g. the branch being measured")
+    args = parser.parse_args()
+
+    parameter, values = args.vary[0], [int(value) for value in args.vary[1:]]
+    if parameter not in parameters:
+        parser.error(f"Unknown scale parameter: {parameter}")
+    base = SyntheticScale(**{key: int(value) for key, value in (setting.split("=") for setting in args.set)})
+    results = run_benchmarks([base.replace(**{parameter: value}) for value in values], args.benchmarks,
+                             args.repeats, args.label)
+    record_results(results)
+    logging.info("Median seconds by %s:\n%s", parameter, scaling_table(results, parameter).to_string(float_format="%.4f"))
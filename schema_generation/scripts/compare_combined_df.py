@@ -4,21 +4,89 @@ the schema dataframe and the TIMES VD outputs, and reports differences between t
 It also provides a detailed comparison of the first extra and missing rows.
 
 Usage:
-python scripts/compare_combined_df.py
+python scripts/compare_combined_df.py [--fast | --keyed | --streaming] [--trace]
+
+With --keyed, rows are paired by the key columns (COMBINED_DF_KEY_COLUMNS) and compared numerically
+within a tolerance, and the number of changed rows is reported for each column.
+With --streaming, the same comparison is done with bounded memory: both files are sorted on disk
+and merge-compared in one pass, and only a capped sample of mismatches is kept per column.
+With --fast, the fingerprint manifests written alongside the tables are compared first, and the
+keyed comparison is only run on the partitions whose fingerprints differ.
+With --trace, the time, memory and row counts of the default comparison are written as a JSON trace
+(see instrumentation.py).
 
 See the README for the overall workflow.
 """
 
+import argparse
 import logging
-from constants import OUTPUT_COMBINED_DF_FILEPATH, REFERENCE_COMBINED_DF_FILEPATH
+from constants import (
+    OUTPUT_COMBINED_DF_FILEPATH,
+    REFERENCE_COMBINED_DF_FILEPATH,
+    COMBINED_DF_KEY_COLUMNS,
+    COMPARE_TOLERANCE,
+    REFERENCE_COMBINED_DF_RENAMES,
+    STREAMING_CHUNK_ROWS,
+)
 from helpers import *
+from instrumentation import tracing, trace_filepath
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 if __name__ == "__main__":
-    message, main_df, schema, correct_rows, missing_rows, extra_rows = compare_tables(
-        OUTPUT_COMBINED_DF_FILEPATH, REFERENCE_COMBINED_DF_FILEPATH
-    )
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--fast', action='store_true', help="Compare fingerprint manifests first")
+    parser.add_argument('--keyed', action='store_true', help="Pair rows by key and compare values numerically")
+    parser.add_argument('--streaming', action='store_true', help="Compare with bounded memory (external sort and merge)")
+    parser.add_argument('--tolerance', type=float, default=COMPARE_TOLERANCE)
+    parser.add_argument('--chunk-rows', type=int, default=STREAMING_CHUNK_ROWS,
+                        help="Rows held in memory per sorted run in --streaming mode")
+    parser.add_argument('--trace', action='store_true', help="Write a JSON trace of the time, memory and rows of the comparison")
+    args = parser.parse_args()
+
+    if args.streaming:
+        from streaming_diff import compare_tables_streaming
+        message, summary = compare_tables_streaming(
+            OUTPUT_COMBINED_DF_FILEPATH, REFERENCE_COMBINED_DF_FILEPATH, COMBINED_DF_KEY_COLUMNS,
+            tolerance=args.tolerance, chunk_rows=args.chunk_rows, reference_renames=REFERENCE_COMBINED_DF_RENAMES,
+        )
+        logging.info(message)
+        for column, sample in summary.column_samples.items():
+            if sample:
+                logging.info("\nSample of changed rows for %s:\n%s", column, pd.DataFrame(sample).to_string(index=False))
+        if summary.missing_sample:
+            logging.info("\nSample of missing rows:\n%s", pd.DataFrame(summary.missing_sample).to_string(index=False))
+        if summary.extra_sample:
+            logging.info("\nSample of extra rows:\n%s", pd.DataFrame(summary.extra_sample).to_string(index=False))
+        exit()
+
+    if args.fast:
+        from manifest import compare_with_manifests
+        message, diff = compare_with_manifests(
+            OUTPUT_COMBINED_DF_FILEPATH, REFERENCE_COMBINED_DF_FILEPATH, COMBINED_DF_KEY_COLUMNS, tolerance=args.tolerance,
+            reference_renames=REFERENCE_COMBINED_DF_RENAMES,
+        )
+        logging.info(message)
+        if diff is not None and not diff[1].empty:
+            logging.info("\nFirst changed rows:\n")
+            logging.info(diff[1].head(10).to_string(index=False))
+        exit()
+
+    if args.keyed:
+        message, changed_rows, missing_rows, extra_rows, column_change_counts = compare_tables_keyed(
+            OUTPUT_COMBINED_DF_FILEPATH, REFERENCE_COMBINED_DF_FILEPATH, COMBINED_DF_KEY_COLUMNS,
+            tolerance=args.tolerance, reference_renames=REFERENCE_COMBINED_DF_RENAMES,
+        )
+        logging.info(message)
+        if not changed_rows.empty:
+            logging.info("\nFirst changed rows:\n")
+            logging.info(changed_rows.head(10).to_string(index=False))
+        exit()
+
+    with tracing(trace_filepath("compare_combined_df"), enabled=args.trace):
+        message, main_df, schema, correct_rows, missing_rows, extra_rows = compare_tables(
+            OUTPUT_COMBINED_DF_FILEPATH, REFERENCE_COMBINED_DF_FILEPATH
+        )
     logging.info(message)
     if not extra_rows.empty and not missing_rows.empty:
         first_extra_row = extra_rows.head(1)
@@ -4,21 +4,59 @@ process with the manually created one, and reports differences between them.
 It also provides a detailed comparison of the first extra and missing rows.
 
 Usage:
-python scripts/compare_schema_df.py
+python scripts/compare_schema_df.py [--fast | --keyed] [--trace]
+
+With --keyed, rows are paired by the key columns (SCHEMA_KEY_COLUMNS) and compared numerically
+within a tolerance, and the number of changed rows is reported for each column.
+With --fast, the fingerprint manifests written alongside the tables are compared first, and the
+keyed comparison is only run on the partitions whose fingerprints differ.
+With --trace, the time, memory and row counts of the default comparison are written as a JSON trace
+(see instrumentation.py).
 
 See the README for the overall workflow.
 """
 
+import argparse
 import logging
-from constants import OUTPUT_SCHEMA_FILEPATH, REFERENCE_SCHEMA_FILEPATH
+from constants import OUTPUT_SCHEMA_FILEPATH, REFERENCE_SCHEMA_FILEPATH, SCHEMA_KEY_COLUMNS, COMPARE_TOLERANCE
 from helpers import *
+from instrumentation import tracing, trace_filepath
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 if __name__ == "__main__":
-    message, main_df, schema, correct_rows, missing_rows, extra_rows = compare_tables(
-        OUTPUT_SCHEMA_FILEPATH, REFERENCE_SCHEMA_FILEPATH
-    )
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--fast', action='store_true', help="Compare fingerprint manifests first")
+    parser.add_argument('--keyed', action='store_true', help="Pair rows by key and compare values numerically")
+    parser.add_argument('--tolerance', type=float, default=COMPARE_TOLERANCE)
+    parser.add_argument('--trace', action='store_true', help="Write a JSON trace of the time, memory and rows of the comparison")
+    args = parser.parse_args()
+
+    if args.fast:
+        from manifest import compare_with_manifests
+        message, diff = compare_with_manifests(
+            OUTPUT_SCHEMA_FILEPATH, REFERENCE_SCHEMA_FILEPATH, SCHEMA_KEY_COLUMNS, tolerance=args.tolerance,
+        )
+        logging.info(message)
+        if diff is not None and not diff[1].empty:
+            logging.info("\nFirst changed rows:\n")
+            logging.info(diff[1].head(10).to_string(index=False))
+        exit()
+
+    if args.keyed:
+        message, changed_rows, missing_rows, extra_rows, column_change_counts = compare_tables_keyed(
+            OUTPUT_SCHEMA_FILEPATH, REFERENCE_SCHEMA_FILEPATH, SCHEMA_KEY_COLUMNS, tolerance=args.tolerance
+        )
+        logging.info(message)
+        if not changed_rows.empty:
+            logging.info("\nFirst changed rows:\n")
+            logging.info(changed_rows.head(10).to_string(index=False))
+        exit()
+
+    with tracing(trace_filepath("compare_schema_df"), enabled=args.trace):
+        message, main_df, schema, correct_rows, missing_rows, extra_rows = compare_tables(
+            OUTPUT_SCHEMA_FILEPATH, REFERENCE_SCHEMA_FILEPATH
+        )
     logging.info(message)
     if not extra_rows.empty and not missing_rows.empty:
         first_extra_row = extra_rows.head(1)
@@ -27,6 +27,21 @@ INPUT_VD_FILES = [
     os.path.join(project_base_path, "data/input", "tui-v2_0_0.vd"),
 ]
 
+# VD file for each scenario, as labelled in the combined DataFrame.
+SCENARIO_INPUT_FILES = {
+    "Kea": INPUT_VD_FILES[0],
+    "Tui": INPUT_VD_FILES[1],
+}
+
+# Leading bytes of gzip- and zstd-compressed VD files, which read_vd decompresses as it reads them, and the size of
+# the read buffer of VD files.
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+VD_READ_BUFFER_SIZE = 1 << 20
+
+# Number of offending keys and sample rows kept for each check of the validation of the VD files (see validation.py).
+VALIDATION_SAMPLE_SIZE = 10
+
 # Path to the TIMES base.dd file containing commodity to unit mappings.
 BASE_DD_FILEPATH = os.path.join(project_base_path, "data/input", "base.dd")
 
@@ -78,6 +93,59 @@ OUTPUT_COMBINED_DF_FILEPATH = os.path.join(project_base_path, "data/output/outpu
 # Define the path to the reference (manually created) cleaned DataFrame CSV file.
 REFERENCE_COMBINED_DF_FILEPATH = os.path.join(project_base_path, "data/reference/reference_combined_df_v2_0_0.csv")
 
+# Path to the spreadsheet mapping each Technology to its Technology_Group.
+SCHEMA_TECHNOLOGY_FILEPATH = os.path.join(os.path.dirname(project_base_path), "data_cleaning", "Schema_Technology.xlsx")
+
+# Columns by which the combined DataFrame is grouped; each row of the output is unique over these columns.
+GROUP_COLUMNS = [
+    "Scenario",
+    "Sector",
+    "Subsector",
+    "Technology",
+    "Enduse",
+    "Unit",
+    "Parameters",
+    "Fuel",
+    "Period",
+    "FuelGroup",
+    "Technology_Group",
+]
+
+# Key columns used by the keyed table diff to pair changed rows between output and reference tables.
+SCHEMA_KEY_COLUMNS = ["Attribute", "Process", "Commodity"]
+COMBINED_DF_KEY_COLUMNS = list(GROUP_COLUMNS)
+
+# Columns of the partitions of raw_df within which the flows are traced.
+PARTITION_COLUMNS = ["Scenario", "Period"]
+
+# Columns by which manifests fingerprint output tables separately (those present in the table are used).
+MANIFEST_PARTITION_COLUMNS = ["Scenario", "Parameters", "Sector"]
+
+# Numeric columns that manifests fingerprint as numbers rather than as written, since the reference tables written by
+# R print them at another precision, and the number of decimals they are fingerprinted with.
+MANIFEST_VALUE_COLUMNS = ["Value"]
+MANIFEST_VALUE_DECIMALS = 6
+
+# Streaming comparison: rows per sorted run held in memory, and mismatches sampled per column.
+STREAMING_CHUNK_ROWS = 200000
+STREAMING_SAMPLE_SIZE = 10
+
+# Column names in the reference combined DataFrame (written by R) that differ from the output column names.
+REFERENCE_COMBINED_DF_RENAMES = {"scen": "Scenario"}
+
+# Absolute tolerance used when comparing numeric values between output and reference tables.
+COMPARE_TOLERANCE = 1e-6
+
+# Define the path to the output combined DataFrame as a Hive-partitioned Parquet dataset (a directory).
+OUTPUT_COMBINED_DATASET_DIR = os.path.join(project_base_path, "data/output/output_combined_dataset_v2_0_0")
+
+# Columns used to partition the combined dataset into directories, and to sort rows within each partition.
+DATASET_PARTITION_COLUMNS = ["Scenario", "Parameters"]
+DATASET_SORT_COLUMNS = ["Sector", "Subsector", "Technology", "Enduse", "Fuel", "Period"]
+
+# Maximum number of rows per Parquet row group. Smaller row groups give finer-grained min/max statistics.
+DATASET_ROW_GROUP_SIZE = 2048
+
 IGNORE_EXPORT_COMMODITIES =[
     'TB_ELC_NI_SI_01',
     'TU_DID_NI_SI_01',
@@ -92,4 +160,67 @@ IGNORE_EXPORT_COMMODITIES =[
     'TU_DSL_NI_SI_01',
     'TU_JET_NI_SI_01',
     'TU_COL_SI_NI_01'
-]
\ No newline at end of file
+]
+
+# Define the path to the precomputed hierarchical rollup cube of the combined DataFrame.
+OUTPUT_ROLLUP_CUBE_FILEPATH = os.path.join(project_base_path, "data/output/output_rollup_cube_v2_0_0.csv")
+
+# Hierarchies rolled up by the cube, from the coarsest to the finest level, and the columns kept at every level.
+ROLLUP_SECTOR_HIERARCHY = ["Sector", "Subsector", "Technology_Group", "Technology"]
+ROLLUP_FUEL_HIERARCHY = ["FuelGroup", "Fuel"]
+ROLLUP_BASE_COLUMNS = ["Scenario", "Parameters", "Unit", "Period"]
+
+# Label used in the cube for hierarchy columns that have been rolled up.
+ROLLUP_TOTAL_LABEL = "All"
+
+# Scenario pairs (scenario, baseline scenario) for which delta and ratio tables are precomputed.
+SCENARIO_COMPARISON_PAIRS = [
+    ("Tui", "Kea"),
+]
+
+# Define the path to the output table of differences between scenario pairs.
+OUTPUT_SCENARIO_DELTAS_FILEPATH = os.path.join(project_base_path, "data/output/output_scenario_deltas_v2_0_0.csv")
+
+# Define the path to the output combined DataFrame in the wide layout (one row per category, one column per period).
+OUTPUT_COMBINED_WIDE_FILEPATH = os.path.join(project_base_path, "data/output/output_combined_wide_v2_0_0.csv")
+
+# Define the path to the node and edge tables of the energy flows (Parquet datasets, in 'nodes' and 'edges' subdirectories).
+OUTPUT_FLOW_TABLES_DIR = os.path.join(project_base_path, "data/output/output_flow_tables_v2_0_0")
+
+# Units of the commodities whose flows are kept in the flow tables, the columns the tables are partitioned by, and
+# the separator between the Sector and Technology in the label of a process node.
+FLOW_TABLE_UNITS = ["PJ"]
+FLOW_TABLE_PARTITION_COLUMNS = ["Scenario"]
+FLOW_TABLE_LABEL_SEPARATOR = " / "
+
+# Local query server over the combined output: port, number of cached query results, and indexed filter columns.
+QUERY_SERVER_PORT = 8765
+QUERY_CACHE_SIZE = 256
+QUERY_INDEX_COLUMNS = [
+    "Scenario",
+    "Sector",
+    "Subsector",
+    "Technology",
+    "Enduse",
+    "Unit",
+    "Parameters",
+    "Fuel",
+    "FuelGroup",
+    "Technology_Group",
+]
+
+# Directory for the checkpoints of the pipeline stages, keyed by the hashes of their inputs.
+CHECKPOINT_DIR = os.path.join(project_base_path, "data/checkpoints")
+
+# Directory for the manifests built from CSV files written without one, e.g. the reference tables (see manifest.py).
+MANIFEST_CACHE_DIR = os.path.join(CHECKPOINT_DIR, "manifests")
+
+# Directory for the outputs of each variant of an option sweep (see sweep.py).
+SWEEP_OUTPUT_DIR = os.path.join(project_base_path, "data/output/sweep")
+
+# Directory for the JSON traces written by the instrumentation (see instrumentation.py).
+TRACE_DIR = os.path.join(project_base_path, "data/traces")
+
+# Results of the scaling micro-benchmarks on synthetic inputs (see benchmark.py), appended to by each run.
+BENCHMARK_RESULTS_FILEPATH = os.path.join(project_base_path, "data/benchmarks/benchmark_results.csv")
+REGRESSION_BASELINE_FILEPATH = os.path.join(project_base_path, "data/benchmarks/regression_baseline.json")
@@ -0,0 +1,538 @@
+"""
+Differential checks of the rule engine, the commodity tracer and the period completion against reference oracles.
+
+The reference implementations in reference_engines.py are run side by side with the engines the pipeline uses, on
+randomized inputs and on synthetic inputs of a configurable scale (see synthetic_inputs.py), and any divergence is
+reported. Each task has one oracle and one or more candidate engines:
+* apply_rules: applying rulesets in order, with apply_rules, with apply_rulesets (which prunes the rules first) and
+  with apply_rulesets_sharded.
+* trace_commodities, end_use_fractions: tracing the flows from a source process, with the pipeline functions,
+  and for end_use_fractions also through a TraceCache that has solved an identical trace in another scenario.
+* add_missing_periods: adding the missing periods of each category, with the function of helpers.py.
+* complete_periods: completing, aggregating and sorting a combined-like DataFrame, with the pipeline function.
+* incremental: the complete DataFrame after some flows of the synthetic VD files are changed, updated from the
+  checkpoints of the run before the change (stage_graph.py --incremental), against a run from scratch. Each case
+  runs the pipeline three times, so the randomized cases are few (INCREMENTAL_CASES) and small (INCREMENTAL_SCALE).
+
+To check a new engine, add it to the candidates of its task in TASKS. A candidate diverges on a case if its result
+has other columns or rows than that of the oracle, rows in another order, or values differing by more than the
+tolerance, or if only one of them raises an error. DataFrame results are compared row by row; when they differ,
+the rows are also paired by their non-value columns (as keyed_diff does) to report the changed, missing and extra
+rows. The script exits with an error if any candidate diverges.
+
+Usage:
+python scripts/differential.py [--tasks NAME ...] [--cases N] [--seed N] [--tolerance T] [--set PARAMETER=VALUE ...]
+                               [--no-synthetic]
+
+See the README for the overall workflow.
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+
+from constants import *
+from helpers import *
+import reference_engines as reference
+from pipeline import (PipelineInputs, apply_rulesets, trace_commodities, end_use_fractions, complete_periods,
+                      THOUSAND_VEHICLE_RULES)
+from sharding import apply_rulesets_sharded
+from stage_graph import StageGraph
+from trace_cache import TraceCache
+from synthetic_inputs import (SyntheticScale, SYNTHETIC_BLEND_SOURCE, synthetic_combined_df, synthetic_model,
+                              write_synthetic_inputs)
+from benchmark import Workspace
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Number of shards of the sharded rule engine
+DIFFERENTIAL_SHARDS = 3
+
+# Number of divergences described in detail for each task and engine
+DIVERGENCES_SHOWN = 3
+
+# Scale of the synthetic inputs and maximum number of the randomized cases of the incremental task
+INCREMENTAL_SCALE = SyntheticScale(processes=40, commodities=10, periods=3)
+INCREMENTAL_CASES = 2
+
+# Number of (Scenario, Process, Period) whose flows are changed in each case of the incremental task
+INCREMENTAL_EDITS = 5
+
+# Values of the columns of the randomized rule and combined inputs
+_RULE_COLUMN_VALUES = {
+    "Attribute": ["VAR_FIn", "VAR_FOut", "VAR_Cap"],
+    "Process": ["P1", "P2", "P3", "P4", "P5"],
+    "Commodity": ["ELC", "NGA", "DSL", "TOTCO2"],
+    "Sector": ["Industry", "Transport", "Residential"],
+    "Fuel": ["Electricity", "Natural Gas", "Diesel"],
+    "Unit": ["PJ", "GW", "kt CO2"],
+}
+_RULE_ACTION_VALUES = {
+    "Sector": ["Industry", "Transport", "Commercial"],
+    "Fuel": ["Electricity", "Diesel", "Biodiesel"],
+    "Unit": ["PJ", "000 Vehicles"],
+    "Enduse": ["Heating", "Motive Power"],
+}
+_COMBINED_COLUMN_VALUES = {
+    "Scenario": ["Kea", "Tui"],
+    "Sector": ["Industry", "Transport"],
+    "Subsector": ["Road Transport", "Dairy"],
+    "Technology": ["Boiler", "Plug-In Hybrid Vehicle"],
+    "Enduse": ["Heating", "Motive Power"],
+    "Unit": ["PJ", "000 Vehicles"],
+    "Parameters": ["Fuel Consumption", "Number of Vehicles"],
+    "Fuel": ["Electricity", "Diesel"],
+    "FuelGroup": ["Electricity", "Fossil Fuels"],
+    "Technology_Group": ["Boilers", "Vehicles"],
+}
+_PERIODS = [2018, 2025, 2030, 2035, 2040]
+
+
+#### INPUTS ####
+
+def _random_value(rng, values, missing=0.0):
+    # A value from the list, or a missing value (NaN or empty, as the rules files have both) with the given probability
+    if rng.random() < missing:
+        return np.nan if rng.random() < 0.5 else ""
+    return values[rng.integers(len(values))]
+
+
+def _random_rule(rng):
+    rule_type = rng.choice(["inplace", "inplace", "inplace", "newrow", "drop"])
+    keys = rng.choice(list(_RULE_COLUMN_VALUES), size=rng.integers(1, 4), replace=False)
+    condition = {key: _random_value(rng, _RULE_COLUMN_VALUES[key], missing=0.1) for key in keys}
+    if rule_type == "drop":
+        return condition, rule_type, {}
+    columns = rng.choice(list(_RULE_ACTION_VALUES), size=rng.integers(1, 3), replace=False)
+    actions = {column: _random_value(rng, _RULE_ACTION_VALUES[column], missing=0.1) for column in columns}
+    if rule_type == "newrow":
+        actions["Value"] = float(rng.integers(1, 100))
+    return condition, rule_type, actions
+
+
+def random_rule_cases(rng, count):
+    """
+    Return randomized (DataFrame, rulesets) cases for the apply_rules task. Some DataFrames have missing values
+    and duplicated index labels, as the schema rows do.
+    """
+    cases = []
+    for case in range(count):
+        rows = int(rng.integers(1, 40))
+        df = pd.DataFrame({column: [_random_value(rng, values, missing=0.1) for _ in range(rows)]
+                           for column, values in _RULE_COLUMN_VALUES.items()})
+        df["Value"] = rng.random(rows).round(3)
+        if rng.random() < 0.25:
+            df.index = rng.integers(0, max(1, rows // 2), rows)
+        rulesets = [(f"random_{position}", [_random_rule(rng) for _ in range(rng.integers(1, 12))])
+                    for position in range(rng.integers(1, 3))]
+        cases.append((f"random {case}", (df, rulesets)))
+    return cases
+
+
+def _random_flow_graph(rng, scenario, period):
+    # A layered flow graph from the SRC process to end-use commodities, with the same unit for every commodity
+    rows, layers, commodity_count = [], [["SRC"]], 0
+    for depth in range(rng.integers(1, 4)):
+        layers.append([f"L{depth}P{i}" for i in range(rng.integers(1, 4))])
+    for depth, processes in enumerate(layers):
+        downstream = layers[depth + 1] if depth + 1 < len(layers) else []
+        for process in processes:
+            for _ in range(rng.integers(1, 3)):
+                commodity, commodity_count = f"C{commodity_count}", commodity_count + 1
+                rows.append(("VAR_FOut", process, commodity, float(rng.integers(1, 100))))
+                consumers = rng.choice(downstream, size=rng.integers(1, len(downstream) + 1), replace=False) \
+                    if downstream and rng.random() < 0.8 else []
+                rows += [("VAR_FIn", consumer, commodity, float(rng.integers(1, 100))) for consumer in consumers]
+            if rng.random() < 0.3:
+                rows.append(("VAR_FOut", process, "TOTCO2", float(rng.integers(1, 100))))
+    df = pd.DataFrame(rows, columns=["Attribute", "Process", "Commodity", "Value"])
+    df["Scenario"], df["Period"] = scenario, period
+    processes = [process for layer in layers for process in layer]
+    ctx = SimpleNamespace(
+        commodity_units={commodity: "PJ" for commodity in df.Commodity.unique()},
+        end_use_processes=np.array(processes[1:] if len(processes) > 1 else processes),
+    )
+    return ctx, df
+
+
+def random_trace_cases(rng, count, with_filter=False):
+    """
+    Return randomized (ctx, process, scenario, period, DataFrame) cases for the tracing tasks, with flows of
+    another scenario and period in the DataFrame. If with_filter, a commodity filter is added to some cases.
+    """
+    cases = []
+    for case in range(count):
+        ctx, df = _random_flow_graph(rng, "Kea", "2030")
+        _, other = _random_flow_graph(rng, "Tui", "2030")
+        df = pd.concat([df, other, df.assign(Period="2035", Value=df.Value * 2)], ignore_index=True)
+        arguments = (ctx, "SRC", "Kea", "2030", df)
+        if with_filter:
+            commodities = df.Commodity.unique()
+            arguments += (list(rng.choice(commodities, size=rng.integers(1, len(commodities) + 1), replace=False))
+                          if rng.random() < 0.5 else None,)
+        cases.append((f"random {case}", arguments))
+    return cases
+
+
+def random_combined_cases(rng, count):
+    """
+    Return randomized (DataFrame, periods) cases for the period completion tasks, with categories missing some
+    periods, duplicated rows and rows in thousands of vehicles.
+    """
+    cases = []
+    for case in range(count):
+        count_categories = int(rng.integers(1, 8))
+        categories = pd.DataFrame({column: [_random_value(rng, values) for _ in range(count_categories)]
+                                   for column, values in _COMBINED_COLUMN_VALUES.items()})
+        rows = [dict(category, Period=period, Value=float(rng.integers(-50, 100)))
+                for category in categories.to_dict("records") for period in _PERIODS if rng.random() < 0.6]
+        df = pd.DataFrame(rows, columns=list(_COMBINED_COLUMN_VALUES) + ["Period", "Value"])
+        if df.empty:
+            continue
+        df = pd.concat([df, df.sample(frac=0.2, random_state=int(rng.integers(1 << 31)))], ignore_index=True)
+        all_periods = np.array(_PERIODS if rng.random() < 0.5 else sorted(df.Period.unique()))
+        cases.append((f"random {case}", (df, all_periods)))
+    return cases
+
+
+def random_flow_edits(rng, scale, count=INCREMENTAL_EDITS):
+    """
+    Return random changes to the flows of the synthetic VD files: a dictionary mapping (Scenario, Process, Period)
+    to the factor by which its VAR_FIn and VAR_FOut values are multiplied.
+    """
+    _, processes = synthetic_model(scale)
+    return {(str(rng.choice(scale.scenario_names)), str(rng.choice([process["Name"] for process in processes])),
+             str(rng.choice(scale.period_values))): round(float(rng.uniform(0.5, 1.5)), 3)
+            for _ in range(count)}
+
+
+def incremental_cases(rng, count, scale=INCREMENTAL_SCALE):
+    """
+    Return randomized cases of the incremental task, as (scale, edits) tuples.
+    """
+    return [(f"random {case} {scale}", (scale, random_flow_edits(rng, scale)))
+            for case in range(min(count, INCREMENTAL_CASES))]
+
+
+def synthetic_cases(task, scale):
+    """
+    Return the cases of a task on synthetic inputs of the given scale: the schema rows and rulesets, the flows
+    from the synthetic blending source in each scenario and period, a synthetic combined DataFrame, or changes to
+    the flows of the synthetic VD files that include the blending source.
+    """
+    if task == "incremental":
+        edits = random_flow_edits(np.random.default_rng(scale.seed), scale)
+        edits[(scale.scenario_names[0], SYNTHETIC_BLEND_SOURCE, str(scale.period_values[-1]))] = 1.1
+        return [(f"synthetic {scale}", (scale, edits))]
+    with tempfile.TemporaryDirectory() as directory:
+        workspace = Workspace(scale, directory)
+        if task == "apply_rules":
+            df = workspace.schema_rows.copy()
+            df["SourceRow"] = np.arange(len(df))
+            return [(f"synthetic {scale}", (df, workspace.ctx.schema_rulesets))]
+        if task in ("trace_commodities", "end_use_fractions"):
+            extra = (None,) if task == "end_use_fractions" else ()
+            raw_df = workspace.raw_df
+            return [(f"synthetic {scale} {scenario} {period}",
+                     (workspace.ctx, SYNTHETIC_BLEND_SOURCE, scenario, str(period), raw_df[raw_df.Period == str(period)]) + extra)
+                    for scenario in scale.scenario_names for period in scale.period_values]
+        df = synthetic_combined_df(scale)
+        return [(f"synthetic {scale}", (df, np.sort(df.Period.unique())))]
+
+
+#### ENGINES ####
+
+def _apply_rules_in_order(engine):
+    def apply(df, rulesets):
+        for _, rules in rulesets:
+            df = engine(df, rules)
+        return df
+    return apply
+
+
+def _end_use_fractions_reused(ctx, process, scenario, period, df, filter_to_commodities=None):
+    # Solve the trace in a copy of its partition under another scenario first, so that the trace reuses that solution
+    partition = df[(df['Scenario'] == scenario) & (df['Period'] == period)]
+    df = pd.concat([partition.assign(Scenario="Copy"), df], ignore_index=True)
+    traces = TraceCache(df)
+    for trace_scenario in ("Copy", scenario):
+        fractions = traces.end_use_fractions(
+            lambda: end_use_fractions(ctx, process, trace_scenario, period, df, filter_to_commodities),
+            process, trace_scenario, period, filter_to_commodities)
+    if traces.reused["traces"] != 1:
+        raise RuntimeError("The trace was not reused")
+    return fractions
+
+
+def edit_flows(inputs, edits):
+    """
+    Multiply the VAR_FIn and VAR_FOut values of some processes and periods in the VD files, in place.
+
+    :param inputs: The PipelineInputs of the VD files.
+    :param edits: Dictionary mapping (Scenario, Process, Period) to a factor, as returned by random_flow_edits.
+    """
+    for scenario, path in inputs.scenario_files.items():
+        with open(path, "r", encoding="utf-8") as file:
+            lines = file.readlines()
+        for number, line in enumerate(lines):
+            if not line.startswith(('"VAR_FIn"', '"VAR_FOut"')):
+                continue
+            fields = line.rstrip("\n").split(",")
+            factor = edits.get((scenario, fields[2].strip('"'), fields[3].strip('"')))
+            if factor is not None:
+                fields[-1] = f"{float(fields[-1]) * factor:.6f}"
+                lines[number] = ",".join(fields) + "\n"
+        with open(path, "w", encoding="utf-8") as file:
+            file.writelines(lines)
+
+
+def _complete_from_scratch(scale, edits):
+    with tempfile.TemporaryDirectory() as directory:
+        inputs = PipelineInputs(**write_synthetic_inputs(scale, directory))
+        edit_flows(inputs, edits)
+        return StageGraph(inputs, use_checkpoints=False).run(["complete"])["complete"]
+
+
+def _complete_incrementally(scale, edits):
+    # Run on the original inputs to save the checkpoints, then update the complete DataFrame for the changed flows
+    with tempfile.TemporaryDirectory() as directory:
+        inputs = PipelineInputs(**write_synthetic_inputs(scale, directory))
+        checkpoint_dir = os.path.join(directory, "checkpoints")
+        StageGraph(inputs, checkpoint_dir=checkpoint_dir).run(["complete"])
+        edit_flows(inputs, edits)
+        graph = StageGraph(inputs, checkpoint_dir=checkpoint_dir, incremental=True)
+        complete_df = graph.run(["complete"])["complete"]
+    if ("complete", "incremental") not in [(name, status) for name, status, _ in graph.history]:
+        raise RuntimeError("The complete stage was not updated incrementally")
+    return complete_df
+
+
+def _groupby_add_missing_periods(add_missing_periods_function):
+    def complete(df, all_periods):
+        categories = [x for x in GROUP_COLUMNS if x != 'Period']
+        return df.groupby(categories).apply(add_missing_periods_function(all_periods)).reset_index(drop=True)
+    return complete
+
+
+@dataclass
+class Task:
+    """
+    An oracle, the candidate engines to check against it and the generator of their randomized inputs.
+    """
+    oracle: object
+    candidates: dict
+    random_cases: object
+    value_columns: list = field(default=None)
+
+
+TASKS = {
+    "apply_rules": Task(
+        oracle=_apply_rules_in_order(reference.apply_rules),
+        candidates={
+            "apply_rules": _apply_rules_in_order(apply_rules),
+            "apply_rulesets": apply_rulesets,
+            "apply_rulesets_sharded": lambda df, rulesets: apply_rulesets_sharded(df, rulesets, DIFFERENTIAL_SHARDS, jobs=1),
+        },
+        random_cases=random_rule_cases,
+    ),
+    "trace_commodities": Task(
+        oracle=reference.trace_commodities,
+        candidates={"trace_commodities": trace_commodities},
+        random_cases=random_trace_cases,
+    ),
+    "end_use_fractions": Task(
+        oracle=reference.end_use_fractions,
+        candidates={"end_use_fractions": end_use_fractions, "TraceCache": _end_use_fractions_reused},
+        random_cases=lambda rng, count: random_trace_cases(rng, count, with_filter=True),
+        value_columns=["Value"],
+    ),
+    "add_missing_periods": Task(
+        oracle=_groupby_add_missing_periods(reference.add_missing_periods),
+        candidates={"add_missing_periods": _groupby_add_missing_periods(add_missing_periods)},
+        random_cases=random_combined_cases,
+        value_columns=["Value"],
+    ),
+    "complete_periods": Task(
+        oracle=lambda df, all_periods: reference.complete_periods(df, THOUSAND_VEHICLE_RULES, all_periods),
+        candidates={"complete_periods": complete_periods},
+        random_cases=random_combined_cases,
+        value_columns=["Value"],
+    ),
+    "incremental": Task(
+        oracle=_complete_from_scratch,
+        candidates={"stage_graph --incremental": _complete_incrementally},
+        random_cases=incremental_cases,
+        value_columns=["Value"],
+    ),
+}
+
+
+#### COMPARISON ####
+
+def _missing_as_none(df):
+    # None and NaN are the same missing value once written
+    return df.astype(object).where(df.notna(), None)
+
+
+def _cells_differ(actual, expected, tolerance=None):
+    # Compare two aligned columns, numerically within the tolerance if one is given, and as strings otherwise
+    if tolerance is not None:
+        actual_values = pd.to_numeric(actual, errors="coerce").to_numpy(dtype=float)
+        expected_values = pd.to_numeric(expected, errors="coerce").to_numpy(dtype=float)
+        return ~np.isclose(actual_values, expected_values, rtol=0, atol=tolerance, equal_nan=True)
+    return actual.astype(str).to_numpy() != expected.astype(str).to_numpy()
+
+
+def frame_divergence(expected, actual, tolerance=COMPARE_TOLERANCE, value_columns=None):
+    """
+    Compare the DataFrame returned by a candidate with that returned by the oracle.
+
+    :param value_columns: Columns compared numerically within the tolerance; defaults to the numeric columns of
+                          the expected DataFrame.
+    :return: List of the differences found, empty if there are none.
+    """
+    differences = []
+    if list(expected.columns) != list(actual.columns):
+        differences.append(f"columns differ: expected {list(expected.columns)}, got {list(actual.columns)}")
+    columns = [column for column in expected.columns if column in actual.columns]
+    if value_columns is None:
+        value_columns = [column for column in columns if pd.api.types.is_numeric_dtype(expected[column])]
+    value_columns = [column for column in value_columns if column in columns]
+    key_columns = [column for column in columns if column not in value_columns]
+    expected = expected[columns].reset_index(drop=True)
+    actual = actual[columns].reset_index(drop=True)
+    expected[key_columns], actual[key_columns] = _missing_as_none(expected[key_columns]), _missing_as_none(actual[key_columns])
+
+    if len(expected) != len(actual):
+        differences.append(f"{len(actual)} rows instead of {len(expected)}")
+    else:
+        differ = np.zeros(len(expected), dtype=bool)
+        for column in columns:
+            differ |= _cells_differ(actual[column], expected[column], tolerance if column in value_columns else None)
+        if differ.any():
+            differences.append(f"{int(differ.sum())} of {len(expected)} rows differ, the first at position {int(np.argmax(differ))}")
+    if differences and len(expected.columns) and key_columns:
+        message, changed_rows, missing_rows, extra_rows, _ = keyed_diff(actual, expected, key_columns, value_columns, tolerance)
+        if changed_rows.empty and missing_rows.empty and extra_rows.empty:
+            differences.append("the same rows, in another order")
+        else:
+            differences.append("; ".join(line.strip() for line in message.splitlines() if line.strip()))
+    return differences
+
+
+def dict_divergence(expected, actual, tolerance=COMPARE_TOLERANCE):
+    """
+    Compare the dictionary of fractions returned by a candidate tracer with that returned by the oracle.
+
+    :return: List of the differences found, empty if there are none.
+    """
+    differences = []
+    missing, extra = expected.keys() - actual.keys(), actual.keys() - expected.keys()
+    if missing:
+        differences.append(f"{len(missing)} paths missing, e.g. {sorted(missing)[0]}")
+    if extra:
+        differences.append(f"{len(extra)} extra paths, e.g. {sorted(extra)[0]}")
+    changed = [key for key in expected.keys() & actual.keys() if abs(expected[key] - actual[key]) > tolerance]
+    if changed:
+        differences.append(f"{len(changed)} fractions differ, e.g. {changed[0]}: {expected[changed[0]]} != {actual[changed[0]]}")
+    return differences
+
+
+def divergence(expected, actual, tolerance, value_columns=None):
+    """
+    Compare the result of a candidate with that of the oracle.
+
+    :return: List of the differences found, empty if there are none.
+    """
+    if isinstance(expected, pd.DataFrame) and isinstance(actual, pd.DataFrame):
+        return frame_divergence(expected, actual, tolerance, value_columns)
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        return dict_divergence(expected, actual, tolerance)
+    return [f"results of different types: {type(expected).__name__} and {type(actual).__name__}"]
+
+
+def _copied(arguments):
+    # Engines may modify their DataFrame arguments in place (apply_rules does)
+    return tuple(argument.copy() if isinstance(argument, pd.DataFrame) else argument for argument in arguments)
+
+
+def _call(function, arguments):
+    try:
+        return function(*_copied(arguments)), None
+    except Exception as error:
+        return None, error
+
+
+def check_task(name, task, cases, tolerance=COMPARE_TOLERANCE):
+    """
+    Run the oracle and every candidate of a task on each case, and compare their results.
+
+    :param cases: List of (description, arguments) tuples.
+    :return: DataFrame with a row per case and candidate: Task, Engine, Case, Status ('equal', 'diverged' or
+             'both raised') and Differences.
+    """
+    results = []
+    for description, arguments in cases:
+        expected, expected_error = _call(task.oracle, arguments)
+        for engine, candidate in task.candidates.items():
+            actual, error = _call(candidate, arguments)
+            if expected_error is not None or error is not None:
+                same = expected_error is not None and error is not None and type(expected_error) is type(error)
+                status = "both raised" if same else "diverged"
+                differences = [] if same else [f"oracle raised {expected_error!r}" if expected_error is not None else "",
+                                               f"engine raised {error!r}" if error is not None else ""]
+                differences = [difference for difference in differences if difference]
+            else:
+                differences = divergence(expected, actual, tolerance, task.value_columns)
+                status = "diverged" if differences else "equal"
+            results.append(dict(Task=name, Engine=engine, Case=description, Status=status,
+                                Differences="; ".join(differences)))
+    return pd.DataFrame(results, columns=["Task", "Engine", "Case", "Status", "Differences"])
+
+
+def report(results):
+    """
+    Return a text report of the checks: the count of each status by task and engine, and the first divergences.
+    """
+    counts = results.groupby(["Task", "Engine", "Status"], sort=False).size().unstack(fill_value=0)
+    lines = ["Cases by task, engine and status:", counts.to_string()]
+    diverged = results[results.Status == "diverged"]
+    for (task, engine), rows in diverged.groupby(["Task", "Engine"], sort=False):
+        lines.append(f"{task} [{engine}] diverged on {len(rows)} cases, e.g.:")
+        lines += [f"  {row.Case}: {row.Differences}" for row in rows.head(DIVERGENCES_SHOWN).itertuples()]
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tasks', nargs='+', choices=list(TASKS), default=list(TASKS), help="Tasks to check (default: all)")
+    parser.add_argument('--cases', type=int, default=50, help="Number of randomized cases of each task")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the randomized cases")
+    parser.add_argument('--tolerance', type=float, default=COMPARE_TOLERANCE, help="Absolute tolerance of numeric values")
+    parser.add_argument('--set', nargs='+', default=[], metavar="PARAMETER=VALUE",
+                        help="Scale parameters of the synthetic inputs (see synthetic_inputs.py)")
+    parser.add_argument('--no-synthetic', action='store_true', help="Check only the randomized cases")
+    args = parser.parse_args()
+
+    scale = SyntheticScale(**{key: int(value) for key, value in (setting.split("=") for setting in args.set)})
+    rng = np.random.default_rng(args.seed)
+    results = []
+    for name in args.tasks:
+        task = TASKS[name]
+        cases = task.random_cases(rng, args.cases)
+        if not args.no_synthetic:
+            cases += synthetic_cases(name, scale)
+        logging.info("Checking %s on %d cases", name, len(cases))
+        results.append(check_task(name, task, cases, args.tolerance))
+    results = pd.concat(results, ignore_index=True)
+    logging.info("Differential checks:\n%s", report(results))
+    if (results.Status == "diverged").any():
+        logging.error("Some engines diverged from the reference implementations")
+        sys.exit(1)
+    logging.info("All engines agree with the reference implementations")
@@ -0,0 +1,148 @@
+"""
+Builds node and edge tables of the energy flows of each (Scenario, Period), for flow (Sankey) diagrams.
+
+The tracer in pipeline.py walks the process -> commodity -> process flows of raw_df one trace at a time, and nothing
+keeps the graph. This module aggregates the whole graph once. Each VAR_FOut row of raw_df is an edge from its process
+to its commodity, and each VAR_FIn row an edge from its commodity to its process. Processes are grouped into nodes by
+their Sector and Technology in the schema, and commodities by their Fuel (the Fuel of the schema rows consuming
+them). The edges between the same nodes are summed, with a single groupby over all scenarios and periods. The value
+of a node is the larger of its inflow and its outflow. Only flows of commodities in the FLOW_TABLE_UNITS are kept,
+so that the widths of a diagram are comparable; emissions (CO2 commodities) are left out, as in the tracer.
+
+The tables are written as Parquet datasets partitioned by Scenario and sorted by Period (requires the optional
+`pyarrow` package), so a diagram reads only the rows of its (Scenario, Period):
+read_flow_tables(OUTPUT_FLOW_TABLES_DIR, Scenario="Kea", Period=2030)
+
+Usage (build the tables from the VD files and the existing output schema CSV):
+python scripts/flow_tables.py
+
+See the README for the overall workflow.
+"""
+
+import logging
+import os
+import numpy as np
+import pandas as pd
+
+from constants import *
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+FLOW_ATTRIBUTES = ['VAR_FIn', 'VAR_FOut']
+
+
+def _most_common(df, key, columns):
+    # The most frequent combination of values of the columns for each key, ties broken by first appearance
+    counts = df.groupby([key] + columns, sort=False).size().reset_index(name='count')
+    counts = counts.sort_values('count', ascending=False, kind='stable')
+    return counts.drop_duplicates(key).set_index(key)[columns]
+
+
+def process_nodes(schema_df):
+    """
+    Map each process of the schema to the label of its node, from its Sector and Technology.
+
+    :param schema_df: The schema DataFrame.
+    :return: DataFrame indexed by Process, with 'Node', 'Sector' and 'Technology' columns.
+    """
+    rows = schema_df[schema_df['Attribute'].isin(FLOW_ATTRIBUTES)].dropna(subset=['Sector', 'Technology'])
+    nodes = _most_common(rows, 'Process', ['Sector', 'Technology'])
+    nodes['Node'] = nodes['Sector'] + FLOW_TABLE_LABEL_SEPARATOR + nodes['Technology']
+    return nodes
+
+
+def commodity_nodes(schema_df):
+    """
+    Map each commodity consumed in the schema to the label of its node, its Fuel.
+
+    Commodities that no schema row consumes (e.g. end-use services) keep their own code as label.
+
+    :param schema_df: The schema DataFrame.
+    :return: DataFrame indexed by Commodity, with 'Node' and 'Fuel' columns.
+    """
+    rows = schema_df[schema_df['Attribute'] == 'VAR_FIn'].dropna(subset=['Fuel'])
+    nodes = _most_common(rows, 'Commodity', ['Fuel'])
+    nodes['Node'] = nodes['Fuel']
+    return nodes
+
+
+def build_flow_tables(raw_df, schema_df, commodity_units, units=None):
+    """
+    Aggregate the flows of raw_df into node and edge tables for each (Scenario, Period).
+
+    :param raw_df: The aggregated TIMES output, as returned by read_raw_df.
+    :param schema_df: The schema DataFrame, as returned by build_schema.
+    :param commodity_units: Dictionary mapping each commodity to its unit (PipelineContext.commodity_units).
+    :param units: Units of the commodities whose flows are kept; defaults to FLOW_TABLE_UNITS.
+    :return: A tuple of the nodes DataFrame (Scenario, Period, Node, Kind, Sector, Technology, Fuel, Unit, Inflow,
+             Outflow, Value) and the edges DataFrame (Scenario, Period, Source, Target, Unit, Value).
+    """
+    units = units or FLOW_TABLE_UNITS
+    processes = process_nodes(schema_df)
+    commodities = commodity_nodes(schema_df)
+    flows = raw_df[raw_df['Attribute'].isin(FLOW_ATTRIBUTES) & ~raw_df['Commodity'].str.contains('CO2')]
+    unit = flows['Commodity'].map(commodity_units)
+    flows, unit = flows[unit.isin(units)], unit[unit.isin(units)]
+    process_node = flows['Process'].map(processes['Node']).fillna(flows['Process'])
+    commodity_node = flows['Commodity'].map(commodities['Node']).fillna(flows['Commodity'])
+    is_output = (flows['Attribute'] == 'VAR_FOut').to_numpy()
+    edges = pd.DataFrame({
+        'Scenario': flows['Scenario'].to_numpy(),
+        'Period': flows['Period'].to_numpy(),
+        'Source': np.where(is_output, process_node, commodity_node),
+        'Target': np.where(is_output, commodity_node, process_node),
+        'Unit': unit.to_numpy(),
+        'Value': flows['Value'].to_numpy(),
+    })
+    edges = edges.groupby(['Scenario', 'Period', 'Source', 'Target', 'Unit']).agg(Value=('Value', 'sum')).reset_index()
+
+    keys = ['Scenario', 'Period', 'Node', 'Unit']
+    outflow = edges.rename(columns={'Source': 'Node'}).groupby(keys).agg(Outflow=('Value', 'sum'))
+    inflow = edges.rename(columns={'Target': 'Node'}).groupby(keys).agg(Inflow=('Value', 'sum'))
+    nodes = inflow.join(outflow, how='outer').fillna(0).reset_index()
+    nodes['Value'] = nodes[['Inflow', 'Outflow']].max(axis=1)
+    kinds = pd.concat([pd.Series('Process', index=process_node.unique()),
+                       pd.Series('Commodity', index=commodity_node.unique())])
+    nodes['Kind'] = nodes['Node'].map(kinds[~kinds.index.duplicated()])
+    nodes = nodes.join(processes.drop_duplicates('Node').set_index('Node'), on='Node')
+    nodes = nodes.join(commodities.drop_duplicates('Node').set_index('Node'), on='Node')
+    nodes = nodes[['Scenario', 'Period', 'Node', 'Kind', 'Sector', 'Technology', 'Fuel', 'Unit', 'Inflow', 'Outflow', 'Value']]
+    logging.info("Built flow tables with %s nodes and %s edges from %s flows", len(nodes), len(edges), len(flows))
+    return nodes, edges
+
+
+def write_flow_tables(nodes, edges, root_path):
+    """
+    Write the node and edge tables as Parquet datasets partitioned by Scenario, in the 'nodes' and 'edges'
+    subdirectories of root_path, replacing any existing tables.
+
+    :return: The paths written.
+    """
+    from partitioned_output import write_partitioned_dataset
+    paths = []
+    for name, df, sort_columns in [('nodes', nodes, ['Period', 'Kind', 'Node']),
+                                   ('edges', edges, ['Period', 'Source', 'Target'])]:
+        paths.append(os.path.join(root_path, name))
+        write_partitioned_dataset(df, paths[-1], partition_columns=FLOW_TABLE_PARTITION_COLUMNS, sort_columns=sort_columns)
+    return paths
+
+
+def read_flow_tables(root_path, **filters):
+    """
+    Read the node and edge tables of a slice, e.g. read_flow_tables(OUTPUT_FLOW_TABLES_DIR, Scenario="Kea", Period=2030).
+
+    :param root_path: Directory the tables were written to.
+    :param filters: Column filters, as for partitioned_output.read_partitioned_dataset.
+    :return: A tuple of the nodes and edges DataFrames.
+    """
+    from partitioned_output import read_partitioned_dataset
+    return tuple(read_partitioned_dataset(os.path.join(root_path, name), **filters) for name in ('nodes', 'edges'))
+
+
+if __name__ == "__main__":
+    from pipeline import build_context, read_raw_df
+    ctx = build_context()
+    schema_df = pd.read_csv(OUTPUT_SCHEMA_FILEPATH)
+    nodes, edges = build_flow_tables(read_raw_df(ctx.inputs), schema_df, ctx.commodity_units)
+    write_flow_tables(nodes, edges, OUTPUT_FLOW_TABLES_DIR)
+    logging.info("The flow tables have been saved to %s", OUTPUT_FLOW_TABLES_DIR)
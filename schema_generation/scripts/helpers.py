@@ -2,44 +2,70 @@
 Functions used for data processing and transformation, and comparison of DataFrames.
 """
 
+import os
 import re
 import csv
+import gzip
+import io
 import logging
 import numpy as np
 import pandas as pd
 
 from constants import *
+from manifest import write_manifest
+from instrumentation import instrumented
+from rule_telemetry import active_rule_telemetry
 
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
 
-def read_vd(filepath):
+def open_vd(filepath):
+    """
+    Open a VD file as a binary stream, decompressing it on the fly if it is gzip- or zstd-compressed.
+
+    The compression is detected from the leading bytes of the file, so archived files can be read under any name.
+    Reading zstd-compressed files requires the optional `zstandard` package.
+
+    :param filepath: Path to the VD file.
+    :return: A buffered binary stream, supporting peek and readline.
+    """
+    with open(filepath, "rb") as file:
+        magic = file.read(len(ZSTD_MAGIC))
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.open(filepath, "rb")
+    if magic.startswith(ZSTD_MAGIC):
+        import zstandard
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(filepath, "rb"), closefd=True),
+                                 buffer_size=VD_READ_BUFFER_SIZE)
+    return open(filepath, "rb", buffering=VD_READ_BUFFER_SIZE)
+
+
+def read_vd(filepath, validator=None):
     """
     Reads a VD file, using column names extracted from the file's header with regex, skipping non-CSV formatted header lines.
 
+    The file may be gzip- or zstd-compressed (see open_vd). It is read in a single pass: the header lines are
+    consumed up to the first data line, and the rest of the same stream is parsed by read_csv.
+
     :param filepath: Path to the VD file.
-    :param scen_label: Label for the 'scen' column for rows from this file.
+    :param validator: Optional VDValidator (see validation.py), given the rows as soon as they are parsed.
     """
     dimensions_pattern = re.compile(r"\*\s*Dimensions-")
 
-    # Determine the number of rows to skip and the column names
-    with open(filepath, "r", encoding="utf-8") as file:
+    with open_vd(filepath) as stream:
+        # Determine the column names from the header, stopping before the first data line
         columns = None
-        skiprows = 0
-        for line in file:
+        while stream.peek(1)[:1] not in (b'"', b''):
+            line = stream.readline().decode("utf-8")
             if dimensions_pattern.search(line):
                 columns_line = line.split("- ")[1].strip()
                 columns = columns_line.split(";")
-                continue
-            if line.startswith('"'):
-                break
-            skiprows += 1
 
-    # Read the CSV file with the determined column names and skiprows
-    df = pd.read_csv(
-        filepath, skiprows=skiprows, names=columns, header=None, low_memory=False
-    )
+        # Read the data lines with the determined column names
+        df = pd.read_csv(stream, names=columns, header=None, low_memory=False, encoding="utf-8")
+    if validator is not None:
+        validator.observe(df, os.path.basename(filepath))
     return df
 
 
@@ -192,6 +218,30 @@ def base_dd_commodity_unit_rules(filepath=None, rule_type=None):
     return rules
 
 
+def base_dd_set_elements(filepath, set_name):
+    """
+    Extracts the elements of a one-dimensional set of a file, e.g. the model years of 'SET MODLYEAR'.
+    Assumes the section starts after 'SET <set_name>' and the opening '/', and ends at the closing '/;'.
+
+    :param filepath: Path to the TIMES base.dd file containing the definitions.
+    :param set_name: Name of the set.
+    :return: List of the elements, as strings.
+    """
+    elements = []
+    with open(filepath, "r", encoding="utf-8") as file:
+        capture = False
+        for line in file:
+            line = line.strip()
+            if line.split() == ["SET", set_name]:
+                capture = True
+                continue
+            if capture and line.startswith("/;"):
+                break
+            if capture and line and not line.startswith("/"):
+                elements.append(line.split()[0].strip("'"))
+    return elements
+
+
 def sort_rules_by_specificity(rules):
     """
     Sort rules based on their specificity. A rule is considered more specific if its keys
@@ -216,18 +266,23 @@ def sort_rules_by_specificity(rules):
     return sorted_rules_rebuilt
 
 
-def apply_rules(schema, rules):
+def apply_rules(schema, rules, label="rules"):
     """
     Apply rules, optimized by minimizing row-wise operations.
 
     :param schema: DataFrame to apply rules on.
     :param rules: Rules defined as a list of tuples with conditions and actions.
+    :param label: Name of the ruleset, for the rule telemetry (see rule_telemetry.py).
     :return: Modified DataFrame with rules applied.
     """
     sorted_rules = sort_rules_by_specificity(rules)
+    telemetry = active_rule_telemetry()
+    recorder = telemetry.application(label, sorted_rules) if telemetry is not None else None
     new_rows = []
     rows_to_drop = []
-    for condition, rule_type, actions in sorted_rules:
+    for position, (condition, rule_type, actions) in enumerate(sorted_rules):
+        if recorder is not None:
+            recorder.start()
         query_conditions_parts, local_vars = [], {}
         for i, (key, value) in enumerate(condition.items()):
             if pd.notna(value) and value != "":
@@ -241,22 +296,32 @@ def apply_rules(schema, rules):
             # Filter schema DataFrame based on the query derived from the rule's conditions
             # Pass local_vars to query() to make external variables available
             filtered_indices = schema.query(query_conditions, local_dict=local_vars).index
+            if recorder is not None:
+                recorder.inplace(position, schema, filtered_indices, actions)
             # Apply actions for filtered rows, ensuring we ignore empty updates
             for column, value_to_set in actions.items():
                 if pd.notna(value_to_set) and value_to_set != "":
                     schema.loc[filtered_indices, column] = value_to_set
         elif rule_type == "newrow":
             # Apply newrow rule logic
+            new_rows_before = len(new_rows)
             for _, row in schema.iterrows():
                 if all(row.get(key, None) == value for key, value in condition.items()):
                     new_row = row.to_dict()
                     new_row.update(actions)
                     new_rows.append(new_row)
+            if recorder is not None:
+                recorder.matched(position, len(new_rows) - new_rows_before)
         elif rule_type == "drop":
             # Collect indices of rows to drop based on the condition
             if not query_conditions:
                 continue
+            rows_to_drop_before = len(rows_to_drop)
             rows_to_drop.extend(schema.fillna('-').query(query_conditions, local_dict=local_vars).index.tolist())    
+            if recorder is not None:
+                recorder.matched(position, len(rows_to_drop) - rows_to_drop_before)
+        if recorder is not None:
+            recorder.finish(position)
     # Drop rows collected for dropping
     schema = schema.drop(rows_to_drop).reset_index(drop=True)
     if new_rows:
@@ -265,6 +330,119 @@ def apply_rules(schema, rules):
     return schema
 
 
+def rule_condition_keys(condition, rule_type):
+    """
+    Return the columns a rule's condition tests, as apply_rules applies it. Inplace and drop rules ignore
+    conditions with empty values, while newrow rules compare every column.
+    """
+    if rule_type == "newrow":
+        return tuple(condition.keys())
+    return tuple(key for key, value in condition.items() if pd.notna(value) and value != "")
+
+
+class RuleKeyIndex:
+    """
+    Index of the rows of a DataFrame by the values of the columns tested by rule conditions, to find the rows
+    a rule matches without querying the DataFrame. An index is built for each combination of columns the
+    first time it is needed.
+    """
+
+    def __init__(self, df):
+        self.df = df
+        self._indexes = {}
+
+    def rows(self, condition, rule_type):
+        """
+        Return the positions of the rows of the DataFrame matching a rule's condition.
+        """
+        keys = rule_condition_keys(condition, rule_type)
+        if not keys:
+            # apply_rules skips inplace and drop rules without a condition
+            return [] if rule_type != "newrow" else list(range(len(self.df)))
+        if rule_type == "newrow" and any(pd.isna(condition[key]) for key in keys):
+            return []
+        if any(key not in self.df.columns for key in keys):
+            return []
+        # Drop rules are matched against the DataFrame with missing values filled with '-'
+        index_key = (keys, rule_type == "drop")
+        if index_key not in self._indexes:
+            columns = [self.df[key].fillna('-') if rule_type == "drop" else self.df[key] for key in keys]
+            index = {}
+            for position, values in enumerate(zip(*columns)):
+                index.setdefault(values, []).append(position)
+            self._indexes[index_key] = index
+        return self._indexes[index_key].get(tuple(condition[key] for key in keys), [])
+
+
+def prune_rules(rules, df, label="rules"):
+    """
+    Drop the rules that cannot match any row of a DataFrame before applying them, keeping the order of the others.
+    A rule cannot match if a value in its condition does not appear in the tested column. Columns set by the
+    ruleset itself are not used for pruning, since a rule may match a value set by an earlier rule.
+
+    :param rules: The ruleset.
+    :param df: The DataFrame the rules will be applied to.
+    :param label: Name of the ruleset, for logging.
+    :return: The rules that may match a row.
+    """
+    telemetry = active_rule_telemetry()
+    if telemetry is not None:
+        telemetry.register(label, rules)
+    own_columns = {column for _, rule_type, actions in rules if rule_type != "drop" for column in actions}
+    value_sets = {}
+
+    def present(column, value, fill):
+        if (column, fill) not in value_sets:
+            # Drop rules are matched against the DataFrame with missing values filled with '-'
+            values = df[column].fillna('-') if fill else df[column]
+            value_sets[(column, fill)] = set(values.unique())
+        return value in value_sets[(column, fill)]
+
+    pruned_rules = [
+        (condition, rule_type, actions) for condition, rule_type, actions in rules
+        if all(present(key, condition[key], rule_type == "drop") for key in rule_condition_keys(condition, rule_type)
+               if key not in own_columns and key in df.columns)
+    ]
+    logging.info("Ruleset %s: pruned %d of %d rules that cannot match", label, len(rules) - len(pruned_rules), len(rules))
+    return pruned_rules
+
+
+def _rule_identity(mapping):
+    # Rule conditions and actions may hold NaN, which does not compare equal to itself
+    return tuple((key, repr(value)) for key, value in mapping.items())
+
+
+def changed_rule_conditions(previous_rules, rules):
+    """
+    Compare two versions of a ruleset.
+
+    :param previous_rules: The previous version of the ruleset.
+    :param rules: The new version of the ruleset.
+    :return: A tuple of (changed, reordered). changed is a list of (condition, rule types) for the conditions
+             whose rules were added, removed or changed. reordered is True if the rules that did not change are
+             applied in a different order, in which case the changes cannot be located by condition.
+    """
+    def by_condition(ruleset):
+        grouped = {}
+        for condition, rule_type, actions in sort_rules_by_specificity(ruleset):
+            entry = grouped.setdefault(_rule_identity(condition), (condition, []))
+            entry[1].append((rule_type, _rule_identity(actions)))
+        return grouped
+
+    previous_grouped, grouped = by_condition(previous_rules), by_condition(rules)
+    changed = []
+    for identity in list(previous_grouped) + [x for x in grouped if x not in previous_grouped]:
+        previous_entry, entry = previous_grouped.get(identity), grouped.get(identity)
+        if previous_entry is None or entry is None or previous_entry[1] != entry[1]:
+            condition = (entry or previous_entry)[0]
+            rule_types = {rule_type for rule_type, _ in (previous_entry[1] if previous_entry else []) + (entry[1] if entry else [])}
+            changed.append((condition, rule_types))
+    changed_identities = {_rule_identity(condition) for condition, _ in changed}
+    reordered = ([x for x in previous_grouped if x not in changed_identities] !=
+                 [x for x in grouped if x not in changed_identities])
+    return changed, reordered
+
+
 def parse_emissions_factors(filename):
     """
     Parses the base.dd file to extract mappings from fuel commodities to emissions commodities.
@@ -345,6 +523,7 @@ def compare_rows(df1, df2, df1_label="df1", df2_label="df2"):
     return comparison_df
 
 
+@instrumented
 def compare_tables(output_filepath, reference_filepath, columns=None):
     """
     Assemble DataFrames from the output and reference CSV files and compare them.
@@ -355,8 +534,25 @@ def compare_tables(output_filepath, reference_filepath, columns=None):
 
     :return: A tuple containing the comparison message, DataFrames, and comparison results.
     """
-    output_df = pd.read_csv(output_filepath, low_memory=False).drop_duplicates()
-    reference_df = pd.read_csv(reference_filepath, low_memory=False).drop_duplicates()
+    output_df = pd.read_csv(output_filepath, low_memory=False)
+    reference_df = pd.read_csv(reference_filepath, low_memory=False)
+    return compare_frames(output_df, reference_df, columns)
+
+
+@instrumented
+def compare_frames(output_df, reference_df, columns=None):
+    """
+    Compare an output DataFrame with a reference DataFrame, as compare_tables does for CSV files.
+    Neither DataFrame is modified.
+
+    :param output_df: The output DataFrame, e.g. as returned by formatted_for_output.
+    :param reference_df: The reference DataFrame.
+    :param columns: Optional list of columns to compare.
+
+    :return: A tuple containing the comparison message, DataFrames, and comparison results.
+    """
+    output_df = output_df.drop_duplicates()
+    reference_df = reference_df.drop_duplicates()
     if columns is not None:
         output_df = output_df[columns]
         reference_df = reference_df[columns]
@@ -445,6 +641,174 @@ def compare_rows_to_df(row_extra, row_missing, columns):
     return transposed_df
 
 
+def _numeric_values(series):
+    """
+    Return the values of a Series as a float array if they are all numeric (or missing), otherwise None.
+    """
+    if pd.api.types.is_numeric_dtype(series):
+        return series.to_numpy(dtype=float)
+    converted = pd.to_numeric(series.astype(str).str.strip().replace({"nan": None, "": None}), errors="coerce")
+    if converted.notna().sum() != series.astype(str).str.strip().replace({"nan": None, "": None}).notna().sum():
+        return None
+    return converted.to_numpy(dtype=float)
+
+
+def _values_differ(output_values, reference_values, tolerance):
+    """
+    Compare two aligned Series element-wise, numerically within a tolerance where both are numeric,
+    and as stripped strings otherwise.
+
+    :return: Boolean array, True where the values differ.
+    """
+    output_numeric = _numeric_values(output_values)
+    reference_numeric = _numeric_values(reference_values)
+    if output_numeric is not None and reference_numeric is not None:
+        return ~np.isclose(output_numeric, reference_numeric, rtol=0, atol=tolerance, equal_nan=True)
+    return (output_values.astype(str).str.strip().to_numpy() != reference_values.astype(str).str.strip().to_numpy())
+
+
+def _hash_occurrences(df, columns):
+    """
+    Hash the given columns of each row, and number repeated hashes so that duplicates pair up one-to-one.
+
+    :return: DataFrame with '_hash', '_occurrence' and '_position' (row position in df) columns.
+    """
+    hashes = pd.util.hash_pandas_object(df[columns], index=False).to_numpy()
+    occurrences = pd.Series(hashes).groupby(hashes).cumcount().to_numpy()
+    return pd.DataFrame({"_hash": hashes, "_occurrence": occurrences, "_position": np.arange(len(df))})
+
+
+def _pair_positions(output_df, reference_df, columns):
+    """
+    Pair rows of two DataFrames that hash equally over the given columns.
+
+    :return: Tuple of (paired output positions, paired reference positions,
+             unpaired output positions, unpaired reference positions).
+    """
+    merged = pd.merge(
+        _hash_occurrences(output_df, columns),
+        _hash_occurrences(reference_df, columns),
+        on=["_hash", "_occurrence"],
+        how="outer",
+        suffixes=("_output", "_reference"),
+        indicator=True,
+    )
+    both = merged[merged["_merge"] == "both"]
+    return (
+        both["_position_output"].to_numpy(dtype=int),
+        both["_position_reference"].to_numpy(dtype=int),
+        merged.loc[merged["_merge"] == "left_only", "_position_output"].to_numpy(dtype=int),
+        merged.loc[merged["_merge"] == "right_only", "_position_reference"].to_numpy(dtype=int),
+    )
+
+
+def keyed_diff(output_df, reference_df, key_columns, value_columns=None, tolerance=COMPARE_TOLERANCE):
+    """
+    Compare two DataFrames by hashing each row's key columns and value columns separately.
+
+    Rows that hash identically on both sides are matched first. The remaining rows are paired by key
+    (duplicated keys pair up in sorted order), and each pair is compared column by column: numerically within
+    the tolerance where both values are numeric, and as stripped strings otherwise. Pairs that agree within the
+    tolerance count as correct. Unpaired rows are reported as missing (reference only) or extra (output only).
+
+    :param output_df: The newly generated DataFrame.
+    :param reference_df: The reference DataFrame.
+    :param key_columns: Columns identifying a row, e.g. SCHEMA_KEY_COLUMNS or COMBINED_DF_KEY_COLUMNS.
+    :param value_columns: Columns to compare. Defaults to all shared columns that are not key columns.
+    :param tolerance: Absolute tolerance for numeric comparisons.
+    :return: A tuple of (message, changed_rows, missing_rows, extra_rows, column_change_counts).
+             changed_rows has the key columns, '<column>_output' and '<column>_reference' for each value column,
+             and 'ChangedColumns'. column_change_counts is a Series counting the changed rows per value column.
+    """
+    if value_columns is None:
+        value_columns = [c for c in output_df.columns if c in reference_df.columns and c not in key_columns]
+    columns = key_columns + value_columns
+    output_df = output_df[columns].drop_duplicates().copy()
+    reference_df = reference_df[columns].drop_duplicates().copy()
+    # Keys are compared as stripped strings; sorting makes the pairing of duplicated keys deterministic
+    for df in (output_df, reference_df):
+        for column in key_columns:
+            df[column] = df[column].astype(str).str.strip()
+    output_df = output_df.sort_values(by=columns).reset_index(drop=True)
+    reference_df = reference_df.sort_values(by=columns).reset_index(drop=True)
+
+    # Exact matches on all columns
+    _, _, output_left, reference_left = _pair_positions(output_df, reference_df, columns)
+    output_rest = output_df.iloc[output_left].reset_index(drop=True)
+    reference_rest = reference_df.iloc[reference_left].reset_index(drop=True)
+    # Pair the remaining rows by key
+    paired_output, paired_reference, extra_positions, missing_positions = _pair_positions(
+        output_rest, reference_rest, key_columns
+    )
+    output_pairs = output_rest.iloc[paired_output].reset_index(drop=True)
+    reference_pairs = reference_rest.iloc[paired_reference].reset_index(drop=True)
+    differ = pd.DataFrame(
+        {column: _values_differ(output_pairs[column], reference_pairs[column], tolerance) for column in value_columns},
+        index=output_pairs.index,
+        dtype=bool,
+    )
+    changed = differ.any(axis=1).to_numpy()
+    changed_rows = output_pairs.loc[changed, key_columns].copy()
+    for column in value_columns:
+        changed_rows[f"{column}_output"] = output_pairs.loc[changed, column]
+        changed_rows[f"{column}_reference"] = reference_pairs.loc[changed, column]
+    changed_rows["ChangedColumns"] = [
+        ";".join(differ.columns[row]) for row in differ[changed].to_numpy()
+    ]
+    changed_rows = changed_rows.reset_index(drop=True)
+    column_change_counts = differ[changed].sum()
+    column_change_counts = column_change_counts[column_change_counts > 0].sort_values(ascending=False)
+    missing_rows = reference_rest.iloc[missing_positions].reset_index(drop=True)
+    extra_rows = output_rest.iloc[extra_positions].reset_index(drop=True)
+
+    correct = len(output_df) - len(output_rest) + int((~changed).sum())
+    differences = [
+        f"Number of correct rows: {correct}",
+        f"Number of changed rows: {len(changed_rows)}",
+        f"Number of missing rows: {len(missing_rows)}",
+        f"Number of extra rows: {len(extra_rows)}",
+    ]
+    if not column_change_counts.empty:
+        differences.append("\nChanged rows per column:\n" + column_change_counts.to_string())
+    return "\n".join(differences), changed_rows, missing_rows, extra_rows, column_change_counts
+
+
+@instrumented
+def compare_tables_keyed(output_filepath, reference_filepath, key_columns, value_columns=None,
+                         tolerance=COMPARE_TOLERANCE, reference_renames=None):
+    """
+    Read the output and reference CSV files and compare them with keyed_diff.
+    Report differences in columns and rows.
+
+    :param output_filepath: Path to the output CSV file.
+    :param reference_filepath: Path to the reference CSV file.
+    :param key_columns: Columns identifying a row.
+    :param value_columns: Columns to compare. Defaults to all shared columns that are not key columns.
+    :param tolerance: Absolute tolerance for numeric comparisons.
+    :param reference_renames: Optional mapping of reference column names to output column names.
+    :return: A tuple of (message, changed_rows, missing_rows, extra_rows, column_change_counts).
+    """
+    output_df = pd.read_csv(output_filepath, low_memory=False)
+    reference_df = pd.read_csv(reference_filepath, low_memory=False)
+    if reference_renames:
+        reference_df = reference_df.rename(columns=reference_renames)
+    differences = []
+    missing_columns = set(reference_df.columns) - set(output_df.columns)
+    extra_columns = set(output_df.columns) - set(reference_df.columns)
+    if missing_columns:
+        differences.append(f"Missing columns: {', '.join(missing_columns)}")
+    if extra_columns:
+        differences.append(f"Extra columns: {', '.join(extra_columns)}")
+    missing_key_columns = [c for c in key_columns if c in missing_columns or c in extra_columns]
+    if missing_key_columns:
+        raise ValueError(f"Key columns not present in both tables: {', '.join(missing_key_columns)}")
+    message, changed_rows, missing_rows, extra_rows, column_change_counts = keyed_diff(
+        output_df, reference_df, key_columns, value_columns, tolerance
+    )
+    differences.append(message)
+    return "\n".join(differences), changed_rows, missing_rows, extra_rows, column_change_counts
+
+
 def show_subset(df, column_value_dict):
     """
     Show a subset of the DataFrame where the specified columns match the specified values.
@@ -460,11 +824,28 @@ def show_subset(df, column_value_dict):
     return df.query(query)
 
 
-def save(df, path):
+def formatted_for_output(df, as_text=False):
+    """
+    Return a copy of a combined DataFrame with Period and Value formatted as they are written by save.
+
+    :param df: The combined DataFrame.
+    :param as_text: If True, Value holds the strings written to the file. Otherwise it holds those strings
+                    parsed back to floats, as if the file had been read with pd.read_csv.
+    """
     _df = df.copy()
     _df['Period'] = _df['Period'].astype(int)
     _df['Value'] = _df['Value'].apply(lambda x: f"{x:.6f}")
+    if not as_text:
+        _df['Value'] = _df['Value'].astype(float)
+    return _df
+
+
+def save(df, path, manifest=False):
+    _df = formatted_for_output(df, as_text=True)
     _df.to_csv(path, index=False, quoting=csv.QUOTE_ALL)
+    if manifest:
+        # Fingerprint the values as written, for fast regression checks against the reference
+        write_manifest(_df, path)
 
 
 # Function to find missing periods and create the necessary rows (curried for convenience)
@@ -0,0 +1,300 @@
+"""
+Incremental recomputation of the outputs when a new model run, or an edit to the Items Lists, changes only part
+of the inputs.
+
+Successive TIMES runs often change only some processes or periods. The flow tracing that allocates the negative
+emissions and renewable fuels to end-use processes works within one (Scenario, Period) partition of raw_df, and
+so do the schema join and the splitting of multiple-output processes. So, given the previous raw_df and outputs:
+
+* raw_df_changes finds the (Scenario, Attribute, Commodity, Process, Period) rows that were added, removed or
+  changed.
+* For each allocation, affected_partitions keeps the partitions where a source row (e.g. a biodiesel production
+  row) changed, or where a changed flow is read when tracing from a source through the flow graph. Only those
+  partitions are traced again; the allocated rows of the others are reused.
+* The combined DataFrame is rebuilt for the changed partitions only, and the categories of the complete DataFrame
+  touching them are completed again and patched into the previous complete DataFrame.
+
+Similarly, when an Items List or base.dd changes, e.g. after editing a process description and fetching the Items
+Lists again, incremental_apply_schema_rulesets compares the new rulesets with the previous ones. The rows matched
+by the conditions of added, removed or changed rules are found through a RuleKeyIndex and go through all the
+rulesets again, in order; the rows derived from the other rows are reused.
+
+The patched outputs are the same as those of a full run. The incremental_* functions are used by the stage graph
+(stage_graph.py --incremental), which passes them the previous output of the stage and of its dependencies.
+
+See the README for the overall workflow.
+"""
+
+import logging
+import numpy as np
+import pandas as pd
+
+from constants import *
+from pipeline import *
+from trace_cache import flow_closure
+
+RAW_DF_KEY_COLUMNS = ['Scenario', 'Attribute', 'Commodity', 'Process', 'Period']
+
+# Processes whose outputs an allocation reads besides those reached by tracing: the jet fuel split in
+# allocate_renewable_fuel
+TRACE_EXTRA_PROCESSES = {"DIJ": ["T_O_FuelJet", "T_O_FuelJet_Int"]}
+
+
+def raw_df_changes(previous_raw_df, raw_df):
+    """
+    Return the key columns of the raw_df rows that were added, removed or whose Value changed.
+    """
+    merged = pd.merge(previous_raw_df[RAW_DF_KEY_COLUMNS + ['Value']], raw_df[RAW_DF_KEY_COLUMNS + ['Value']],
+                      on=RAW_DF_KEY_COLUMNS, how='outer', suffixes=('_previous', ''), indicator=True)
+    changed = (merged['_merge'] != 'both') | (merged['Value_previous'] != merged['Value'])
+    return merged.loc[changed, RAW_DF_KEY_COLUMNS].reset_index(drop=True)
+
+
+def changed_partitions(changes):
+    """
+    Return the set of (Scenario, Period) partitions with changes.
+    """
+    return set(changes[PARTITION_COLUMNS].itertuples(index=False, name=None))
+
+
+def in_partitions(df, partitions):
+    """
+    Return a boolean mask of the rows of df in the given (Scenario, Period) partitions.
+    """
+    if df.empty or not partitions:
+        return np.zeros(len(df), dtype=bool)
+    return pd.MultiIndex.from_frame(df[PARTITION_COLUMNS]).isin(list(partitions))
+
+
+def _flow_graphs(raw_df, partitions):
+    # For each partition, the output commodities of each process and the processes consuming each commodity,
+    # as read by trace_commodities
+    df = raw_df[in_partitions(raw_df, partitions)]
+    graphs = {partition: ({}, {}) for partition in partitions}
+    outputs = df[(df['Attribute'] == 'VAR_FOut') & ~(df['Commodity'].str.contains('CO2'))]
+    for scenario, period, process, commodity in outputs[['Scenario', 'Period', 'Process', 'Commodity']].itertuples(index=False, name=None):
+        graphs[(scenario, period)][0].setdefault(process, set()).add(commodity)
+    inputs = df[df['Attribute'] == 'VAR_FIn']
+    for scenario, period, process, commodity in inputs[['Scenario', 'Period', 'Process', 'Commodity']].itertuples(index=False, name=None):
+        graphs[(scenario, period)][1].setdefault(commodity, set()).add(process)
+    return graphs
+
+
+def affected_partitions(previous_raw_df, raw_df, changes, sources, extra_processes=()):
+    """
+    Find the (Scenario, Period) partitions whose allocation may differ between two model runs: those where a
+    source row of the allocation changed, or where a changed flow is read when tracing from one of the sources
+    in either run.
+
+    :param previous_raw_df: The raw_df of the previous run.
+    :param raw_df: The raw_df of the new run.
+    :param changes: The changed rows, as returned by raw_df_changes.
+    :param sources: Function returning the source rows of the allocation in a raw_df, e.g. negative_emission_rows.
+    :param extra_processes: Processes whose outputs the allocation reads besides the traced ones.
+    :return: A set of (Scenario, Period) tuples.
+    """
+    changed_keys = set(changes.itertuples(index=False, name=None))
+    changes_by_partition = {}
+    for scenario, attribute, commodity, process, period in changed_keys:
+        changes_by_partition.setdefault((scenario, period), []).append((attribute, commodity, process))
+
+    affected = set()
+    source_dfs = [(previous_raw_df, sources(previous_raw_df)), (raw_df, sources(raw_df))]
+    for _, source_df in source_dfs:
+        source_keys = set(source_df[RAW_DF_KEY_COLUMNS].itertuples(index=False, name=None))
+        affected |= {(key[0], key[4]) for key in changed_keys & source_keys}
+
+    for df, source_df in source_dfs:
+        remaining = set(changes_by_partition) - affected
+        source_df = source_df[in_partitions(source_df, remaining)]
+        if source_df.empty:
+            continue
+        graphs = _flow_graphs(df, remaining)
+        for scenario, process, period in source_df[['Scenario', 'Process', 'Period']].itertuples(index=False, name=None):
+            if (scenario, period) in affected:
+                continue
+            processes, commodities = flow_closure(graphs[(scenario, period)], process)
+            processes |= set(extra_processes)
+            if any((attribute == 'VAR_FOut' and changed_process in processes) or
+                   (attribute == 'VAR_FIn' and changed_commodity in commodities)
+                   for attribute, changed_commodity, changed_process in changes_by_partition[(scenario, period)]):
+                affected.add((scenario, period))
+    return affected
+
+
+def patch_partitions(previous_rows, rows, partitions):
+    """
+    Replace the rows of the given partitions in previous_rows with rows.
+    """
+    if previous_rows.empty:
+        return rows
+    kept_rows = previous_rows[~in_partitions(previous_rows, partitions)]
+    return kept_rows if rows.empty else pd.concat([kept_rows, rows])
+
+
+def _reallocate(previous_rows, raw_df, partitions, sources, allocate_function):
+    # Allocate the sources in the affected partitions again, reusing the previous rows elsewhere
+    if not partitions:
+        return previous_rows
+    raw_df = raw_df[in_partitions(raw_df, partitions)]
+    rows = allocate_function(raw_df) if not sources(raw_df).empty else pd.DataFrame()
+    return patch_partitions(previous_rows, rows, partitions)
+
+
+def incremental_allocate_emissions(ctx, previous, previous_dependencies, raw_df):
+    """
+    Update the previous output of allocate_emissions for a new raw_df, tracing only the affected partitions.
+
+    :param previous: The previous output of allocate_emissions.
+    :param previous_dependencies: List of the previous raw_df and rulesets.
+    """
+    previous_raw_df = previous_dependencies[0]
+    partitions = affected_partitions(previous_raw_df, raw_df, raw_df_changes(previous_raw_df, raw_df), negative_emission_rows)
+    logging.info("Negative emissions: allocating %d affected partitions again: %s", len(partitions), sorted(partitions))
+    rows_to_add = _reallocate(previous[0], raw_df, partitions, negative_emission_rows,
+                              lambda df: allocate_emissions(ctx, df)[0])
+    return rows_to_add, negative_emission_rows(raw_df)
+
+
+def incremental_allocate_renewable_fuel(ctx, previous, previous_dependencies, raw_df, commodity):
+    """
+    Update the previous output of allocate_renewable_fuel for a new raw_df, tracing only the affected partitions.
+
+    :param previous: The previous output of allocate_renewable_fuel for the commodity.
+    :param previous_dependencies: List of the previous raw_df and rulesets.
+    """
+    previous_raw_df = previous_dependencies[0]
+
+    def sources(df):
+        return production_rows(df, commodity)
+
+    partitions = affected_partitions(previous_raw_df, raw_df, raw_df_changes(previous_raw_df, raw_df), sources,
+                                     TRACE_EXTRA_PROCESSES.get(commodity, ()))
+    logging.info("%s: allocating %d affected partitions again: %s", commodity, len(partitions), sorted(partitions))
+    rows_to_add = _reallocate(previous[0], raw_df, partitions, sources,
+                              lambda df: allocate_renewable_fuel(ctx, df, commodity)[0])
+    return rows_to_add, production_rows(raw_df, commodity)
+
+
+def incremental_combine(ctx, previous, previous_dependencies, raw_df, schema_df, schema_technology, allocations):
+    """
+    Update the previous output of combine for a new raw_df and allocations, joining only the changed partitions.
+
+    :param previous: The previous combined DataFrame.
+    :param previous_dependencies: List of the previous raw_df, schema_df, schema_technology, allocations and rulesets.
+    """
+    partitions = changed_partitions(raw_df_changes(previous_dependencies[0], raw_df))
+    logging.info("Combining %d changed partitions again: %s", len(partitions), sorted(partitions))
+    if not partitions:
+        return previous
+    partition_allocations = {
+        'rows_to_drop': allocations['rows_to_drop'][in_partitions(allocations['rows_to_drop'], partitions)],
+        'rows_to_add': allocations['rows_to_add'][in_partitions(allocations['rows_to_add'], partitions)],
+    }
+    combined_df = combine(ctx, raw_df[in_partitions(raw_df, partitions)], schema_df, schema_technology, partition_allocations)
+    return pd.concat([previous[~in_partitions(previous, partitions)], combined_df], ignore_index=True)
+
+
+def output_categories(df):
+    """
+    Return the categories of the complete DataFrame that rows of a combined DataFrame end up in, in the same order.
+    """
+    categories = [x for x in GROUP_COLUMNS if x != 'Period']
+    return apply_rules(df[categories].reset_index(drop=True), THOUSAND_VEHICLE_RULES, 'THOUSAND_VEHICLE_RULES')
+
+
+def incremental_complete(ctx, previous, previous_dependencies, raw_df, combined_df, allocations):
+    """
+    Update the previous output of complete, completing again only the categories with rows in changed partitions.
+
+    :param previous: The previous complete DataFrame.
+    :param previous_dependencies: List of the previous raw_df, combined DataFrame, allocations and rulesets.
+    """
+    previous_raw_df, previous_combined_df = previous_dependencies[:2]
+    all_periods = np.sort(combined_df['Period'].unique())
+    if not np.array_equal(all_periods, np.sort(previous_combined_df['Period'].unique())):
+        logging.info("The periods have changed: completing all categories")
+        return complete(ctx, raw_df, combined_df, allocations)
+
+    partitions = changed_partitions(raw_df_changes(previous_raw_df, raw_df))
+    complete_df = previous
+    if partitions:
+        changed_rows = pd.concat([previous_combined_df[in_partitions(previous_combined_df, partitions)],
+                                  combined_df[in_partitions(combined_df, partitions)]])
+        affected = pd.MultiIndex.from_frame(output_categories(changed_rows).drop_duplicates())
+        logging.info("Completing %d categories with rows in changed partitions again", len(affected))
+        selected = combined_df[pd.MultiIndex.from_frame(output_categories(combined_df)).isin(affected)]
+        kept = previous[~pd.MultiIndex.from_frame(previous[affected.names]).isin(affected)]
+        completed = [complete_periods(selected, all_periods)] if not selected.empty else []
+        complete_df = pd.concat([kept] + completed).sort_values(by=GROUP_COLUMNS)
+    check_complete_df(ctx, raw_df, complete_df, allocations['rows_to_drop'], allocations['productions'])
+    return complete_df
+
+
+#### SCHEMA RULES ####
+
+def _modified_columns(rulesets):
+    # Columns set by the inplace and newrow rules of the rulesets
+    return {column for _, ruleset in rulesets for _, rule_type, actions in ruleset if rule_type != "drop" for column in actions}
+
+
+def affected_source_rows(main_df, previous_rulesets, rulesets):
+    """
+    Find the rows whose derived schema rows may differ between two versions of the rulesets: those matched by
+    the condition of a rule that was added, removed or changed, found through a RuleKeyIndex of main_df.
+
+    :param main_df: The rows the rulesets are applied to, as returned by prepare_schema_rows.
+    :param previous_rulesets: The previous rulesets, as (name, rules) tuples in order.
+    :param rulesets: The new rulesets, as (name, rules) tuples in order.
+    :return: A sorted list of positions in main_df, or None if the changes cannot be located by their conditions.
+    """
+    if [name for name, _ in previous_rulesets] != [name for name, _ in rulesets]:
+        logging.info("The rulesets have been added, removed or reordered")
+        return None
+    index = RuleKeyIndex(main_df)
+    affected = set()
+    for position, ((name, previous_rules), (_, rules)) in enumerate(zip(previous_rulesets, rulesets)):
+        changed, reordered = changed_rule_conditions(previous_rules, rules)
+        if not changed:
+            continue
+        if reordered:
+            logging.info("Ruleset %s: the unchanged rules are applied in a different order", name)
+            return None
+        # The matched rows are found from the values in main_df, so the conditions must not test columns set
+        # by an earlier ruleset
+        modified_columns = _modified_columns(previous_rulesets[:position] + rulesets[:position])
+        matched = set()
+        for condition, rule_types in changed:
+            for rule_type in rule_types:
+                if modified_columns & set(rule_condition_keys(condition, rule_type)):
+                    logging.info("Ruleset %s: a changed rule tests a column set by an earlier ruleset: %s", name, condition)
+                    return None
+                matched.update(index.rows(condition, rule_type))
+        logging.info("Ruleset %s: %d changed conditions matching %d rows", name, len(changed), len(matched))
+        affected |= matched
+    # apply_rules sets values by index label, so the first ruleset also sets the rows sharing a label with a
+    # matched row; derive those again too
+    labels = main_df.index[sorted(affected)]
+    return np.flatnonzero(main_df.index.isin(labels)).tolist()
+
+
+def incremental_apply_schema_rulesets(ctx, previous, previous_dependencies, main_df):
+    """
+    Update the previous output of apply_schema_rulesets for new rulesets, deriving again only the rows matched
+    by added, removed or changed rules. Those rows go through every ruleset in order, as in a full run.
+
+    :param previous: The previous output of apply_schema_rulesets.
+    :param previous_dependencies: List of the previous schema rows and rulesets.
+    """
+    previous_rulesets = ordered_rulesets(previous_dependencies[1])
+    rulesets = ctx.schema_rulesets
+    positions = affected_source_rows(main_df, previous_rulesets, rulesets)
+    if positions is None:
+        return apply_schema_rulesets(ctx, main_df)
+    logging.info("Deriving %d of %d schema rows again", len(positions), len(main_df))
+    if not positions:
+        return previous
+    rows = main_df.iloc[positions].copy()
+    rows['SourceRow'] = positions
+    rows = apply_rulesets(rows, rulesets)
+    return pd.concat([previous[~previous['SourceRow'].isin(positions)], rows], ignore_index=True)
@@ -0,0 +1,319 @@
+"""
+Instrumentation of the pipeline stages, ruleset applications and table comparisons.
+
+While a trace is active, each instrumented call records a span with its wall time, its CPU time, the increase of
+the peak resident set size (RSS) of the process while it ran, and the number of rows of its input and output
+DataFrames. The peak RSS never decreases, so a call whose memory peaks below that of an earlier call has an RSS
+delta of about 0. A trace started with memory=True also records the peak memory of each call: the peak of the memory
+allocated (as traced by tracemalloc) while the call ran, above that allocated when it started. tracemalloc slows the
+calls down, so it is off by default. Spans nest: a ruleset applied by a stage is recorded as a child of that stage. At the end of the run,
+the spans are written as a JSON trace in TRACE_DIR, and a summary table is logged.
+
+Tracing is off unless a script enables it, e.g. with --trace. An instrumented call then only checks that no trace
+is active before calling the function, so the overhead is negligible.
+
+The active trace is held in a context variable, so concurrent runs in different threads record separate traces.
+Spans recorded in worker processes are not seen by the main process: stage_graph.py records each stage in its own
+trace and merges it into the trace of the run, but the shards of apply_rulesets_sharded are only recorded as a
+whole. The peak RSS is that of the whole process, so the RSS delta of stages running in a thread pool overlap.
+
+Usage (e.g. in a script):
+with tracing(trace_filepath("generate_schema"), enabled=write_trace):
+    ...
+
+See the README for the overall workflow.
+"""
+
+import contextvars
+import functools
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+import pandas as pd
+
+from constants import *
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+_ACTIVE_TRACE = contextvars.ContextVar("active_trace", default=None)
+
+
+def peak_rss():
+    """
+    Return the peak resident set size of the process in bytes, or None if it cannot be measured.
+    On Windows, this requires psutil.
+    """
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+        return peak if sys.platform == "darwin" else peak * 1024
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return getattr(psutil.Process().memory_info(), "peak_wset", None)
+
+
+def row_count(value):
+    """
+    Return the number of rows of a DataFrame or Series, or the total over the DataFrames in a tuple, list or
+    dictionary. Return None if the value holds no DataFrame.
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (tuple, list)):
+        counts = [len(item) for item in value if isinstance(item, (pd.DataFrame, pd.Series))]
+        return sum(counts) if counts else None
+    return None
+
+
+@dataclass
+class Span:
+    """
+    One instrumented call. The RSS delta is the increase of the peak RSS of the process while the call ran, and the
+    peak memory the peak of the traced memory while the call ran above that when it started (if memory is traced).
+    """
+    id: int
+    parent: int = None
+    depth: int = 0
+    name: str = ""
+    started: float = 0.0
+    wall_seconds: float = None
+    cpu_seconds: float = None
+    peak_rss_delta: int = None
+    peak_memory: int = None
+    rows_in: int = None
+    rows_out: int = None
+    error: str = None
+
+
+class Trace:
+    """
+    The spans recorded during a run, in the order in which they started.
+    """
+
+    def __init__(self, label="run", memory=False):
+        """
+        :param label: Label of the trace.
+        :param memory: If True, record the peak memory of each span; tracemalloc must be tracing.
+        """
+        self.label = label
+        self.memory = memory
+        self.started = time.time()
+        self.spans = []
+        self._open = []
+        self._starts = {}
+        # Traced memory when each open span started and its peak so far, by span id (None for the whole trace)
+        self._memory = {}
+        self.peak_memory = None
+        if memory:
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            self._memory[None] = [current, current]
+
+    def _update_peaks(self):
+        # tracemalloc keeps a single peak, which is reset when a span starts or finishes: fold it into the peaks of
+        # all open spans first, so that the peak of a span includes those of the spans nested in it
+        _, peak = tracemalloc.get_traced_memory()
+        for memory in self._memory.values():
+            memory[1] = max(memory[1], peak)
+        tracemalloc.reset_peak()
+
+    def start(self, name, rows_in=None):
+        """
+        Open a span, as a child of the innermost open span.
+        """
+        parent = self._open[-1] if self._open else None
+        span = Span(id=len(self.spans), parent=parent.id if parent else None, depth=len(self._open),
+                    name=name, started=time.time() - self.started, rows_in=rows_in)
+        self.spans.append(span)
+        self._open.append(span)
+        if self.memory:
+            self._update_peaks()
+            current, _ = tracemalloc.get_traced_memory()
+            self._memory[span.id] = [current, current]
+        self._starts[span.id] = (time.perf_counter(), time.process_time(), peak_rss())
+        return span
+
+    def finish(self, span, error=None):
+        """
+        Close a span, recording the resources used since it was opened.
+        """
+        wall, cpu, rss = self._starts.pop(span.id)
+        span.wall_seconds = time.perf_counter() - wall
+        span.cpu_seconds = time.process_time() - cpu
+        end_rss = peak_rss()
+        span.peak_rss_delta = end_rss - rss if rss is not None and end_rss is not None else None
+        if self.memory:
+            self._update_peaks()
+            start, peak = self._memory.pop(span.id)
+            span.peak_memory = peak - start
+        if error is not None:
+            span.error = type(error).__name__
+        self._open.remove(span)
+
+    def merge(self, spans, started):
+        """
+        Add the spans of a trace recorded elsewhere, e.g. in a worker process, under the innermost open span.
+
+        :param spans: The spans of the other trace.
+        :param started: The start time of the other trace, as returned by time.time().
+        """
+        offset, parent = len(self.spans), self._open[-1] if self._open else None
+        for span in spans:
+            self.spans.append(Span(**dict(
+                asdict(span),
+                id=span.id + offset,
+                parent=span.parent + offset if span.parent is not None else (parent.id if parent else None),
+                depth=span.depth + len(self._open),
+                started=span.started + started - self.started,
+            )))
+
+    def close(self):
+        """
+        Record the peak memory of the whole trace, if memory is traced.
+        """
+        if self.memory:
+            self._update_peaks()
+            start, peak = self._memory.pop(None)
+            self.peak_memory = peak - start
+
+    def to_dict(self):
+        return {
+            "label": self.label,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "argv": sys.argv,
+            "peak_memory": self.peak_memory,
+            "spans": [asdict(span) for span in self.spans],
+        }
+
+    def write(self, path):
+        """
+        Write the trace as JSON.
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as file:
+            json.dump(self.to_dict(), file, indent=1)
+        logging.info("Trace written to %s", path)
+
+    def summary(self):
+        """
+        Return a table of the spans, indented by nesting depth, with their time, RSS delta, peak memory (if traced)
+        and row counts.
+        """
+        def cell(value, width, format_spec=""):
+            return f"{value:>{width}{format_spec}}" if value is not None else f"{'-':>{width}}"
+
+        lines = [f"{'Span':<50} {'Wall (s)':>9} {'CPU (s)':>9} {'RSS (MiB)':>10} {'Peak (MiB)':>11} "
+                 f"{'Rows in':>10} {'Rows out':>10}"]
+        for span in self.spans:
+            rss = span.peak_rss_delta / 2**20 if span.peak_rss_delta is not None else None
+            peak = span.peak_memory / 2**20 if span.peak_memory is not None else None
+            lines.append(
+                f"{'  ' * span.depth + span.name:<50} {cell(span.wall_seconds, 9, '.2f')} {cell(span.cpu_seconds, 9, '.2f')} "
+                f"{cell(rss, 10, '.1f')} {cell(peak, 11, '.1f')} {cell(span.rows_in, 10)} {cell(span.rows_out, 10)}"
+                + (f" ({span.error})" if span.error else "")
+            )
+        return "\n".join(lines)
+
+
+def active_trace():
+    """
+    Return the active Trace, or None if tracing is off.
+    """
+    return _ACTIVE_TRACE.get()
+
+
+def trace_filepath(label):
+    """
+    Return the path of the JSON trace of a run of a script, from the script name and the time.
+    """
+    return os.path.join(TRACE_DIR, f"{label}_{time.strftime('%Y%m%d_%H%M%S')}.json")
+
+
+@contextmanager
+def tracing(path=None, enabled=True, label=None, memory=False):
+    """
+    Activate a new trace for the duration of the block. On exit, write it to path (if given) and log its summary.
+
+    :param path: Path of the JSON trace, e.g. from trace_filepath.
+    :param enabled: If False, nothing is traced and None is yielded.
+    :param label: Label of the trace; defaults to the file name of the path.
+    :param memory: If True, also record the peak memory of each span, tracing the allocations with tracemalloc for
+                   the duration of the block (if it is not tracing already).
+    """
+    if not enabled:
+        yield None
+        return
+    started_tracemalloc = memory and not tracemalloc.is_tracing()
+    if started_tracemalloc:
+        tracemalloc.start()
+    trace = Trace(label or (os.path.splitext(os.path.basename(path))[0] if path else "run"), memory=memory)
+    token = _ACTIVE_TRACE.set(trace)
+    try:
+        yield trace
+    finally:
+        _ACTIVE_TRACE.reset(token)
+        trace.close()
+        if started_tracemalloc:
+            tracemalloc.stop()
+        if path is not None:
+            trace.write(path)
+            logging.info("Trace summary:\n%s", trace.summary())
+
+
+@contextmanager
+def span(name, rows_in=None):
+    """
+    Record the block as a span of the active trace, if any. Yields the Span, or None if tracing is off, so that
+    the block can set its rows_out.
+    """
+    trace = _ACTIVE_TRACE.get()
+    if trace is None:
+        yield None
+        return
+    record = trace.start(name, rows_in)
+    try:
+        yield record
+    except BaseException as error:
+        trace.finish(record, error)
+        raise
+    trace.finish(record)
+
+
+def instrumented(function=None, name=None):
+    """
+    Decorate a function so that each call is recorded as a span of the active trace, if any. The rows in are
+    counted over the DataFrame arguments, and the rows out over the returned DataFrames.
+
+    :param name: Name of the spans; defaults to the function name.
+    """
+    if function is None:
+        return functools.partial(instrumented, name=name)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        trace = _ACTIVE_TRACE.get()
+        if trace is None:
+            return function(*args, **kwargs)
+        record = trace.start(name or function.__name__, row_count(list(args) + list(kwargs.values())))
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as error:
+            trace.finish(record, error)
+            raise
+        record.rows_out = row_count(result)
+        trace.finish(record)
+        return result
+
+    return wrapper
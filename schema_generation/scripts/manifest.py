@@ -0,0 +1,222 @@
+"""
+Fingerprint manifests for output tables, for fast output-vs-reference regression checks.
+
+When a table is written, a manifest is saved alongside it (`<name>.manifest.json`). The manifest records the
+row count, an order-independent content hash, and a hash for each partition, e.g. by Scenario, Parameters and
+Sector. The content hash is the wrapping sum of per-row hashes over the distinct rows. It does not depend on row
+order, and it is computed from the values as written to the CSV file, except for the MANIFEST_VALUE_COLUMNS: these
+are parsed as numbers and formatted with MANIFEST_VALUE_DECIMALS decimals, so that a reference written by R (e.g.
+0.0446086 and 0) fingerprints like our output (0.044609 and 0.000000). A manifest rebuilt from the file therefore
+matches the one written with it.
+
+compare_with_manifests checks the two manifests first. If they match, the tables are identical and no data is
+read. Otherwise, only the partitions whose hashes differ are compared in detail with keyed_diff. A file without an
+up-to-date manifest (e.g. a reference table) has its manifest rebuilt and cached in MANIFEST_CACHE_DIR, never next
+to the file. A manifest records the column renames and partition columns it was built with, and is rebuilt when
+they differ from those requested.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import numpy as np
+import pandas as pd
+
+from constants import *
+
+# Version of the way manifests are computed; manifests of another version are rebuilt
+MANIFEST_FORMAT = 2
+
+
+def manifest_path(csv_path):
+    """
+    Return the path of the manifest for a CSV file.
+    """
+    return os.path.splitext(csv_path)[0] + ".manifest.json"
+
+
+def cached_manifest_path(csv_path):
+    """
+    Return the path of the manifest for a CSV file in MANIFEST_CACHE_DIR.
+    """
+    digest = hashlib.sha256(os.path.abspath(csv_path).encode("utf-8")).hexdigest()[:12]
+    name = os.path.splitext(os.path.basename(csv_path))[0]
+    return os.path.join(MANIFEST_CACHE_DIR, f"{name}_{digest}.manifest.json")
+
+
+def _formatted_values(column):
+    # Numbers formatted with a fixed number of decimals; rounding first turns -0.0000001 into 0.000000, not -0.000000
+    values = pd.to_numeric(column, errors="coerce").round(MANIFEST_VALUE_DECIMALS) + 0.0
+    return values.map(lambda value: f"{value:.{MANIFEST_VALUE_DECIMALS}f}" if pd.notna(value) else "")
+
+
+def _row_hashes(df):
+    """
+    Hash each row of a DataFrame from its values as strings, as they appear in the CSV file, and the
+    MANIFEST_VALUE_COLUMNS as numbers with MANIFEST_VALUE_DECIMALS decimals.
+    Columns are hashed in sorted order so the column order does not matter.
+    """
+    _df = df[sorted(df.columns)].astype(object).where(df[sorted(df.columns)].notna(), "")
+    _df = _df.astype(str).apply(lambda column: column.str.strip())
+    for column in MANIFEST_VALUE_COLUMNS:
+        if column in _df.columns:
+            _df[column] = _formatted_values(_df[column]).to_numpy()
+    _df = _df.drop_duplicates()
+    return _df, pd.util.hash_pandas_object(_df, index=False).to_numpy(dtype=np.uint64)
+
+
+def _combine(hashes):
+    # Wrapping uint64 sum: independent of row order
+    return format(int(hashes.sum(dtype=np.uint64)), "016x")
+
+
+def _present(partition_columns, columns):
+    return [c for c in (partition_columns or MANIFEST_PARTITION_COLUMNS) if c in columns]
+
+
+def fingerprint_table(df, partition_columns=None):
+    """
+    Compute the manifest of a table.
+
+    :param df: The table, with values formatted as they are written to the CSV file.
+    :param partition_columns: Columns to fingerprint separately. Those not in the table are ignored.
+    :return: A dictionary with the columns, row count, content hash and per-partition hashes.
+    """
+    partition_columns = _present(partition_columns, df.columns)
+    _df, hashes = _row_hashes(df)
+    partitions = []
+    if partition_columns:
+        grouped = pd.Series(hashes, index=_df.index).groupby([_df[c] for c in partition_columns], sort=True)
+        for key, group_hashes in grouped:
+            key = key if isinstance(key, tuple) else (key,)
+            partitions.append({
+                "key": dict(zip(partition_columns, key)),
+                "row_count": int(len(group_hashes)),
+                "hash": _combine(group_hashes.to_numpy(dtype=np.uint64)),
+            })
+    return {
+        "format": MANIFEST_FORMAT,
+        "columns": sorted(df.columns),
+        "row_count": int(len(hashes)),
+        "content_hash": _combine(hashes),
+        "partition_columns": partition_columns,
+        "partitions": partitions,
+    }
+
+
+def write_manifest(df, csv_path, partition_columns=None, renames=None, path=None):
+    """
+    Write the manifest for a table that has just been written to csv_path.
+
+    :param df: The table, with values formatted as they were written to the CSV file.
+    :param csv_path: Path of the CSV file the table was written to.
+    :param partition_columns: Columns to fingerprint separately.
+    :param renames: The mapping of column names in the file to the names in df, if any, recorded in the manifest.
+    :param path: Path of the manifest; defaults to manifest_path(csv_path), next to the file.
+    :return: The manifest.
+    """
+    manifest = fingerprint_table(df, partition_columns)
+    manifest["renames"] = renames or {}
+    manifest["source_size"] = os.path.getsize(csv_path)
+    path = path or manifest_path(csv_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=1)
+    return manifest
+
+
+def _read_csv_as_written(csv_path, renames=None):
+    df = pd.read_csv(csv_path, dtype=str, keep_default_na=False, low_memory=False)
+    return df.rename(columns=renames) if renames else df
+
+
+def _load_manifest(path, csv_path, partition_columns, renames):
+    # The manifest at path, or None if it is missing, older than the CSV file, of another format, or built with other
+    # renames or partitions
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(csv_path):
+        return None
+    with open(path, "r", encoding="utf-8") as file:
+        manifest = json.load(file)
+    if (manifest.get("format") != MANIFEST_FORMAT
+            or manifest.get("source_size") != os.path.getsize(csv_path)
+            or manifest.get("renames", {}) != (renames or {})
+            or manifest["partition_columns"] != _present(partition_columns, manifest["columns"])):
+        return None
+    return manifest
+
+
+def load_or_build_manifest(csv_path, partition_columns=None, renames=None):
+    """
+    Load the manifest of a CSV file, written with it or cached, rebuilding it in MANIFEST_CACHE_DIR if it is
+    missing, out of date or built with other renames or partition columns.
+
+    :param csv_path: Path of the CSV file.
+    :param partition_columns: Columns to fingerprint separately.
+    :param renames: Optional mapping of column names in the file to the names used in the manifest.
+    :return: The manifest.
+    """
+    for path in (manifest_path(csv_path), cached_manifest_path(csv_path)):
+        manifest = _load_manifest(path, csv_path, partition_columns, renames)
+        if manifest is not None:
+            return manifest
+    logging.info("Building manifest for %s", csv_path)
+    return write_manifest(_read_csv_as_written(csv_path, renames), csv_path, partition_columns, renames,
+                          path=cached_manifest_path(csv_path))
+
+
+def _partition_keys(df, columns):
+    return pd.Series(list(zip(*[df[c].astype(object).where(df[c].notna(), "").astype(str).str.strip() for c in columns])))
+
+
+def differing_partitions(output_manifest, reference_manifest):
+    """
+    List the partition keys whose hashes differ between two manifests, or that appear in only one of them.
+    """
+    output_partitions = {tuple(sorted(p["key"].items())): p["hash"] for p in output_manifest["partitions"]}
+    reference_partitions = {tuple(sorted(p["key"].items())): p["hash"] for p in reference_manifest["partitions"]}
+    keys = set(output_partitions) | set(reference_partitions)
+    return [dict(key) for key in sorted(keys) if output_partitions.get(key) != reference_partitions.get(key)]
+
+
+def compare_with_manifests(output_filepath, reference_filepath, key_columns, partition_columns=None,
+                           tolerance=COMPARE_TOLERANCE, reference_renames=None):
+    """
+    Compare an output table with its reference using their manifests, running a keyed diff only on
+    the partitions whose hashes differ.
+
+    :param output_filepath: Path to the output CSV file.
+    :param reference_filepath: Path to the reference CSV file.
+    :param key_columns: Columns identifying a row, for the detailed diff.
+    :param partition_columns: Columns to fingerprint separately if a manifest has to be rebuilt.
+    :param tolerance: Absolute tolerance for numeric comparisons in the detailed diff.
+    :param reference_renames: Optional mapping of reference column names to output column names.
+    :return: A tuple of (message, diff), where diff is the keyed_diff result tuple for the differing
+             partitions, or None if the manifests match.
+    """
+    # Imported here because helpers imports this module to write manifests
+    from helpers import keyed_diff
+
+    output_manifest = load_or_build_manifest(output_filepath, partition_columns)
+    reference_manifest = load_or_build_manifest(reference_filepath, partition_columns, reference_renames)
+    if (output_manifest["columns"] == reference_manifest["columns"]
+            and output_manifest["row_count"] == reference_manifest["row_count"]
+            and output_manifest["content_hash"] == reference_manifest["content_hash"]):
+        return f"All good: manifests match ({output_manifest['row_count']} rows)", None
+
+    partitions = differing_partitions(output_manifest, reference_manifest)
+    output_df = pd.read_csv(output_filepath, low_memory=False)
+    reference_df = pd.read_csv(reference_filepath, low_memory=False)
+    if reference_renames:
+        reference_df = reference_df.rename(columns=reference_renames)
+    columns = output_manifest["partition_columns"]
+    if columns and columns == reference_manifest["partition_columns"]:
+        # Partition keys are recorded as the strings written to the CSV files
+        selected = {tuple(p[c] for c in columns) for p in partitions}
+        output_df = output_df[_partition_keys(output_df, columns).isin(selected).to_numpy()]
+        reference_df = reference_df[_partition_keys(reference_df, columns).isin(selected).to_numpy()]
+    total_partitions = len({tuple(sorted(p["key"].items()))
+                            for p in output_manifest["partitions"] + reference_manifest["partitions"]})
+    diff = keyed_diff(output_df, reference_df, key_columns, tolerance=tolerance)
+    header = f"Manifests differ in {len(partitions)} of {total_partitions} partitions; detailed diff of those partitions:\n"
+    return header + diff[0], diff
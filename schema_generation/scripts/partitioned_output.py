@@ -0,0 +1,122 @@
+"""
+Writes the combined DataFrame as a Hive-partitioned Parquet dataset, and reads filtered slices back from it.
+
+The dataset is partitioned into directories by Scenario and Parameters (e.g. `Scenario=Kea/Parameters=Emissions/`).
+Within each partition the rows are sorted by Sector, Subsector, Technology, Enduse, Fuel and Period, so the
+min/max statistics Parquet stores for each row group are tight. The reader turns filters into a pyarrow
+expression: partitions are skipped using their directory names, and row groups are skipped using their statistics.
+A single-scenario or single-sector request therefore only reads the bytes it needs.
+
+Requires the optional `pyarrow` package.
+
+Usage (convert the existing output CSV into a dataset):
+python scripts/partitioned_output.py
+
+See the README for the overall workflow.
+"""
+
+import logging
+import shutil
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from constants import *
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def write_partitioned_dataset(df, root_path, partition_columns=None, sort_columns=None,
+                              row_group_size=DATASET_ROW_GROUP_SIZE):
+    """
+    Write a combined DataFrame as a Hive-partitioned Parquet dataset, replacing any existing dataset at root_path.
+
+    :param df: The combined DataFrame (e.g. complete_df), with a 'Period' and a 'Value' column.
+    :param root_path: Directory to write the dataset to.
+    :param partition_columns: Columns used to partition the dataset into directories.
+    :param sort_columns: Columns used to sort the rows within each partition.
+    :param row_group_size: Maximum number of rows per row group.
+    :return: The number of rows written.
+    """
+    partition_columns = partition_columns or DATASET_PARTITION_COLUMNS
+    sort_columns = [c for c in (sort_columns or DATASET_SORT_COLUMNS) if c in df.columns]
+    _df = df.copy()
+    # Periods are stored as integers so that range filters can use the row group statistics
+    _df['Period'] = _df['Period'].astype(int)
+    _df['Value'] = _df['Value'].astype(float)
+    _df = _df.sort_values(by=partition_columns + sort_columns).reset_index(drop=True)
+    table = pa.Table.from_pandas(_df, preserve_index=False)
+    partitioning = ds.partitioning(
+        pa.schema([table.schema.field(c) for c in partition_columns]), flavor="hive"
+    )
+    # Remove stale partitions (e.g. a scenario that has since been dropped) before writing
+    shutil.rmtree(root_path, ignore_errors=True)
+    ds.write_dataset(
+        table,
+        root_path,
+        format="parquet",
+        partitioning=partitioning,
+        max_rows_per_group=row_group_size,
+        min_rows_per_group=min(row_group_size, 1024),
+        max_rows_per_file=0,
+        preserve_order=True,
+        existing_data_behavior="overwrite_or_ignore",
+    )
+    logging.info("Wrote %s rows to the partitioned dataset at %s", len(_df), root_path)
+    return len(_df)
+
+
+def _filter_expression(filters):
+    """
+    Build a pyarrow filter expression from a dictionary of column filters.
+
+    A scalar value selects rows equal to it, a list or set selects rows matching any of its values,
+    and a (low, high) tuple selects rows in the inclusive range (either end may be None).
+
+    :param filters: Dictionary mapping column names to filter values.
+    :return: A pyarrow expression, or None if there are no filters.
+    """
+    expression = None
+    for column, value in filters.items():
+        field = pc.field(column)
+        if isinstance(value, tuple):
+            low, high = value
+            parts = []
+            if low is not None:
+                parts.append(field >= low)
+            if high is not None:
+                parts.append(field <= high)
+            if not parts:
+                continue
+            condition = parts[0] if len(parts) == 1 else parts[0] & parts[1]
+        elif isinstance(value, (list, set, frozenset)):
+            condition = field.isin(sorted(value))
+        else:
+            condition = field == value
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def read_partitioned_dataset(root_path, columns=None, **filters):
+    """
+    Read a slice of a partitioned combined dataset, pushing the filters down to the partition and row group level.
+
+    Example:
+    read_partitioned_dataset(OUTPUT_COMBINED_DATASET_DIR, Scenario="Kea", Sector=["Industry", "Transport"],
+                             Period=(2025, 2040))
+
+    :param root_path: Directory containing the dataset.
+    :param columns: Optional list of columns to read. Defaults to all columns.
+    :param filters: Column filters. A scalar selects equal values, a list selects any of its values,
+                    and a (low, high) tuple selects an inclusive range.
+    :return: DataFrame with the matching rows, in the order they are stored.
+    """
+    dataset = ds.dataset(root_path, format="parquet", partitioning="hive")
+    table = dataset.to_table(columns=columns, filter=_filter_expression(filters))
+    return table.to_pandas()
+
+
+if __name__ == "__main__":
+    combined_df = pd.read_csv(OUTPUT_COMBINED_DF_FILEPATH, low_memory=False)
+    write_partitioned_dataset(combined_df, OUTPUT_COMBINED_DATASET_DIR)
@@ -0,0 +1,891 @@
+"""
+The schema and combined DataFrame generation as an importable pipeline of stages.
+
+Each stage is a function that takes a PipelineContext and DataFrames, and returns new DataFrames. The context holds
+the input file paths, the options (e.g. fix_multiple_fout), the rulesets and the lookups derived from them, such as
+the sector of each process. Nothing is kept in module-level state and input DataFrames are never modified, so several
+runs, with different inputs or options, can execute concurrently in one interpreter.
+
+run_pipeline generates the schema, builds the combined DataFrame from it and compares both with their references,
+passing the DataFrames from stage to stage in memory. generate_schema.py and generate_output_combined_df.py are thin
+wrappers around the schema and combined stages.
+
+The stages are instrumented (see instrumentation.py): with --trace, the time, memory and row counts of each stage
+and of each ruleset application are written as a JSON trace, and a summary table is logged. With --rule-telemetry,
+the matches, overwrites and time of each rule are written as CSV, and the dead, shadowed and most expensive rules
+are reported (see rule_telemetry.py).
+
+Usage (generate and compare both outputs in one process):
+python scripts/pipeline.py [--trace] [--rule-telemetry]
+
+See the README for the overall workflow.
+"""
+
+import argparse
+import logging
+import os
+from dataclasses import dataclass, field
+import numpy as np
+import pandas as pd
+
+from constants import *
+from helpers import *
+from rulesets import build_rulesets, ordered_rulesets, MISSING_ROWS
+from sharding import apply_rulesets_sharded
+from trace_cache import TraceCache
+from validation import VDValidator, validation_filepath
+from instrumentation import active_trace, instrumented, span, tracing, trace_filepath
+from rule_telemetry import collecting_rule_telemetry, rule_telemetry_filepath
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+#### CONSTANTS ####
+
+needed_attributes = ['VAR_Cap', 'VAR_FIn', 'VAR_FOut']
+non_emission_fuel = ['Electricity', 'Wood', 'Hydrogen', 'Hydro', 'Wind', 'Solar', 'Biogas']
+emissions_commodities = ['INDCO2', 'COMCO2', 'AGRCO2', 'RESCO2', 'ELCCO2', 'TRACO2', 'TOTCO2']
+
+sector_emission_types = {
+    '': 'TOTCO2',
+    'Industry': 'INDCO2',
+    'Residential' : 'RESCO2',
+    'Agriculture' : 'AGRCO2',
+    'Electricity' : 'ELCCO2',
+    'Transport' : 'TRACO2',
+    'Green Hydrogen': 'TOTCO2',
+    'Primary Fuel Supply': 'TOTCO2',
+    'Commercial': 'COMCO2'
+}
+
+RENEWABLE_FUEL_ALLOCATION_RULES = [
+    ({"FuelSourceProcess": "SUP_BIGNGA", "Commodity": "NGA"}, "inplace", {"Fuel": "Biogas"}),
+    ({"FuelSourceProcess": "SUP_H2NGA", "Commodity": "NGA"}, "inplace", {"Fuel": "Natural Gas From Green Hydrogen"}),
+    ({"FuelSourceProcess": "CT_COILBDS", "Commodity": "BDSL"}, "inplace", {"Fuel": "Biodiesel"}),
+    ({"FuelSourceProcess": "CT_CWODDID", "Commodity": "DID"}, "inplace", {"Fuel": "Drop-In Diesel"}),
+    ({"FuelSourceProcess": "CT_CWODDID", "Commodity": "DIJ"}, "inplace", {"Fuel": "Drop-In Jet"}),
+]
+
+THOUSAND_VEHICLE_RULES = [
+    ({"Sector": "Transport", "Subsector": "Road Transport",# "Technology": "Plug-In Hybrid Vehicle",
+      "Unit": "000 Vehicles"}, "inplace", {"Unit": "Number of Vehicles (Thousands)"}),
+]
+
+# Renewable fuels allocated to end-use processes: commodity -> (label for logging, fossil fuel it displaces)
+RENEWABLE_FUEL_ALLOCATIONS = {
+    "BDSL": ("biodiesel", "Diesel"),
+    "DID": ("drop-in diesel", "Diesel"),
+    "DIJ": ("drop-in jet", "Jet Fuel"),
+}
+
+# Columns of the rows allocated to end-use processes
+ALLOCATED_COLUMNS = ['Scenario', 'Attribute', 'Commodity', 'Process', 'Period', 'Value', 'FuelSourceProcess'] + \
+    [column for column in OUT_COLS if column not in ('Attribute', 'Process', 'Commodity')]
+
+
+#### CONTEXT ####
+
+@dataclass(frozen=True)
+class PipelineInputs:
+    """
+    Paths of the input files of a pipeline run.
+    """
+    scenario_files: dict = field(default_factory=lambda: dict(SCENARIO_INPUT_FILES))
+    commodity_filepath: str = ITEMS_LIST_COMMODITY_CSV
+    process_filepath: str = ITEMS_LIST_PROCESS_CSV
+    commodity_groups_filepath: str = ITEMS_LIST_COMMODITY_GROUPS_CSV
+    base_dd_filepath: str = BASE_DD_FILEPATH
+    schema_technology_filepath: str = SCHEMA_TECHNOLOGY_FILEPATH
+    reference_schema_filepath: str = REFERENCE_SCHEMA_FILEPATH
+    reference_combined_filepath: str = REFERENCE_COMBINED_DF_FILEPATH
+
+
+@dataclass(frozen=True)
+class PipelineOptions:
+    """
+    Options of a pipeline run.
+
+    fix_multiple_fout: split the VAR_FIn row of processes with several VAR_FOut rows across their end-uses.
+    zero_biofuel_emissions: attribute the negative emissions of biofuel production to the fossil fuel instead,
+                            and give the biofuel zero emissions.
+    rule_shards: apply the schema rulesets to this many shards of the rows, partitioned by Process, in parallel
+                 (see sharding.py). This does not change the outputs.
+    """
+    fix_multiple_fout: bool = True
+    zero_biofuel_emissions: bool = False
+    rule_shards: int = 1
+
+
+@dataclass(frozen=True)
+class PipelineContext:
+    """
+    Everything a pipeline stage needs besides its input DataFrames. Build it with build_context.
+    """
+    inputs: PipelineInputs
+    options: PipelineOptions
+    rulesets: dict
+    commodity_map: pd.DataFrame
+    commodity_units: dict
+    process_sectors: dict
+    end_use_processes: np.ndarray
+    end_use_process_emission_types: dict
+
+    @property
+    def schema_rulesets(self):
+        """
+        The rulesets applied to the schema, as (name, rules) tuples in order.
+        """
+        return ordered_rulesets(self.rulesets)
+
+    @property
+    def allocation_rulesets(self):
+        """
+        The rulesets applied to rows allocated to end-use processes, taking care not to overwrite the Fuel.
+        """
+        return [(name, ruleset) for name, ruleset in self.schema_rulesets + [('process_enduse_rules', self.rulesets['process_enduse_rules'])]
+                if name not in ["commodity_fuel_rules", "process_fuel_rules"]]
+
+
+@instrumented
+def build_context(inputs=None, options=None, rulesets=None):
+    """
+    Build the context for a pipeline run.
+
+    :param inputs: PipelineInputs; defaults to the standard input files.
+    :param options: PipelineOptions; defaults to the standard options.
+    :param rulesets: Dictionary returned by build_rulesets; built from the inputs if not given.
+    :return: A PipelineContext.
+    """
+    inputs = inputs or PipelineInputs()
+    options = options or PipelineOptions()
+    if rulesets is None:
+        rulesets = build_rulesets(inputs.commodity_filepath, inputs.process_filepath,
+                                  inputs.commodity_groups_filepath, inputs.base_dd_filepath)
+    commodity_map = process_map_from_commodity_groups(inputs.commodity_groups_filepath)
+    commodities_by_type = commodities_by_type_from_commodity_groups(inputs.commodity_groups_filepath)
+    end_use_commodities = commodities_by_type['DEMO']
+    end_use_processes = commodity_map[commodity_map.Commodity.isin(end_use_commodities)].Process.unique()
+    process_sectors = {x[0]['Process']: x[2]['Sector'] for x in rulesets['process_rules']}
+    return PipelineContext(
+        inputs=inputs,
+        options=options,
+        rulesets=rulesets,
+        commodity_map=commodity_map,
+        commodity_units={x[0]['Commodity']: x[2]['Unit'] for x in rulesets['commodity_unit_rules']},
+        process_sectors=process_sectors,
+        end_use_processes=end_use_processes,
+        end_use_process_emission_types={x: sector_emission_types[process_sectors[x]] for x in end_use_processes},
+    )
+
+
+#### INGEST ####
+
+@instrumented
+def read_vd_files(inputs, validator=None):
+    """
+    Read and concatenate the VD files of all scenarios, with a Scenario column. Both the schema and the combined
+    DataFrame are derived from these rows, so a run reads each file once.
+
+    The rows are validated as they are read (see validation.py), and the summary of the problems is logged. If a
+    trace is active, the full report is also written as JSON to TRACE_DIR.
+
+    :param inputs: The PipelineInputs.
+    :param validator: The VDValidator to collect the problems in; built from the inputs if not given.
+    """
+    validator = validator or VDValidator.from_inputs(inputs)
+    scenario_dfs = []
+    for scen, path in inputs.scenario_files.items():
+        if not os.path.exists(path):
+            raise FileNotFoundError(f'File not found: {path}')
+        scen_df = read_vd(path, validator=validator)
+        scen_df['Scenario'] = scen
+        scenario_dfs.append(scen_df)
+    validator.log()
+    if active_trace() is not None:
+        validator.write(validation_filepath("ingest"))
+    return pd.concat(scenario_dfs, ignore_index=True)
+
+
+#### SCHEMA STAGES ####
+
+@instrumented
+def read_schema_vd(inputs):
+    """
+    Read and concatenate the VD files of all scenarios.
+
+    :param inputs: The PipelineInputs.
+    """
+    return read_vd_files(inputs)
+
+
+@instrumented
+def prepare_schema_rows(ctx, vd_df):
+    """
+    Select the schema columns and attributes from the VD rows, and add the rows for each process from the
+    Commodity Groups file.
+    """
+    # First approach: VD OUTPUT. This approach will only include technologies selected by TIMES.
+    vd_df = add_missing_columns(vd_df.copy(), OUT_COLS + SUP_COLS)
+    logging.info(
+        "Dropping columns: %s",
+        [x for x in vd_df.columns if x not in OUT_COLS + SUP_COLS]
+    )
+    vd_df = vd_df[OUT_COLS + SUP_COLS]
+
+    # Subset the rows and drop duplicates
+    vd_df = vd_df[vd_df["Attribute"].isin(ATTRIBUTE_ROWS_TO_KEEP)]
+
+    # Second approach: Read the 'Commodity Groups' CSV file. This approach would be preferred if the
+    # Commodity Groups export from VEDA were complete. Unfortunately, it doesn't present the emissions
+    cg_df = process_map_from_commodity_groups(ctx.inputs.commodity_groups_filepath)
+
+    # Combine the two DataFrames and drop duplicates
+    return pd.concat([vd_df, cg_df]).drop_duplicates()
+
+
+@instrumented
+def apply_schema_rulesets(ctx, main_df):
+    """
+    Populate the columns and augment with emissions rows according to the rulesets in the specified order.
+    The SourceRow column records the position in main_df of the row each output row derives from.
+    """
+    main_df = main_df.copy()
+    main_df['SourceRow'] = np.arange(len(main_df))
+    if ctx.options.rule_shards > 1:
+        return apply_rulesets_sharded(main_df, ctx.schema_rulesets, ctx.options.rule_shards)
+    return apply_rulesets(main_df, ctx.schema_rulesets)
+
+
+def apply_rulesets(df, rulesets, label=None):
+    """
+    Apply rulesets in order, first pruning the rules that cannot match any row. Each ruleset application is
+    recorded as a span of the active trace, if any.
+
+    :param df: The DataFrame to apply the rulesets to.
+    :param rulesets: List of (name, rules) tuples.
+    :param label: Description of the rows, for logging.
+    """
+    for name, ruleset in rulesets:
+        if label is None:
+            logging.info("Applying ruleset: %s", name)
+        else:
+            logging.info("Applying ruleset to '%s' rows: %s", label, name)
+        with span(f"ruleset:{name}", rows_in=len(df)) as record:
+            df = apply_rules(df, prune_rules(ruleset, df, name), name)
+            if record is not None:
+                record.rows_out = len(df)
+    return df
+
+
+@instrumented
+def finalise_schema(main_df):
+    """
+    Drop emissions rows with non-emissions commodities, add the MISSING_ROWS and tidy up the schema.
+    """
+    main_df = main_df.copy()
+    main_df.Commodity = main_df.Commodity.fillna('-')
+
+    # Drop emissions rows with non-emissions commodities
+    indexes_to_drop = main_df[(main_df['Parameters'] == 'Emissions') & (~main_df['Commodity'].isin(emissions_commodities))].index
+    main_df = main_df.drop(indexes_to_drop)
+
+    telemetry = active_rule_telemetry()
+    if telemetry is not None:
+        telemetry.record_missing_rows(main_df, MISSING_ROWS)
+    logging.info("Adding missing rows")
+    main_df = pd.concat([main_df, MISSING_ROWS], ignore_index=True)
+    return main_df[OUT_COLS].drop_duplicates().dropna().sort_values(by=OUT_COLS)
+
+
+@instrumented
+def build_schema(ctx, vd_df=None):
+    """
+    Generate the schema DataFrame.
+
+    :param ctx: The PipelineContext.
+    :param vd_df: The concatenated VD rows, as returned by read_vd_files; read if not given.
+    :return: The schema DataFrame, with the OUT_COLS columns.
+    """
+    if vd_df is None:
+        vd_df = read_schema_vd(ctx.inputs)
+    return finalise_schema(apply_schema_rulesets(ctx, prepare_schema_rows(ctx, vd_df)))
+
+
+#### COMBINED DATAFRAME STAGES ####
+
+@instrumented
+def aggregate_raw_df(vd_df):
+    """
+    Aggregate Value of the VD rows over all combinations of Region, Vintage, Timeslice and UserConstraint.
+
+    :param vd_df: The concatenated VD rows, as returned by read_vd_files.
+    """
+    raw_df = vd_df[(vd_df['Period'] != '2016') &
+                   (vd_df['Commodity'] != 'COseq') &
+                   (vd_df['Period'] != '2020')]
+
+    # Filtering and transformation
+    raw_df = raw_df.rename(columns={'PV': 'Value'})
+    raw_df = raw_df[raw_df['Attribute'].isin(needed_attributes)]
+    return raw_df.groupby(['Scenario', 'Attribute', 'Commodity', 'Process', 'Period']).sum(['Value']).reset_index()
+
+
+@instrumented
+def read_raw_df(inputs, validator=None):
+    """
+    Read the VD file of each scenario, validating the rows as they are read, and aggregate Value over all
+    combinations of Region, Vintage, Timeslice and UserConstraint.
+
+    :param inputs: The PipelineInputs.
+    :param validator: The VDValidator to collect the problems in; built from the inputs if not given.
+    """
+    return aggregate_raw_df(read_vd_files(inputs, validator))
+
+
+@instrumented
+def read_schema_technology(inputs):
+    """
+    Read the mapping of each Technology to its Technology_Group.
+
+    :param inputs: The PipelineInputs.
+    """
+    schema_technology = pd.read_excel(inputs.schema_technology_filepath)
+    schema_technology['Technology'] = schema_technology['Technology'].str.strip()
+    return schema_technology
+
+
+def prepare_schema_all(schema_df):
+    """
+    Drop the MISSING_ROWS from the schema before joining it to the TIMES output.
+    """
+    schema_all = pd.merge(schema_df,
+                          MISSING_ROWS,
+                          on=['Attribute', 'Process', 'Commodity', 'Sector', 'Subsector', 'Technology', 'Fuel', 'Enduse', 'Unit', 'Parameters', 'FuelGroup'],
+                          how='outer', indicator=True)
+    return schema_all[schema_all['_merge'] == 'left_only'].drop(columns=['_merge'])
+
+
+def units_consistent(ctx, commodity_flow_dict):
+    # Check if all units are the same
+    return len(set([ctx.commodity_units[commodity] for commodity in commodity_flow_dict])) == 1
+
+
+def trace_commodities(ctx, process, scenario, period, df, path=None, fraction=1):
+    """
+    Trace the output commodities of a process (e.g. Biodiesel blending) all the way through
+    to end-use commodities (e.g. bus transportation) to determine what fraction of its output
+    (e.g. blended diesel) ends up being used to provide each end-use commodity.
+    """
+    if path is None:
+        path = []
+    # Extend path with the current process
+    current_path = path + [process]
+    # Get output flows from the current process
+    output_flows = process_output_flows(process, scenario, period, df)
+    # This implementation assumes that everything has the same units
+    assert(units_consistent(ctx, output_flows))
+    # Calculate fractional flows for each output commodity
+    output_fracs = flow_fractions(output_flows)
+    # Resulting dictionary to keep track of the final fractional attributions
+    result = {}
+    for commodity in output_flows.keys():
+        # Get the input flows for the commodity across different processes
+        input_flows = commodity_input_flows(commodity, scenario, period, df)
+        # If the commodity does not flow into any other processes, it is terminal
+        if not input_flows:
+            # Save the path and fraction up to this point
+            result[tuple(current_path + [commodity])] = fraction * output_fracs[commodity]
+        else:
+            input_fracs = flow_fractions(input_flows)
+            # Recursively trace downstream processes
+            for downstream_process, input_fraction in input_fracs.items():
+                # Calculate new fraction as current fraction * fraction of this commodity's output used by the downstream process
+                new_fraction = fraction * output_fracs[commodity] * input_fraction
+                # Merge results from recursion
+                result.update(trace_commodities(ctx, downstream_process, scenario, period, df, current_path + [commodity], new_fraction))
+    return result
+
+
+def end_use_fractions(ctx, process, scenario, period, df, filter_to_commodities=None):
+    # Return a dictionary of emissions from end-use processes
+    trace_result = trace_commodities(ctx, process, scenario, period, df)
+    # Ensure the sum of all terminal fractions is approximately 1
+    assert(abs(sum(trace_result.values()) - 1) < 1e-5)
+    end_use_fractions = pd.DataFrame(
+         [{'Scenario': scenario,
+         'Attribute': 'VAR_FOut',
+         'Commodity': None,
+         'Process': process,
+         'Period': period,
+         'Value': None} for process in ctx.end_use_processes]
+    )
+    # Loop through the trace_result dictionary
+    for key, value in trace_result.items():
+        process_chain = key  # This is the tuple containing the process chain
+        fuel_source_process = process_chain[0] # First entry which is the fuel source process
+        process = process_chain[-2]  # Penultimate entry which is the process
+        commodity = process_chain[1]  # Second entry which is the commodity
+        end_use_fractions.loc[end_use_fractions['Process'] == process, 'Value'] = value
+        end_use_fractions.loc[end_use_fractions['Process'] == process, 'Commodity'] = commodity
+        end_use_fractions.loc[end_use_fractions['Process'] == process, 'FuelSourceProcess'] = fuel_source_process
+    if filter_to_commodities is not None:
+        end_use_fractions = end_use_fractions[(end_use_fractions['Commodity'].isin(filter_to_commodities)) | (end_use_fractions['Commodity'].isna())]
+    end_use_fractions.Value = end_use_fractions.Value / end_use_fractions.Value.sum()
+    return end_use_fractions
+
+
+def apply_allocation_rulesets(ctx, rows, label):
+    """
+    Complete rows allocated to end-use processes using the usual rules, taking care not to overwrite the Fuel.
+    """
+    if rows.empty:
+        # Nothing was allocated (e.g. no biofuel is produced): the rules cannot query a frame without columns
+        return pd.DataFrame(columns=ALLOCATED_COLUMNS).astype({'Value': float})
+    return apply_rulesets(rows, ctx.allocation_rulesets, label)
+
+
+def negative_emission_rows(raw_df):
+    """
+    Return the "negative emissions" rows of biofuel production in the TIMES output.
+    """
+    return raw_df[
+        (raw_df['Attribute'] == "VAR_FOut") &
+        (raw_df['Commodity'].str.contains("CO2")) &
+        (raw_df['Value'] < 0)]
+
+
+def production_rows(raw_df, commodity):
+    """
+    Return the rows of the TIMES output producing a commodity.
+    """
+    return raw_df[
+        (raw_df['Attribute'] == "VAR_FOut") &
+        (raw_df['Commodity'] == commodity)]
+
+
+@instrumented
+def allocate_negative_emissions(ctx, raw_df):
+    """
+    Attribute the "negative emissions" of biofuel production to the end-use processes using the biofuel.
+
+    :return: A tuple of (rows to add, negative emissions rows to drop from raw_df).
+    """
+    emissions_rows_to_add = pd.DataFrame()
+    # Identical traces in different scenarios and periods are solved once
+    traces = TraceCache(raw_df)
+
+    # Collect all "negative emissions" rows to attribute to end-use processes
+    negative_emissions = negative_emission_rows(raw_df)
+    for index, row in negative_emissions.iterrows():
+        # For each negative emission process, get the fractional attributions of its output to end-use processes
+        end_use_allocations = traces.end_use_fractions(
+            lambda: end_use_fractions(ctx, row['Process'], row['Scenario'], row['Period'], raw_df),
+            row['Process'], row['Scenario'], row['Period'], label='negative emissions')
+        # Proportionately attribute the 'neg-emissions' to the end-uses, in units of Mt CO₂/yr
+        end_use_allocations['Value'] *= row['Value']
+        # Label the Fuels used according to the neg-emission process and commodity produced
+        end_use_allocations = apply_rules(end_use_allocations, RENEWABLE_FUEL_ALLOCATION_RULES, 'RENEWABLE_FUEL_ALLOCATION_RULES')
+        # Overwrite the commodity with the emission commodity for the sector
+        end_use_allocations['Commodity'] = end_use_allocations['Process'].map(ctx.end_use_process_emission_types)
+        # Tidy up and add the new rows to emissions_rows_to_add
+        end_use_allocations.dropna(inplace=True)
+        end_use_allocations = add_missing_columns(end_use_allocations, OUT_COLS)
+        emissions_rows_to_add = pd.concat([emissions_rows_to_add, end_use_allocations], ignore_index=True)
+    logging.info("Traces of %s", traces.summary('negative emissions'))
+    emissions_rows_to_add = apply_allocation_rulesets(ctx, emissions_rows_to_add, 'negative emissions')
+    return emissions_rows_to_add, negative_emissions
+
+
+def zero_biofuel_emission_rows(emissions_rows_to_add):
+    """
+    Attribute the negative emissions to the fossil fuel instead, and create zero-emissions rows for the biofuel.
+    The extra fossil negative-emissions rows for the fossil fuel will later combine and partly cancel the existing
+    fossil fuel emissions on a subsequent .groupby().sum() operation.
+    """
+    emissions_rows_to_add_copy = emissions_rows_to_add.copy()
+    emissions_rows_to_add_copy.Fuel = emissions_rows_to_add_copy.Fuel.map(
+        {'Drop-In Diesel': 'Diesel', 'Drop-In Jet': 'Jet Fuel', 'Biodiesel': 'Diesel'}
+    )
+    emissions_rows_to_add_copy.FuelGroup = "Fossil Fuels"
+    emissions_rows_to_add = emissions_rows_to_add.copy()
+    emissions_rows_to_add.Value = 0.0
+    return pd.concat([emissions_rows_to_add, emissions_rows_to_add_copy])
+
+
+@instrumented
+def allocate_renewable_fuel(ctx, raw_df, commodity):
+    """
+    Allocate the production of a renewable fuel (e.g. BDSL) to the end-use processes using it, and deallocate
+    the same amount of the fossil fuel it displaces, as given in RENEWABLE_FUEL_ALLOCATIONS.
+
+    :param ctx: The PipelineContext.
+    :param raw_df: The aggregated TIMES output.
+    :param commodity: The renewable fuel commodity.
+    :return: A tuple of (rows to add, production rows of the commodity).
+    """
+    label, fossil_fuel = RENEWABLE_FUEL_ALLOCATIONS[commodity]
+    rows_to_add = pd.DataFrame()
+    traces = TraceCache(raw_df)
+    production = production_rows(raw_df, commodity)
+    for index, row in production.iterrows():
+        end_use_allocations = traces.end_use_fractions(
+            lambda: end_use_fractions(ctx, row['Process'], row['Scenario'], row['Period'], raw_df, filter_to_commodities=[commodity]),
+            row['Process'], row['Scenario'], row['Period'], [commodity], label)
+        if commodity == 'DIJ':
+            ################################
+            # Hack to match R
+            domestic_jet_travel = process_output_flows('T_O_FuelJet', row['Scenario'], row['Period'], raw_df)['T_O_JET']
+            internat_jet_travel = process_output_flows('T_O_FuelJet_Int', row['Scenario'], row['Period'], raw_df)['T_O_JET_Int']
+            end_use_allocations.loc[end_use_allocations.Process=='T_O_FuelJet_Int','Value'] = internat_jet_travel / (internat_jet_travel + domestic_jet_travel)
+            end_use_allocations.loc[end_use_allocations.Process=='T_O_FuelJet','Value'] = domestic_jet_travel / (internat_jet_travel + domestic_jet_travel)
+            end_use_allocations.loc[end_use_allocations.Process=='T_O_FuelJet_Int','Commodity'] = 'DIJ'
+            end_use_allocations.loc[end_use_allocations.Process=='T_O_FuelJet_Int','FuelSourceProcess'] = 'CT_CWODDID'
+            ################################
+        end_use_allocations = end_use_allocations.dropna()
+        end_use_allocations['Value'] *= row['Value']
+        end_use_allocations['Attribute'] = 'VAR_FIn'
+        end_use_allocations['Commodity'] = commodity
+        end_use_allocations = apply_rules(end_use_allocations, RENEWABLE_FUEL_ALLOCATION_RULES, 'RENEWABLE_FUEL_ALLOCATION_RULES')
+        end_use_allocations.dropna(inplace=True)
+        rows_to_add = pd.concat([rows_to_add, end_use_allocations], ignore_index=True)
+    logging.info("Traces of %s", traces.summary(label))
+    rows_to_add = apply_allocation_rulesets(ctx, rows_to_add, label)
+    # Deallocate the same amount of the fossil fuel.
+    fossil_rows_to_add = rows_to_add.copy()
+    fossil_rows_to_add['Value'] = -fossil_rows_to_add['Value']
+    fossil_rows_to_add['Fuel'] = fossil_fuel
+    fossil_rows_to_add['FuelGroup'] = 'Fossil Fuels'
+    return pd.concat([rows_to_add, fossil_rows_to_add]), production
+
+
+def check_allocations(rows_to_drop, rows_to_add, schema_all):
+    """
+    Check that all rows to drop will be dropped on merging, and that the rows to add match the rows to drop
+    in terms of total value.
+    """
+    assert(0 == len(pd.merge(rows_to_drop, schema_all, on=['Attribute', 'Process', 'Commodity'], how='inner')))
+    tolerance = 1E-6
+    assert(abs(rows_to_drop.Value.sum() - rows_to_add.Value.sum()) < tolerance)
+    for commodity in ['CO2', 'BDSL', 'DIJ', 'DID']:
+        assert(abs(rows_to_drop[rows_to_drop.Commodity.str.contains(commodity)].Value.sum() -
+                   rows_to_add[rows_to_add.Commodity.str.contains(commodity)].Value.sum()) < tolerance)
+
+
+@instrumented
+def join_schema(raw_df, schema_all, schema_technology, rows_to_drop, rows_to_add):
+    """
+    Join the TIMES output to the schema, add the allocated rows, convert units and aggregate.
+    """
+    clean_df = pd.concat(
+        [pd.merge(raw_df[~raw_df.index.isin(rows_to_drop.index)], schema_all,
+                  on=['Attribute', 'Process', 'Commodity'],
+                  how='inner'),
+         rows_to_add],
+        ignore_index=True
+    )
+    clean_df = pd.merge(clean_df, schema_technology, on=['Technology'], how='left')
+
+    # Setting values based on conditions
+    non_emission_fuel_emissions = (clean_df['Parameters'] == 'Emissions') & (clean_df['Fuel'].isin(non_emission_fuel))
+    logging.debug("Value of emissions from non-emissions fuels before adjustment:\n%s", clean_df[non_emission_fuel_emissions])
+    clean_df['Value'] = np.where(non_emission_fuel_emissions, 0, clean_df['Value'])
+    logging.warning("\nTODO: The approach inherited here could be improved. The schema has rows for each input fuel for processes that use multiple fuels.\n" \
+           " On joining we get multiple rows with duplicated emissions for those processes, and we later set the non-emissions fuel emissions to zero.\n" \
+           " This violates the principle that the dataframe should always be correct in between operations. Any forgotten process will lead to errors.\n" \
+           " A nicer approach would be to have a single emissions row for each process, and procedurally attribute emissions to input energy flows.\n")
+
+    # Reset the Electricity sector to 'Other'
+    clean_df['Sector'] = np.where(clean_df['Sector'] == 'Electricity', 'Other', clean_df['Sector'])
+
+    # Convert emissions to Mt CO2/yr
+    clean_df.loc[clean_df['Parameters'] == 'Emissions', 'Value'] /= 1000
+    clean_df.loc[clean_df['Parameters'] == 'Emissions', 'Unit'] = 'Mt CO<sub>2</sub>/yr' #'Mt CO₂/yr'
+
+    # Convert Annualised Capital Costs to Billion NZD
+    clean_df.loc[clean_df['Parameters'] == 'Annualised Capital Costs', 'Value'] /= 1000
+    clean_df.loc[clean_df['Parameters'] == 'Annualised Capital Costs', 'Unit'] = 'Billion NZD'
+
+    # Remove unwanted rows and group data
+    clean_df = clean_df[(clean_df['Parameters'] != 'Annualised Capital Costs') & (clean_df['Parameters'] != 'Technology Capacity')]
+    return clean_df.groupby(['Attribute', 'Process', 'Commodity'] + GROUP_COLUMNS).agg(Value=('Value', 'sum')).reset_index()
+
+
+@instrumented
+def split_multiple_fout(combined_df):
+    """
+    Find processes with multiple VAR_FOut rows (excluding emissions commodities) and split the VAR_FIn row across
+    each of the end-uses obtained from the VAR_FOut rows, based on the ratio of VAR_FOut values.
+    """
+    filtered_df = combined_df[(combined_df['Attribute'] == 'VAR_FOut') & (~combined_df['Commodity'].str.contains('CO2'))]
+    multi_fout = filtered_df.groupby(['Scenario', 'Process', 'Period']).filter(lambda x: len(x) > 1)
+    unique_scenario_process_periods = multi_fout[['Scenario', 'Process', 'Period']].drop_duplicates()
+
+    for _, row in unique_scenario_process_periods.iterrows():
+        scen = row['Scenario']
+        process = row['Process']
+        period = row['Period']
+        logging.info(f"Processing Scenario: {scen}, Process: {process}, Period: {period}")
+
+        # Filter relevant rows for the current process and period
+        relevant_rows = combined_df[(combined_df['Scenario'] == scen) & (combined_df['Process'] == process) & (combined_df['Period'] == period)]
+        fin_row = relevant_rows[relevant_rows['Attribute'] == 'VAR_FIn']
+        assert(len(fin_row) == 1)  # There should only be one VAR_FIn row - currently not handling multiple VAR_FIn rows
+        fout_rows = relevant_rows[relevant_rows['Attribute'] == 'VAR_FOut']
+
+        if not fin_row.empty:
+            total_output = fout_rows['Value'].sum()
+            ratios = fout_rows['Value'] / total_output
+
+            # Create new VAR_FIn rows by multiplying the original Value with each ratio
+            new_fin_rows = fin_row.copy().loc[fin_row.index.repeat(len(fout_rows))].reset_index(drop=True)
+            new_fin_rows['Value'] = fin_row['Value'].values[0] * ratios.values
+            new_fin_rows['Enduse'] = fout_rows['Enduse'].values
+
+            # Replace the original VAR_FIn row with the new rows in the DataFrame
+            combined_df = combined_df.drop(fin_row.index)  # Remove original VAR_FIn row
+            combined_df = pd.concat([combined_df, new_fin_rows], ignore_index=True)
+    return combined_df
+
+
+@instrumented
+def complete_periods(combined_df, all_periods=None):
+    """
+    Add zero-valued rows so that every category has a row for every period, and aggregate over the group columns.
+
+    :param all_periods: The periods every category should have; defaults to those in combined_df.
+    """
+    if all_periods is None:
+        all_periods = np.sort(combined_df['Period'].unique())
+    categories = [x for x in GROUP_COLUMNS if x != 'Period']
+    complete_df = combined_df.groupby(categories).apply(add_missing_periods(all_periods)).reset_index(drop=True)
+
+    complete_df = complete_df.groupby(GROUP_COLUMNS).agg(Value=('Value', 'sum')).reset_index()
+    complete_df = apply_rules(complete_df, THOUSAND_VEHICLE_RULES, 'THOUSAND_VEHICLE_RULES')
+    return complete_df.sort_values(by=GROUP_COLUMNS)
+
+
+@instrumented
+def check_complete_df(ctx, raw_df, complete_df, negative_emissions, productions):
+    """
+    Check that the allocated negative emissions and renewable fuels add up to the TIMES output.
+
+    :param productions: Dictionary mapping each renewable fuel commodity to its production rows.
+    """
+    grouped_negative_emissions = negative_emissions.groupby(['Scenario', 'Period']).Value.sum()
+    for (scenario, period), value in grouped_negative_emissions.items():
+        if ctx.options.zero_biofuel_emissions:
+            logging.info("skip check")
+            break
+        negative_emissions_in_dataframe = complete_df[
+            (complete_df.Scenario==scenario) &
+            (complete_df.Period==period) &
+            (complete_df.Fuel.isin(['Biodiesel', 'Drop-In Jet', 'Drop-In Diesel'])) &
+            (complete_df.Parameters=='Emissions')].Value.sum() * 1000
+        assert(abs(negative_emissions_in_dataframe - value) < 1E-6)
+        logging.info(f"Check output matches negative emissions for Scenario: {scenario}, Period: {period}, Summed Value: {value:.2f}: OK")
+
+    fuels = {'BDSL': 'Biodiesel', 'DID': 'Drop-In Diesel', 'DIJ': 'Drop-In Jet'}
+    for commodity, (label, _) in RENEWABLE_FUEL_ALLOCATIONS.items():
+        grouped_production = productions[commodity].groupby(['Scenario', 'Period']).Value.sum()
+        for (scenario, period), value in grouped_production.items():
+            fuel_in_dataframe = complete_df[
+                (complete_df.Scenario==scenario) &
+                (complete_df.Period==period) &
+                (complete_df.Fuel==fuels[commodity]) &
+                (complete_df.Parameters=='Fuel Consumption')].Value.sum()
+            assert(abs(fuel_in_dataframe - value) < 1E-6)
+            logging.info(f"Check output matches {label} production for Scenario: {scenario}, Period: {period}, Summed Value: {value:.2f}: OK")
+
+    total_emissions = raw_df[raw_df.Commodity=='TOTCO2'].groupby(['Scenario', 'Period']).Value.sum()
+    for (scenario, period), value in total_emissions.items():
+        emissions_in_dataframe = complete_df[
+            (complete_df.Scenario==scenario) &
+            (complete_df.Period==period) &
+            (complete_df.Parameters=='Emissions')].Value.sum() * 1000
+        if abs(emissions_in_dataframe - value) > 1E-6 and emissions_in_dataframe < value:
+            logging.info(f"WARNING: emissions in output for Scenario: {scenario}, Period: {period} ({emissions_in_dataframe:.2f}) is missing some TOTCO2 emissions in raw TIMES output: ({value:.2f})")
+
+    logging.info(raw_df[raw_df.Commodity.str.contains('TOTCO2')].groupby(['Scenario', 'Period']).Value.sum()*2)
+    logging.info(raw_df[raw_df.Commodity.str.contains('CO2')].groupby(['Scenario', 'Period']).Value.sum())
+
+
+@instrumented
+def allocate_emissions(ctx, raw_df):
+    """
+    Allocate the negative emissions to end-use processes, attributing them to the fossil fuel instead if
+    the zero_biofuel_emissions option is set.
+
+    :return: A tuple of (rows to add, negative emissions rows to drop from raw_df).
+    """
+    emissions_rows_to_add, negative_emissions = allocate_negative_emissions(ctx, raw_df)
+    if ctx.options.zero_biofuel_emissions:
+        emissions_rows_to_add = zero_biofuel_emission_rows(emissions_rows_to_add)
+    return emissions_rows_to_add, negative_emissions
+
+
+def assemble_allocations(emissions_allocation, fuel_allocations):
+    """
+    Bring together the allocations of the negative emissions and of each renewable fuel.
+
+    :param emissions_allocation: The tuple returned by allocate_emissions.
+    :param fuel_allocations: The tuples returned by allocate_renewable_fuel, in the order of RENEWABLE_FUEL_ALLOCATIONS.
+    :return: Dictionary with the 'rows_to_drop' from raw_df, the 'rows_to_add' to it, and the 'productions'
+             rows of each renewable fuel commodity.
+    """
+    emissions_rows_to_add, negative_emissions = emissions_allocation
+    return {
+        'rows_to_drop': negative_emissions,
+        'rows_to_add': pd.concat([emissions_rows_to_add] + [rows for rows, _ in fuel_allocations]),
+        'productions': {commodity: production for commodity, (_, production) in zip(RENEWABLE_FUEL_ALLOCATIONS, fuel_allocations)},
+    }
+
+
+@instrumented
+def allocate(ctx, raw_df):
+    """
+    Allocate the negative emissions and the renewable fuels to the end-use processes using them.
+
+    :param ctx: The PipelineContext.
+    :param raw_df: The aggregated TIMES output.
+    :return: Dictionary with the 'rows_to_drop' from raw_df, the 'rows_to_add' to it, and the 'productions'
+             rows of each renewable fuel commodity.
+    """
+    return assemble_allocations(
+        allocate_emissions(ctx, raw_df),
+        [allocate_renewable_fuel(ctx, raw_df, commodity) for commodity in RENEWABLE_FUEL_ALLOCATIONS],
+    )
+
+
+@instrumented
+def combine(ctx, raw_df, schema_df, schema_technology, allocations):
+    """
+    Join the TIMES output and the allocated rows to the schema, and split multiple-output processes if enabled.
+
+    :return: The combined DataFrame, before period completion.
+    """
+    schema_all = prepare_schema_all(schema_df)
+    # The negative emissions rows are dropped on schema join.
+    assert(0 == len(pd.merge(allocations['rows_to_drop'], schema_all, on=['Attribute', 'Process', 'Commodity'], how='inner')))
+    check_allocations(allocations['rows_to_drop'], allocations['rows_to_add'], schema_all)
+    combined_df = join_schema(raw_df, schema_all, schema_technology, allocations['rows_to_drop'], allocations['rows_to_add'])
+    if ctx.options.fix_multiple_fout:
+        combined_df = split_multiple_fout(combined_df)
+    return combined_df
+
+
+@instrumented
+def complete(ctx, raw_df, combined_df, allocations):
+    """
+    Complete the periods of the combined DataFrame and check it against the TIMES output.
+    """
+    complete_df = complete_periods(combined_df)
+    check_complete_df(ctx, raw_df, complete_df, allocations['rows_to_drop'], allocations['productions'])
+    return complete_df
+
+
+@instrumented
+def build_combined(ctx, schema_df, raw_df=None, schema_technology=None):
+    """
+    Generate the combined DataFrame from the TIMES output and the schema.
+
+    :param ctx: The PipelineContext.
+    :param schema_df: The schema DataFrame, as returned by build_schema.
+    :param raw_df: The aggregated TIMES output, as returned by read_raw_df; read if not given.
+    :param schema_technology: The Technology_Group mapping, as returned by read_schema_technology; read if not given.
+    :return: The complete combined DataFrame, with a row for every category and period.
+    """
+    if raw_df is None:
+        raw_df = read_raw_df(ctx.inputs)
+    if schema_technology is None:
+        schema_technology = read_schema_technology(ctx.inputs)
+    allocations = allocate(ctx, raw_df)
+    combined_df = combine(ctx, raw_df, schema_df, schema_technology, allocations)
+    return complete(ctx, raw_df, combined_df, allocations)
+
+
+#### COMPARISON ####
+
+@instrumented
+def compare_schema(inputs, schema_df):
+    """
+    Compare a schema DataFrame with the reference schema, as compare_tables does for the written file.
+    """
+    reference_df = pd.read_csv(inputs.reference_schema_filepath, low_memory=False)
+    return compare_frames(schema_df, reference_df, columns=OUT_COLS)
+
+
+@instrumented
+def compare_combined(inputs, complete_df):
+    """
+    Compare a combined DataFrame with the reference, as compare_tables does for the written file.
+    """
+    reference_df = pd.read_csv(inputs.reference_combined_filepath, low_memory=False)
+    return compare_frames(formatted_for_output(complete_df), reference_df)
+
+
+@dataclass
+class PipelineResult:
+    """
+    The outputs of a pipeline run. The comparisons are the tuples returned by compare_frames.
+    """
+    schema_df: pd.DataFrame
+    complete_df: pd.DataFrame
+    schema_comparison: tuple
+    combined_comparison: tuple
+
+
+@instrumented
+def run_pipeline(ctx=None):
+    """
+    Generate the schema and the combined DataFrame, and compare both with their references, in memory.
+
+    :param ctx: The PipelineContext; built with the defaults if not given.
+    :return: A PipelineResult.
+    """
+    ctx = ctx or build_context()
+    # The TIMES output is read once, and validated, before the schema rules are applied
+    vd_df = read_vd_files(ctx.inputs)
+    raw_df = aggregate_raw_df(vd_df)
+    schema_df = build_schema(ctx, vd_df)
+    complete_df = build_combined(ctx, schema_df, raw_df=raw_df)
+    return PipelineResult(
+        schema_df=schema_df,
+        complete_df=complete_df,
+        schema_comparison=compare_schema(ctx.inputs, schema_df),
+        combined_comparison=compare_combined(ctx.inputs, complete_df),
+    )
+
+
+@instrumented
+def write_outputs(schema_df, complete_df, schema_filepath=OUTPUT_SCHEMA_FILEPATH, combined_filepath=OUTPUT_COMBINED_DF_FILEPATH):
+    """
+    Write the schema and the combined DataFrame, each with its fingerprint manifest.
+
+    :return: The paths written.
+    """
+    schema_df.to_csv(schema_filepath, index=False)
+    write_manifest(schema_df, schema_filepath)
+    save(complete_df, combined_filepath, manifest=True)
+    return [schema_filepath, combined_filepath]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate and compare the schema and combined DataFrames in one process.")
+    parser.add_argument('--no-fix-multiple-fout', action='store_true', help="Do not split VAR_FIn rows across multiple VAR_FOut end-uses")
+    parser.add_argument('--zero-biofuel-emissions', action='store_true', help="Attribute negative emissions to the fossil fuel")
+    parser.add_argument('--rule-shards', type=int, default=1, help="Apply the schema rulesets to this many shards of the rows in parallel")
+    parser.add_argument('--trace', action='store_true', help="Write a JSON trace of the time, memory and rows of each stage")
+    parser.add_argument('--rule-telemetry', action='store_true', help="Report the matches, overwrites and time of each rule")
+    args = parser.parse_args()
+
+    with tracing(trace_filepath("pipeline"), enabled=args.trace), \
+            collecting_rule_telemetry(rule_telemetry_filepath("pipeline"), enabled=args.rule_telemetry):
+        ctx = build_context(options=PipelineOptions(
+            fix_multiple_fout=not args.no_fix_multiple_fout,
+            zero_biofuel_emissions=args.zero_biofuel_emissions,
+            rule_shards=args.rule_shards,
+        ))
+        result = run_pipeline(ctx)
+        write_outputs(result.schema_df, result.complete_df)
+    logging.info("Schema comparison:\n%s", result.schema_comparison[0])
+    logging.info("Combined DataFrame comparison:\n%s", result.combined_comparison[0])
@@ -0,0 +1,226 @@
+"""
+A small local HTTP query service over the combined output, so that many dashboard sessions can share one
+warm copy of the data instead of each loading the whole file.
+
+The combined CSV is parsed once through a memory map, and the dimension columns are stored as categoricals.
+An index from each value to its row positions is built for every column in QUERY_INDEX_COLUMNS. A request
+is answered by intersecting the index entries for its filters, applying the period range, and optionally
+summing Value over the requested group columns. Recent results are kept in an LRU cache and served
+with an ETag. A client that sends If-None-Match with the current ETag gets a 304 response with no body.
+Only the Python standard library and pandas are used.
+
+Endpoints:
+* GET /query?Scenario=Kea&Sector=Industry,Transport&Parameters=Emissions&period_from=2025&period_to=2040&group_by=Sector,Period
+  Filters on any indexed column (comma-separated values match any of them), an optional inclusive period range,
+  and optional group_by columns to aggregate Value over. Returns {"columns": [...], "rows": [[...], ...]}.
+* GET /values?column=Sector
+  Returns the distinct values of an indexed column, e.g. to populate a picker.
+
+Usage:
+python scripts/query_server.py --port 8765
+
+See the README for the overall workflow.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from constants import *
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class CombinedDataIndex:
+    """
+    The combined output held in memory once, with a row-position index for each indexed column.
+    """
+
+    def __init__(self, filepath, index_columns=None):
+        self.index_columns = index_columns or QUERY_INDEX_COLUMNS
+        df = pd.read_csv(filepath, memory_map=True, low_memory=False)
+        for column in self.index_columns:
+            df[column] = df[column].astype('category')
+        df['Period'] = df['Period'].astype(int)
+        self.df = df
+        self.periods = df['Period'].to_numpy()
+        # Map each value of each indexed column to the sorted row positions holding it
+        self.indexes = {
+            column: {value: np.asarray(positions) for value, positions in df.groupby(column, observed=True).indices.items()}
+            for column in self.index_columns
+        }
+        logging.info("Indexed %s rows from %s", len(df), filepath)
+
+    def values(self, column):
+        """
+        Return the sorted distinct values of an indexed column.
+        """
+        return sorted(self.indexes[column].keys())
+
+    def query(self, filters, period_from=None, period_to=None, group_by=None):
+        """
+        Select and optionally aggregate a slice of the combined output.
+
+        :param filters: Dictionary mapping indexed columns to lists of accepted values.
+        :param period_from: Optional first Period to include.
+        :param period_to: Optional last Period to include.
+        :param group_by: Optional list of columns to sum Value over.
+        :return: DataFrame with the selected rows, or the aggregated rows if group_by is given.
+        """
+        positions = None
+        for column, accepted in filters.items():
+            column_index = self.indexes[column]
+            matches = [column_index[value] for value in accepted if value in column_index]
+            column_positions = np.unique(np.concatenate(matches)) if matches else np.array([], dtype=int)
+            positions = column_positions if positions is None else np.intersect1d(positions, column_positions, assume_unique=True)
+        if positions is None:
+            positions = np.arange(len(self.df))
+        if period_from is not None:
+            positions = positions[self.periods[positions] >= period_from]
+        if period_to is not None:
+            positions = positions[self.periods[positions] <= period_to]
+        result = self.df.iloc[positions]
+        if group_by:
+            result = result.groupby(group_by, observed=True).agg(Value=('Value', 'sum')).reset_index()
+        return result
+
+
+class QueryCache:
+    """
+    A thread-safe LRU cache of encoded query results and their ETags.
+    """
+
+    def __init__(self, max_size=QUERY_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, body):
+        etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+        with self._lock:
+            self._entries[key] = (etag, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return etag, body
+
+
+def parse_query_parameters(query_string, index_columns):
+    """
+    Parse a query string into filters, a period range and group columns.
+
+    :param query_string: The URL query string.
+    :param index_columns: Columns that may be filtered on.
+    :return: Tuple of (filters, period_from, period_to, group_by, cache_key).
+    """
+    filters, period_from, period_to, group_by = {}, None, None, None
+    for name, value in parse_qsl(query_string, keep_blank_values=False):
+        if name == 'period_from':
+            period_from = int(value)
+        elif name == 'period_to':
+            period_to = int(value)
+        elif name == 'group_by':
+            group_by = [c for c in value.split(',') if c]
+        elif name in index_columns:
+            filters.setdefault(name, set()).update(value.split(','))
+        else:
+            raise ValueError(f"Unknown query parameter: {name}")
+    cache_key = (
+        tuple(sorted((column, tuple(sorted(values))) for column, values in filters.items())),
+        period_from,
+        period_to,
+        tuple(group_by or ()),
+    )
+    return filters, period_from, period_to, group_by, cache_key
+
+
+def make_handler(data_index, cache):
+    """
+    Create a request handler class bound to the given data index and result cache.
+    """
+
+    class QueryHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            try:
+                if url.path == '/query':
+                    filters, period_from, period_to, group_by, cache_key = parse_query_parameters(
+                        url.query, data_index.index_columns
+                    )
+                    entry = cache.get(cache_key)
+                    if entry is None:
+                        result = data_index.query(filters, period_from, period_to, group_by)
+                        body = json.dumps({
+                            'columns': list(result.columns),
+                            'rows': result.astype(object).where(result.notna(), None).values.tolist(),
+                        }).encode('utf-8')
+                        entry = cache.put(cache_key, body)
+                    self._send(*entry)
+                elif url.path == '/values':
+                    column = dict(parse_qsl(url.query)).get('column')
+                    if column not in data_index.indexes:
+                        raise ValueError(f"Not an indexed column: {column}")
+                    body = json.dumps(data_index.values(column)).encode('utf-8')
+                    self._send('"{}"'.format(hashlib.sha1(body).hexdigest()), body)
+                else:
+                    self.send_error(404)
+            except (ValueError, KeyError) as error:
+                self.send_error(400, str(error))
+
+        def _send(self, etag, body):
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('ETag', etag)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logging.debug(format, *args)
+
+    return QueryHandler
+
+
+def serve(filepath=OUTPUT_COMBINED_DF_FILEPATH, port=QUERY_SERVER_PORT, cache_size=QUERY_CACHE_SIZE):
+    """
+    Load and index the combined output once, then serve queries on localhost until interrupted.
+    """
+    data_index = CombinedDataIndex(filepath)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(data_index, QueryCache(cache_size)))
+    logging.info("Serving queries on http://127.0.0.1:%s", port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve filtered and aggregated slices of the combined output.")
+    parser.add_argument('--port', type=int, default=QUERY_SERVER_PORT)
+    parser.add_argument('--path', default=OUTPUT_COMBINED_DF_FILEPATH, help="Combined output CSV file to serve")
+    parser.add_argument('--cache-size', type=int, default=QUERY_CACHE_SIZE)
+    args = parser.parse_args()
+    serve(args.path, args.port, args.cache_size)
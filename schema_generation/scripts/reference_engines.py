@@ -0,0 +1,174 @@
+"""
+Reference implementations of the rule engine, the commodity tracer and the period completion, kept as oracles for
+the differential checks of differential.py.
+
+These are copies of apply_rules, trace_commodities, end_use_fractions, add_missing_periods and complete_periods (and
+of the flow lookups the tracer uses) as they were when the differential checks were introduced, without the
+instrumentation and rule telemetry hooks. They are slow on purpose and must not be optimised or changed: any new
+engine used in helpers.py or pipeline.py has to reproduce their results. If the intended behaviour of an engine
+changes, change the reference deliberately, in its own commit.
+
+See the README for the overall workflow.
+"""
+
+import numpy as np
+import pandas as pd
+
+from constants import *
+from helpers import sort_rules_by_specificity
+
+
+def apply_rules(schema, rules):
+    """
+    Apply rules, from least to most specific. Inplace rules set values of the matching rows (by index label),
+    newrow rules add a copy of each matching row with the actions applied, and drop rules drop the matching rows.
+
+    :param schema: DataFrame to apply rules on. Modified in place by inplace rules.
+    :param rules: Rules defined as a list of tuples with conditions and actions.
+    :return: Modified DataFrame with rules applied.
+    """
+    sorted_rules = sort_rules_by_specificity(rules)
+    new_rows = []
+    rows_to_drop = []
+    for condition, rule_type, actions in sorted_rules:
+        query_conditions_parts, local_vars = [], {}
+        for i, (key, value) in enumerate(condition.items()):
+            if pd.notna(value) and value != "":
+                query_placeholder = f"@value_{i}"
+                query_conditions_parts.append(f"`{key}` == {query_placeholder}")
+                local_vars[f"value_{i}"] = value
+        query_conditions = " & ".join(query_conditions_parts)
+        if rule_type == "inplace":
+            if not query_conditions:
+                continue
+            filtered_indices = schema.query(query_conditions, local_dict=local_vars).index
+            for column, value_to_set in actions.items():
+                if pd.notna(value_to_set) and value_to_set != "":
+                    schema.loc[filtered_indices, column] = value_to_set
+        elif rule_type == "newrow":
+            for _, row in schema.iterrows():
+                if all(row.get(key, None) == value for key, value in condition.items()):
+                    new_row = row.to_dict()
+                    new_row.update(actions)
+                    new_rows.append(new_row)
+        elif rule_type == "drop":
+            if not query_conditions:
+                continue
+            rows_to_drop.extend(schema.fillna('-').query(query_conditions, local_dict=local_vars).index.tolist())
+    schema = schema.drop(rows_to_drop).reset_index(drop=True)
+    if new_rows:
+        new_rows_df = pd.DataFrame(new_rows)
+        schema = pd.concat([schema, new_rows_df], ignore_index=True)
+    return schema
+
+
+def process_output_flows(process, scenario, period, df):
+    # Return a dictionary mapping commodity to value, excluding CO2
+    flows = df[(df['Process'] == process) &
+               (df['Scenario'] == scenario) &
+               (df['Period'] == period) &
+               (df['Attribute'] == 'VAR_FOut') &
+               ~(df['Commodity'].str.contains('CO2'))]
+    return flows.set_index('Commodity')['Value'].to_dict()
+
+
+def commodity_input_flows(commodity, scenario, period, df):
+    # Return a dictionary of processes the commodity flows into, mapped to flow values
+    return df[(df['Commodity'] == commodity) &
+              (df['Scenario'] == scenario) &
+              (df['Period'] == period) &
+              (df['Attribute'] == 'VAR_FIn')].set_index('Process')['Value'].to_dict()
+
+
+def flow_fractions(flow_dict):
+    # Return a dictionary of fractions for each flow
+    total = sum(flow_dict.values())
+    return {k: v / total for k, v in flow_dict.items()}
+
+
+def trace_commodities(ctx, process, scenario, period, df, path=None, fraction=1):
+    """
+    Trace the output commodities of a process through to end-use commodities, returning the fraction of its
+    output reaching each end-use commodity, keyed by the path (process, commodity, process, ..., commodity).
+
+    :param ctx: Anything with the commodity_units of the pipeline context.
+    """
+    if path is None:
+        path = []
+    current_path = path + [process]
+    output_flows = process_output_flows(process, scenario, period, df)
+    assert len(set(ctx.commodity_units[commodity] for commodity in output_flows)) == 1
+    output_fracs = flow_fractions(output_flows)
+    result = {}
+    for commodity in output_flows.keys():
+        input_flows = commodity_input_flows(commodity, scenario, period, df)
+        if not input_flows:
+            result[tuple(current_path + [commodity])] = fraction * output_fracs[commodity]
+        else:
+            input_fracs = flow_fractions(input_flows)
+            for downstream_process, input_fraction in input_fracs.items():
+                new_fraction = fraction * output_fracs[commodity] * input_fraction
+                result.update(trace_commodities(ctx, downstream_process, scenario, period, df, current_path + [commodity], new_fraction))
+    return result
+
+
+def end_use_fractions(ctx, process, scenario, period, df, filter_to_commodities=None):
+    """
+    Return the fraction of the output of a process used by each end-use process, with the commodity it is used
+    as and the fuel source process.
+
+    :param ctx: Anything with the commodity_units and end_use_processes of the pipeline context.
+    """
+    trace_result = trace_commodities(ctx, process, scenario, period, df)
+    assert abs(sum(trace_result.values()) - 1) < 1e-5
+    fractions = pd.DataFrame(
+         [{'Scenario': scenario,
+         'Attribute': 'VAR_FOut',
+         'Commodity': None,
+         'Process': process,
+         'Period': period,
+         'Value': None} for process in ctx.end_use_processes]
+    )
+    for process_chain, value in trace_result.items():
+        fuel_source_process = process_chain[0]
+        process = process_chain[-2]
+        commodity = process_chain[1]
+        fractions.loc[fractions['Process'] == process, 'Value'] = value
+        fractions.loc[fractions['Process'] == process, 'Commodity'] = commodity
+        fractions.loc[fractions['Process'] == process, 'FuelSourceProcess'] = fuel_source_process
+    if filter_to_commodities is not None:
+        fractions = fractions[(fractions['Commodity'].isin(filter_to_commodities)) | (fractions['Commodity'].isna())]
+    fractions.Value = fractions.Value / fractions.Value.sum()
+    return fractions
+
+
+def add_missing_periods(all_periods):
+    """
+    Return a function adding a zero-valued row to a group for each period of all_periods it has no row for.
+    """
+    def _add_missing_periods(group):
+        existing_periods = group['Period'].unique()
+        missing_periods = np.setdiff1d(all_periods, existing_periods)
+        if missing_periods.size > 0:
+            new_rows = pd.DataFrame({
+                'Period': missing_periods,
+                **{col: group.iloc[0][col] for col in group.columns if col != 'Period'}
+            })
+            new_rows['Value'] = 0
+            return pd.concat([group, new_rows], ignore_index=True)
+        return group
+    return _add_missing_periods
+
+
+def complete_periods(combined_df, thousand_vehicle_rules, all_periods=None):
+    """
+    Add zero-valued rows so that every category has a row for every period, aggregate over the group columns,
+    apply the vehicle unit rules and sort.
+    """
+    if all_periods is None:
+        all_periods = np.sort(combined_df['Period'].unique())
+    categories = [x for x in GROUP_COLUMNS if x != 'Period']
+    complete_df = combined_df.groupby(categories).apply(add_missing_periods(all_periods)).reset_index(drop=True)
+    complete_df = complete_df.groupby(GROUP_COLUMNS).agg(Value=('Value', 'sum')).reset_index()
+    complete_df = apply_rules(complete_df, thousand_vehicle_rules)
+    return complete_df.sort_values(by=GROUP_COLUMNS)
@@ -0,0 +1,218 @@
+"""
+End-to-end performance regression check of the schema and combined DataFrame generation.
+
+The complete pipeline, as run by generate_schema.py, generate_output_combined_df.py and the comparison scripts, is
+run several times on the same input files: the context and schema are built, the combined DataFrame is built, both
+are written (to a temporary directory) and compared with their references. Each run executes in a fresh process.
+The wall time of each stage is taken from the trace of the run (see instrumentation.py), and its median over the
+runs is compared with a stored baseline. The peak memory of each stage is measured in one more run, traced with
+tracemalloc: it is the peak of the memory allocated while the stage ran, above that allocated when it started.
+Unlike the peak RSS of the process, it does not hide a stage peaking below an earlier stage, and it does not vary
+between runs. tracemalloc slows the run down several times, so the times are not taken from that run.
+
+A stage regresses when its median time or peak memory exceeds the baseline by more than the threshold
+(a fraction of the baseline, e.g. 0.25 for 25%) and by more than a small absolute margin, so that short stages do
+not fail on noise. The script then exits with an error. The baseline also records the hashes of the input files,
+and a warning is logged if they have changed since it was written.
+
+Usage:
+python scripts/regression.py [--repeats N] [--threshold FRACTION] [--memory-threshold FRACTION] [--update-baseline]
+
+Run with --update-baseline to record the baseline, e.g. before a change, then run without it after the change.
+Without --update-baseline, the script fails if there is no baseline, rather than recording one and passing.
+The times and memory depend on the machine, so the baseline is not shared: it is kept in data/benchmarks, which git
+ignores, and must be recorded on the machine that runs the check (e.g. on a CI runner, from the base branch before
+checking a change), or given with --baseline.
+
+See the README for the overall workflow.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict
+
+from constants import *
+from instrumentation import tracing
+from pipeline import (PipelineInputs, PipelineOptions, build_context, build_schema, build_combined, write_outputs,
+                      compare_schema, compare_combined)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# The stages of a run, in order, named after the pipeline functions that run them
+STAGES = ["build_context", "build_schema", "build_combined", "write_outputs", "compare_schema", "compare_combined"]
+
+# Increases smaller than these are never reported as regressions
+MIN_REGRESSION_SECONDS = 0.1
+MIN_REGRESSION_MIB = 16
+
+
+def input_hashes(inputs):
+    """
+    Return the SHA-256 hash of each input file, by file name.
+    """
+    paths = list(inputs.scenario_files.values()) + [
+        inputs.commodity_filepath, inputs.process_filepath, inputs.commodity_groups_filepath, inputs.base_dd_filepath,
+        inputs.schema_technology_filepath, inputs.reference_schema_filepath, inputs.reference_combined_filepath,
+    ]
+    hashes = {}
+    for path in paths:
+        digest = hashlib.sha256()
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                digest.update(block)
+        hashes[os.path.basename(path)] = digest.hexdigest()
+    return hashes
+
+
+def run_once(inputs, options, memory=False):
+    """
+    Run the complete pipeline once and measure each stage.
+
+    :param memory: If True, measure the peak memory of each stage with tracemalloc, which slows the run down.
+    :return: Dictionary of the wall time in seconds and peak memory in MiB (None unless measured) of each stage, and
+             of the whole run ("total").
+    """
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as directory, tracing(label="regression", memory=memory) as trace:
+        ctx = build_context(inputs, options)
+        schema_df = build_schema(ctx)
+        complete_df = build_combined(ctx, schema_df)
+        write_outputs(schema_df, complete_df, os.path.join(directory, "schema_df.csv"),
+                      os.path.join(directory, "combined_df.csv"))
+        compare_schema(ctx.inputs, schema_df)
+        compare_combined(ctx.inputs, complete_df)
+    def mib(peak_memory):
+        return peak_memory / 2**20 if peak_memory is not None else None
+
+    measures = {span.name: {"wall_seconds": span.wall_seconds, "peak_memory_mib": mib(span.peak_memory)}
+                for span in trace.spans if span.depth == 0}
+    measures["total"] = {"wall_seconds": time.perf_counter() - start, "peak_memory_mib": mib(trace.peak_memory)}
+    return measures
+
+
+def run_repeats(inputs, options, repeats):
+    """
+    Run the pipeline several times, each in a fresh process, and once more to measure the peak memory. Return the
+    median wall time and the peak memory of each stage.
+    """
+    def run_in_fresh_process(memory):
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            return pool.submit(run_once, inputs, options, memory).result()
+
+    runs = []
+    for repeat in range(repeats):
+        runs.append(run_in_fresh_process(memory=False))
+        logging.info("Run %d of %d: %.2fs", repeat + 1, repeats, runs[-1]["total"]["wall_seconds"])
+    memory_run = run_in_fresh_process(memory=True)
+    logging.info("Memory run: %.2fs", memory_run["total"]["wall_seconds"])
+
+    return {stage: {"wall_seconds": statistics.median(run[stage]["wall_seconds"] for run in runs),
+                    "peak_memory_mib": memory_run[stage]["peak_memory_mib"]}
+            for stage in STAGES + ["total"]}
+
+
+def compare_with_baseline(stages, baseline, threshold, memory_threshold):
+    """
+    Compare the median measures of each stage with the baseline.
+
+    :param stages: The median measures of each stage, as returned by run_repeats.
+    :param baseline: The stored baseline.
+    :param threshold: Allowed relative increase of the wall time, e.g. 0.25 for 25%.
+    :param memory_threshold: Allowed relative increase of the peak memory.
+    :return: A tuple of the comparison table as text and the list of regressions.
+    """
+    lines = [f"{'Stage':<18} {'Base (s)':>9} {'Now (s)':>9} {'Change':>8} {'Base (MiB)':>11} {'Now (MiB)':>10} {'Change':>8}"]
+    regressions = []
+
+    def change(now, base, allowed, minimum, what, stage):
+        if now is None or base is None:
+            return f"{'-':>8}"
+        if now > base * (1 + allowed) and now - base > minimum:
+            regressions.append(f"{stage}: {what} {base:.2f} -> {now:.2f}")
+            flag = "!"
+        else:
+            flag = " "
+        return f"{(now - base) / base:>+7.0%}{flag}" if base else f"{'-':>7}{flag}"
+
+    def cell(value, width):
+        return f"{value:>{width}.2f}" if value is not None else f"{'-':>{width}}"
+
+    for stage, now in stages.items():
+        base = baseline["stages"].get(stage, {})
+        base_seconds, base_mib = base.get("wall_seconds"), base.get("peak_memory_mib")
+        lines.append(
+            f"{stage:<18} {cell(base_seconds, 9)} {cell(now['wall_seconds'], 9)} "
+            f"{change(now['wall_seconds'], base_seconds, threshold, MIN_REGRESSION_SECONDS, 'seconds', stage)} "
+            f"{cell(base_mib, 11)} {cell(now['peak_memory_mib'], 10)} "
+            f"{change(now['peak_memory_mib'], base_mib, memory_threshold, MIN_REGRESSION_MIB, 'MiB', stage)}"
+        )
+    return "\n".join(lines), regressions
+
+
+def read_baseline(path=REGRESSION_BASELINE_FILEPATH):
+    """
+    Return the stored baseline, or None if there is none.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def write_baseline(stages, inputs, options, repeats, path=REGRESSION_BASELINE_FILEPATH):
+    """
+    Write the median measures of each stage as the baseline, with the input hashes and options of the runs.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump({
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "repeats": repeats,
+            "options": asdict(options),
+            "inputs": input_hashes(inputs),
+            "stages": stages,
+        }, file, indent=1)
+    logging.info("Baseline written to %s", path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeats', type=int, default=3, help="Number of timed runs of the pipeline")
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="Allowed relative increase of the time of a stage (default: 0.25)")
+    parser.add_argument('--memory-threshold', type=float, default=0.25,
+                        help="Allowed relative increase of the peak memory of a stage (default: 0.25)")
+    parser.add_argument('--update-baseline', action='store_true', help="Record the measures as the new baseline")
+    parser.add_argument('--baseline', default=REGRESSION_BASELINE_FILEPATH, help="Path of the baseline file")
+    args = parser.parse_args()
+
+    inputs, options = PipelineInputs(), PipelineOptions()
+    baseline = read_baseline(args.baseline)
+    if baseline is None and not args.update_baseline:
+        logging.error("No baseline in %s: record one with --update-baseline on this machine first", args.baseline)
+        sys.exit(1)
+    stages = run_repeats(inputs, options, args.repeats)
+    if args.update_baseline:
+        write_baseline(stages, inputs, options, args.repeats, args.baseline)
+        sys.exit(0)
+
+    if baseline["inputs"] != input_hashes(inputs) or baseline["options"] != asdict(options):
+        logging.warning("The inputs or options have changed since the baseline was recorded (%s)", baseline["created"])
+    if not any("peak_memory_mib" in stage for stage in baseline["stages"].values()):
+        logging.warning("The baseline has no peak memory of the stages (it measured the RSS increase): run with "
+                        "--update-baseline to record it again")
+    table, regressions = compare_with_baseline(stages, baseline, args.threshold, args.memory_threshold)
+    logging.info("Median of %d runs against the baseline of %s:\n%s", args.repeats, baseline["created"], table)
+    if regressions:
+        logging.error("Stages regressed past the threshold:\n%s", "\n".join(regressions))
+        sys.exit(1)
+    logging.info("No stage regressed past the threshold")
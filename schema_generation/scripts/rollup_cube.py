@@ -0,0 +1,96 @@
+"""
+Builds a precomputed rollup cube of the combined DataFrame for the visualisation.
+
+The app sums combined_df over the Sector -> Subsector -> Technology_Group -> Technology and
+FuelGroup -> Fuel hierarchies every time a picker changes. This module computes all of those totals
+once, for every Scenario, Parameters, Unit and Period. It works like SQL GROUPING SETS over the
+cross product of the two hierarchies. Each row is tagged with the level of each hierarchy it was
+aggregated to (SectorLevel, FuelLevel). Rolled-up hierarchy columns hold ROLLUP_TOTAL_LABEL.
+
+Usage (build the cube from the existing output CSV):
+python scripts/rollup_cube.py
+
+See the README for the overall workflow.
+"""
+
+import logging
+import pandas as pd
+
+from constants import *
+from helpers import save
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def _hierarchy_levels(hierarchy):
+    """
+    List the grouping levels of a hierarchy, from the grand total down to the finest level.
+
+    :param hierarchy: List of columns from the coarsest to the finest level.
+    :return: List of (level label, grouped columns) tuples.
+    """
+    return [(ROLLUP_TOTAL_LABEL, [])] + [(hierarchy[i], hierarchy[:i + 1]) for i in range(len(hierarchy))]
+
+
+def build_rollup_cube(df, base_columns=None, sector_hierarchy=None, fuel_hierarchy=None):
+    """
+    Precompute the sums of Value for every combination of sector and fuel hierarchy levels.
+
+    The leaf level is aggregated from df once; every coarser level is then aggregated from the leaf level,
+    which is much smaller than df.
+
+    :param df: The combined DataFrame (e.g. complete_df).
+    :param base_columns: Columns kept at every level (default: Scenario, Parameters, Unit, Period).
+    :param sector_hierarchy: Sector hierarchy columns, from the coarsest to the finest.
+    :param fuel_hierarchy: Fuel hierarchy columns, from the coarsest to the finest.
+    :return: DataFrame with the base columns, the hierarchy columns, 'SectorLevel', 'FuelLevel' and 'Value'.
+    """
+    base_columns = base_columns or ROLLUP_BASE_COLUMNS
+    sector_hierarchy = sector_hierarchy or ROLLUP_SECTOR_HIERARCHY
+    fuel_hierarchy = fuel_hierarchy or ROLLUP_FUEL_HIERARCHY
+    hierarchy_columns = sector_hierarchy + fuel_hierarchy
+    leaf = df.groupby(base_columns + hierarchy_columns, dropna=False).agg(Value=('Value', 'sum')).reset_index()
+    cubes = []
+    for sector_level, sector_columns in _hierarchy_levels(sector_hierarchy):
+        for fuel_level, fuel_columns in _hierarchy_levels(fuel_hierarchy):
+            grouped = leaf.groupby(base_columns + sector_columns + fuel_columns, dropna=False)
+            level_df = grouped.agg(Value=('Value', 'sum')).reset_index()
+            for column in hierarchy_columns:
+                if column not in level_df.columns:
+                    level_df[column] = ROLLUP_TOTAL_LABEL
+            level_df['SectorLevel'] = sector_level
+            level_df['FuelLevel'] = fuel_level
+            cubes.append(level_df)
+    cube = pd.concat(cubes, ignore_index=True)
+    cube = cube[base_columns + hierarchy_columns + ['SectorLevel', 'FuelLevel', 'Value']]
+    logging.info("Built rollup cube with %s rows from %s rows", len(cube), len(df))
+    return cube
+
+
+def lookup_rollup(cube, sector_level=ROLLUP_TOTAL_LABEL, fuel_level=ROLLUP_TOTAL_LABEL, **filters):
+    """
+    Look up precomputed totals from the cube at the given hierarchy levels.
+
+    Example: emissions by Subsector within Transport, across all fuels:
+    lookup_rollup(cube, sector_level="Subsector", Scenario="Kea", Parameters="Emissions", Sector="Transport")
+
+    :param cube: DataFrame returned by build_rollup_cube.
+    :param sector_level: Sector hierarchy level to return, e.g. 'Subsector', or ROLLUP_TOTAL_LABEL.
+    :param fuel_level: Fuel hierarchy level to return, e.g. 'FuelGroup', or ROLLUP_TOTAL_LABEL.
+    :param filters: Column values to match. A list matches any of its values.
+    :return: The matching rows of the cube.
+    """
+    mask = (cube['SectorLevel'] == sector_level) & (cube['FuelLevel'] == fuel_level)
+    for column, value in filters.items():
+        if isinstance(value, (list, set, tuple)):
+            mask &= cube[column].isin(value)
+        else:
+            mask &= cube[column] == value
+    return cube[mask]
+
+
+if __name__ == "__main__":
+    combined_df = pd.read_csv(OUTPUT_COMBINED_DF_FILEPATH, low_memory=False)
+    cube = build_rollup_cube(combined_df)
+    save(cube, OUTPUT_ROLLUP_CUBE_FILEPATH)
+    logging.info("The rollup cube has been saved to %s", OUTPUT_ROLLUP_CUBE_FILEPATH)
@@ -0,0 +1,245 @@
+"""
+Per-rule telemetry for the rulesets: which rules match, which overwrite each other, and which are expensive.
+
+While telemetry is being collected, apply_rules records for each rule the number of rows it matched, the cells it
+set, the cells it overwrote (those already holding another value), the time spent, and which later rules overwrote
+the cells it set. Within a ruleset, rules are applied from least to most specific, so a rule whose cells are all
+overwritten by later rules has no effect: it is shadowed. prune_rules registers every rule of a ruleset, so the
+rules it prunes are counted as never matching.
+
+Rules are identified by the name of their ruleset, their condition, type and actions, and the statistics of a
+rule applied several times (e.g. the allocation rulesets, applied to each kind of allocated row) are summed. The
+report lists:
+* dead rules, which never matched a row,
+* fully shadowed rules, which set cells but whose cells were all overwritten by later rules,
+* the most expensive rules,
+* the MISSING_ROWS that the rules already generate.
+
+Telemetry is off unless a script enables it, e.g. with --rule-telemetry; apply_rules then only checks that no
+collection is active. It is held in a context variable like the trace of instrumentation.py, and rules applied in
+worker processes (e.g. the shards of apply_rulesets_sharded) are not recorded.
+
+See the README for the overall workflow.
+"""
+
+import contextvars
+import logging
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+import pandas as pd
+
+from constants import *
+
+_ACTIVE_TELEMETRY = contextvars.ContextVar("active_rule_telemetry", default=None)
+
+
+def _identity(mapping):
+    # Rule conditions and actions may hold NaN, which does not compare equal to itself
+    return tuple((key, repr(value)) for key, value in mapping.items())
+
+
+def describe_rule(condition, rule_type, actions):
+    """
+    Return a short description of a rule, e.g. for the report.
+    """
+    def pairs(mapping):
+        return ", ".join(f"{key}={value}" for key, value in mapping.items())
+    return f"{rule_type} if {pairs(condition)}: {pairs(actions) if rule_type != 'drop' else 'drop'}"
+
+
+@dataclass
+class RuleStats:
+    """
+    The statistics of one rule, summed over its applications.
+    """
+    ruleset: str
+    condition: dict
+    rule_type: str
+    actions: dict
+    applications: int = 0
+    matched_rows: int = 0
+    set_cells: int = 0
+    overwritten_cells: int = 0
+    shadowed_cells: int = 0
+    seconds: float = 0.0
+    shadowed_by: Counter = field(default_factory=Counter)
+
+    @property
+    def dead(self):
+        return self.matched_rows == 0
+
+    @property
+    def fully_shadowed(self):
+        return self.set_cells > 0 and self.shadowed_cells == self.set_cells
+
+
+class RuleApplication:
+    """
+    The record of one call of apply_rules, tracking which rule last set each cell.
+    """
+
+    def __init__(self, telemetry, label, sorted_rules):
+        self.stats = [telemetry.stats_for(label, rule) for rule in sorted_rules]
+        self._owners = {}
+        self._start = None
+        for stats in self.stats:
+            stats.applications += 1
+
+    def start(self):
+        self._start = time.perf_counter()
+
+    def inplace(self, position, schema, labels, actions):
+        """
+        Record the cells an inplace rule is about to set, before they are set.
+        """
+        stats = self.stats[position]
+        stats.matched_rows += len(labels)
+        labels = labels.unique()
+        for column, value in actions.items():
+            if pd.isna(value) or value == "":
+                continue
+            if column in schema.columns and len(labels):
+                current = schema.loc[labels, column]
+                stats.overwritten_cells += int((current.notna() & (current != value)).sum())
+            stats.set_cells += len(labels)
+            for label in labels:
+                owner = self._owners.get((label, column))
+                if owner is not None and owner != position:
+                    self.stats[owner].shadowed_cells += 1
+                    self.stats[owner].shadowed_by[describe_rule(*self._rule(position))] += 1
+                self._owners[(label, column)] = position
+
+    def matched(self, position, rows):
+        """
+        Record the rows a newrow or drop rule matched.
+        """
+        self.stats[position].matched_rows += rows
+
+    def finish(self, position):
+        self.stats[position].seconds += time.perf_counter() - self._start
+
+    def _rule(self, position):
+        stats = self.stats[position]
+        return stats.condition, stats.rule_type, stats.actions
+
+
+class RuleTelemetry:
+    """
+    The statistics of every rule registered or applied while telemetry is collected.
+    """
+
+    def __init__(self):
+        self.stats = {}
+        self.missing_rows = None
+
+    def stats_for(self, label, rule):
+        condition, rule_type, actions = rule
+        key = (label, _identity(condition), rule_type, _identity(actions))
+        if key not in self.stats:
+            self.stats[key] = RuleStats(label, condition, rule_type, actions)
+        return self.stats[key]
+
+    def register(self, label, rules):
+        """
+        Register the rules of a ruleset, so that those that are never applied are reported as dead.
+        """
+        for rule in rules:
+            self.stats_for(label, rule)
+
+    def application(self, label, sorted_rules):
+        """
+        Start recording a call of apply_rules.
+        """
+        return RuleApplication(self, label, sorted_rules)
+
+    def record_missing_rows(self, generated_df, missing_rows):
+        """
+        Record the MISSING_ROWS that the rules already generate.
+        """
+        columns = list(missing_rows.columns)
+        self.missing_rows = (pd.merge(missing_rows, generated_df[columns].drop_duplicates(), on=columns, how="inner"),
+                             len(missing_rows))
+
+    def to_frame(self):
+        """
+        Return a DataFrame with the statistics of each rule, in the order in which they were registered.
+        """
+        return pd.DataFrame([{
+            "Ruleset": stats.ruleset,
+            "Rule": describe_rule(stats.condition, stats.rule_type, stats.actions),
+            "Applications": stats.applications,
+            "MatchedRows": stats.matched_rows,
+            "SetCells": stats.set_cells,
+            "OverwrittenCells": stats.overwritten_cells,
+            "ShadowedCells": stats.shadowed_cells,
+            "Seconds": stats.seconds,
+            "Dead": stats.dead,
+            "FullyShadowed": stats.fully_shadowed,
+            "ShadowedBy": "; ".join(rule for rule, _ in stats.shadowed_by.most_common(3)),
+        } for stats in self.stats.values()])
+
+    def report(self, top=10):
+        """
+        Return a text report of the dead and fully shadowed rules of each ruleset and of the most expensive rules.
+
+        :param top: Number of rules listed in each section.
+        """
+        df = self.to_frame()
+        if df.empty:
+            return "No rules were applied."
+        lines = ["Rules by ruleset (total, dead, fully shadowed, seconds):"]
+        for ruleset, rules in df.groupby("Ruleset", sort=False):
+            lines.append(f"  {ruleset:<45} {len(rules):6d} {int(rules.Dead.sum()):6d} "
+                         f"{int(rules.FullyShadowed.sum()):6d} {rules.Seconds.sum():8.2f}s")
+        for title, rules in [("Dead rules", df[df.Dead]), ("Fully shadowed rules", df[df.FullyShadowed])]:
+            lines.append(f"{title} ({len(rules)}, first {min(top, len(rules))}):")
+            lines += [f"  [{row.Ruleset}] {row.Rule}" for row in rules.head(top).itertuples()]
+        lines.append("Most expensive rules:")
+        lines += [f"  {row.Seconds:8.3f}s {row.MatchedRows:7d} rows [{row.Ruleset}] {row.Rule}"
+                  for row in df.sort_values("Seconds", ascending=False).head(top).itertuples()]
+        if self.missing_rows is not None:
+            redundant, total = self.missing_rows
+            lines.append(f"MISSING_ROWS already generated by the rules: {len(redundant)} of {total}")
+        return "\n".join(lines)
+
+
+def active_rule_telemetry():
+    """
+    Return the active RuleTelemetry, or None if no telemetry is being collected.
+    """
+    return _ACTIVE_TELEMETRY.get()
+
+
+def rule_telemetry_filepath(label):
+    """
+    Return the path of the rule telemetry CSV file of a run of a script, from the script name and the time.
+    """
+    return os.path.join(TRACE_DIR, f"rule_telemetry_{label}_{time.strftime('%Y%m%d_%H%M%S')}.csv")
+
+
+@contextmanager
+def collecting_rule_telemetry(path=None, enabled=True):
+    """
+    Collect rule telemetry for the duration of the block. On exit, write the statistics of each rule to path
+    (if given) as CSV and log the report.
+
+    :param path: Path of the CSV file, e.g. from rule_telemetry_filepath.
+    :param enabled: If False, nothing is collected and None is yielded.
+    """
+    if not enabled:
+        yield None
+        return
+    telemetry = RuleTelemetry()
+    token = _ACTIVE_TELEMETRY.set(telemetry)
+    try:
+        yield telemetry
+    finally:
+        _ACTIVE_TELEMETRY.reset(token)
+        if path is not None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            telemetry.to_frame().to_csv(path, index=False)
+            logging.info("Rule telemetry written to %s", path)
+            logging.info("Rule telemetry report:\n%s", telemetry.report())
@@ -12,105 +12,15 @@ to most specific. A more specific rule's condition dictionary has a superset of
 
 When a sequence of rulesets is applied, later rulesets can override the effects of earlier ones.
 
-The rulesets are applied in a sequence determined by the RULESETS list (defined at the end of this module)
-to ensure data consistency and completeness.
+The rulesets are applied in a sequence determined by the RULESET_ORDER list to ensure data consistency and
+completeness. build_rulesets builds them from the given input files; the legacy module-level rulesets (e.g.
+process_rules, and RULESETS in order) are built from the default input files when first accessed.
 """
+import functools
 import pandas as pd
 from constants import *
 from helpers import *
 
-schema = pd.read_csv(REFERENCE_SCHEMA_FILEPATH).drop_duplicates()
-schema = schema[OUT_COLS].dropna().drop_duplicates().sort_values(by=OUT_COLS)
-
-# Generate rulesets for 'Set' attributes and descriptions
-commodity_set_rules = df_to_ruleset(
-    df=pd.read_csv(ITEMS_LIST_COMMODITY_CSV),
-    target_column_map={"Name": "Commodity"},
-    parse_column="Set",
-    separator="-:-",
-    schema=["Set"],
-    rule_type="inplace",
-)
-
-process_set_rules = df_to_ruleset(
-    df=pd.read_csv(ITEMS_LIST_PROCESS_CSV),
-    target_column_map={"Name": "Process"},
-    parse_column="Set",
-    separator="-:-",
-    schema=["Set"],
-    rule_type="inplace",
-)
-
-commodity_fuel_rules = df_to_ruleset(
-    df=pd.read_csv(ITEMS_LIST_COMMODITY_CSV),
-    target_column_map={"Name": "Commodity"},
-    parse_column="Description",
-    separator="-:-",
-    schema=["Fuel", ""],
-    rule_type="inplace",
-)
-
-commodity_enduse_rules = df_to_ruleset(
-    df=pd.read_csv(ITEMS_LIST_COMMODITY_CSV),
-    target_column_map={"Name": "Commodity"},
-    parse_column="Description",
-    separator="-:-",
-    schema=["", "Enduse"],
-    rule_type="inplace",
-)
-
-process_rules = df_to_ruleset(
-    df=pd.read_csv(ITEMS_LIST_PROCESS_CSV),
-    target_column_map={"Name": "Process"},
-    parse_column="Description",
-    separator="-:-",
-    schema=["Sector", "Subsector", "Technology", ""],
-    rule_type="inplace",
-)
-
-# Keep Sector, Subsector,.. Technology, Fuel
-# Drop Enduse, ParametersOverride, DisplayCapacity
-
-process_fuel_rules = df_to_ruleset(
-    df=pd.read_csv(ITEMS_LIST_PROCESS_CSV),
-    target_column_map={"Name": "Process"},
-    parse_column="Description",
-    separator="-:-",
-    schema=["", "", "", "Fuel"],
-    rule_type="inplace",
-)
-
-
-# Generate Enduse attributions for Processes based on their first output commodity
-_cg_df = process_map_from_commodity_groups(ITEMS_LIST_COMMODITY_GROUPS_CSV)
-process_enduse_df = apply_rules(_cg_df[_cg_df.Attribute=='VAR_FOut'], commodity_enduse_rules)[['Process', 'Enduse']].dropna()
-# Take the first enduse for each process. This is a temporary solution until we have a better way to handle multiple enduses
-# TODO: can we determine the 'main' enduse for each process, in terms of the way its capacity is defined?
-process_enduse_df = process_enduse_df.groupby('Process').first().reset_index()
-process_enduse_rules = df_to_ruleset(
-    df=process_enduse_df,
-    target_column_map={"Process": "Process"},
-    parse_column="Enduse",
-    separator="-:-",
-    schema=["Enduse"],
-    rule_type="inplace",
-)
-# Label process inputs with the process Enduse
-process_input_enduse_rules = [(dict(condition, **{'Attribute': 'VAR_FIn'}), rule_type, updates)
-    for condition, rule_type, updates in process_enduse_rules]
-# Label process capacities with the process Enduse
-process_capacity_enduse_rules = [(dict(condition, **{'Attribute': 'VAR_Cap'}), rule_type, updates) 
-    for condition, rule_type, updates in process_enduse_rules]
-# Label process outputs with the commodity Enduse (where applicable)
-commodity_enduse_rules = [(dict(condition, **{'Attribute': 'VAR_FOut'}), rule_type, updates)
-    for condition, rule_type, updates in commodity_enduse_rules]
-
-# Rules for assigning units to commodities based on the TIMES base.dd definitions
-commodity_unit_rules = base_dd_commodity_unit_rules(
-    filepath=BASE_DD_FILEPATH,
-    rule_type="inplace",
-    )
-
 SUPPRESS_PROCESS_CAPACITY_RULES = [
     # If a VAR_Cap row has DisplayCapacity not equal to TRUE, remove it by setting Attribute to None
     ({"Attribute": "VAR_Cap", "DisplayCapacity": "-"}, "drop", {}),
@@ -179,9 +89,6 @@ PARAMS_RULES = [
     ({"Attribute": "VAR_FOut", "Unit": "PJ", "Enduse": "Feedstock"}, "drop", {}),
 ]
 
-emissions_dict = parse_emissions_factors(BASE_DD_FILEPATH)
-emissions_rules = create_emissions_rules(emissions_dict)
-
 SUPPRESS_VAR_FIn_RENEWABLES = [
     ({"Attribute": "VAR_FIn", "Sector": "Electricity", "Subsector": "Hydro"}, "drop", {}),
     ({"Attribute": "VAR_FIn", "Sector": "Electricity", "Subsector": "Solar"}, "drop", {}),
@@ -189,23 +96,208 @@ SUPPRESS_VAR_FIn_RENEWABLES = [
     ({"Attribute": "VAR_FIn", "Sector": "Electricity", "Subsector": "Geothermal"}, "drop", {}),
 ]
 
-RULESETS = [
-        ("commodity_set_rules", commodity_set_rules),
-        ("process_set_rules", process_set_rules),
-        ("process_rules", process_rules),
-        ("process_fuel_rules", process_fuel_rules),
-        ("process_input_enduse_rules", process_input_enduse_rules),
-        ("process_capacity_enduse_rules", process_capacity_enduse_rules),
-        ("commodity_enduse_rules", commodity_enduse_rules),
-        ("commodity_fuel_rules", commodity_fuel_rules),
-        ("commodity_unit_rules", commodity_unit_rules),
-        #("SUPPRESS_PROCESS_CAPACITY_RULES", SUPPRESS_PROCESS_CAPACITY_RULES),
-        ("SUPPRESS_VAR_FIn_RENEWABLES", SUPPRESS_VAR_FIn_RENEWABLES),
-        ("FUEL_TO_FUELGROUP_RULES", FUEL_TO_FUELGROUP_RULES),
-        ("SECTOR_CAPACITY_RULES", SECTOR_CAPACITY_RULES),
-        ("PARAMS_RULES", PARAMS_RULES),
-        ("EMISSIONS_RULES", emissions_rules),
-    ]
+# Order in which the rulesets are applied to the schema DataFrame
+RULESET_ORDER = [
+    "commodity_set_rules",
+    "process_set_rules",
+    "process_rules",
+    "process_fuel_rules",
+    "process_input_enduse_rules",
+    "process_capacity_enduse_rules",
+    "commodity_enduse_rules",
+    "commodity_fuel_rules",
+    "commodity_unit_rules",
+    #"SUPPRESS_PROCESS_CAPACITY_RULES",
+    "SUPPRESS_VAR_FIn_RENEWABLES",
+    "FUEL_TO_FUELGROUP_RULES",
+    "SECTOR_CAPACITY_RULES",
+    "PARAMS_RULES",
+    "EMISSIONS_RULES",
+]
+
+
+# Rulesets parsed from the Items Lists. Each is built with df_to_ruleset from the given Items List ('commodity' or
+# 'process'), mapping its Name column to the target column, and splitting parse_column with the "-:-" separator
+# into the parts given by the schema. 'commodity_description_enduse_rules' labels commodities with their Enduse;
+# it is only used to derive the Enduse rulesets (see build_enduse_rulesets).
+ITEMS_LIST_RULESETS = {
+    "commodity_set_rules": ("commodity", "Commodity", "Set", ["Set"]),
+    "process_set_rules": ("process", "Process", "Set", ["Set"]),
+    "commodity_fuel_rules": ("commodity", "Commodity", "Description", ["Fuel", ""]),
+    "commodity_description_enduse_rules": ("commodity", "Commodity", "Description", ["", "Enduse"]),
+    # Keep Sector, Subsector,.. Technology, Fuel
+    # Drop Enduse, ParametersOverride, DisplayCapacity
+    "process_rules": ("process", "Process", "Description", ["Sector", "Subsector", "Technology", ""]),
+    "process_fuel_rules": ("process", "Process", "Description", ["", "", "", "Fuel"]),
+}
+
+
+def build_items_list_ruleset(name, filepath):
+    """
+    Build one of the rulesets in ITEMS_LIST_RULESETS.
+
+    :param name: Name of the ruleset.
+    :param filepath: Path to the Items List file it is parsed from.
+    """
+    _, target_column, parse_column, schema = ITEMS_LIST_RULESETS[name]
+    return df_to_ruleset(
+        df=pd.read_csv(filepath),
+        target_column_map={"Name": target_column},
+        parse_column=parse_column,
+        separator="-:-",
+        schema=schema,
+        rule_type="inplace",
+    )
+
+
+def build_enduse_rulesets(commodity_description_enduse_rules, commodity_groups_filepath):
+    """
+    Build the rulesets labelling process inputs, capacities and outputs with their Enduse.
+
+    :param commodity_description_enduse_rules: The 'commodity_description_enduse_rules' ruleset.
+    :param commodity_groups_filepath: Path to the Items List file for commodity groups.
+    :return: Dictionary mapping ruleset names to rules.
+    """
+    # Generate Enduse attributions for Processes based on their first output commodity
+    _cg_df = process_map_from_commodity_groups(commodity_groups_filepath)
+    process_enduse_df = apply_rules(_cg_df[_cg_df.Attribute=='VAR_FOut'].copy(), commodity_description_enduse_rules,
+                                    'commodity_description_enduse_rules')[['Process', 'Enduse']].dropna()
+    # Take the first enduse for each process. This is a temporary solution until we have a better way to handle multiple enduses
+    # TODO: can we determine the 'main' enduse for each process, in terms of the way its capacity is defined?
+    process_enduse_df = process_enduse_df.groupby('Process').first().reset_index()
+    process_enduse_rules = df_to_ruleset(
+        df=process_enduse_df,
+        target_column_map={"Process": "Process"},
+        parse_column="Enduse",
+        separator="-:-",
+        schema=["Enduse"],
+        rule_type="inplace",
+    )
+    return {
+        "process_enduse_rules": process_enduse_rules,
+        # Label process inputs with the process Enduse
+        "process_input_enduse_rules": [(dict(condition, **{'Attribute': 'VAR_FIn'}), rule_type, updates)
+            for condition, rule_type, updates in process_enduse_rules],
+        # Label process capacities with the process Enduse
+        "process_capacity_enduse_rules": [(dict(condition, **{'Attribute': 'VAR_Cap'}), rule_type, updates)
+            for condition, rule_type, updates in process_enduse_rules],
+        # Label process outputs with the commodity Enduse (where applicable)
+        "commodity_enduse_rules": [(dict(condition, **{'Attribute': 'VAR_FOut'}), rule_type, updates)
+            for condition, rule_type, updates in commodity_description_enduse_rules],
+    }
+
+
+def build_base_dd_rulesets(base_dd_filepath):
+    """
+    Build the rulesets derived from base.dd: commodity units, and emissions rows for fuel inputs.
+
+    :param base_dd_filepath: Path to the TIMES base.dd file.
+    :return: Dictionary mapping ruleset names to rules.
+    """
+    return {
+        # Rules for assigning units to commodities based on the TIMES base.dd definitions
+        "commodity_unit_rules": base_dd_commodity_unit_rules(
+            filepath=base_dd_filepath,
+            rule_type="inplace",
+            ),
+        "EMISSIONS_RULES": create_emissions_rules(parse_emissions_factors(base_dd_filepath)),
+    }
+
+
+def assemble_rulesets(items_list_rulesets, enduse_rulesets, base_dd_rulesets):
+    """
+    Combine the built rulesets with the predefined ones.
+
+    :param items_list_rulesets: Dictionary of the rulesets in ITEMS_LIST_RULESETS.
+    :param enduse_rulesets: Dictionary returned by build_enduse_rulesets.
+    :param base_dd_rulesets: Dictionary returned by build_base_dd_rulesets.
+    :return: Dictionary mapping ruleset names to rules, as returned by build_rulesets.
+    """
+    rulesets = {name: rules for name, rules in items_list_rulesets.items() if name != "commodity_description_enduse_rules"}
+    rulesets.update(enduse_rulesets)
+    rulesets.update(base_dd_rulesets)
+    rulesets.update({
+        "SUPPRESS_PROCESS_CAPACITY_RULES": SUPPRESS_PROCESS_CAPACITY_RULES,
+        "SUPPRESS_VAR_FIn_RENEWABLES": SUPPRESS_VAR_FIn_RENEWABLES,
+        "FUEL_TO_FUELGROUP_RULES": FUEL_TO_FUELGROUP_RULES,
+        "SECTOR_CAPACITY_RULES": SECTOR_CAPACITY_RULES,
+        "PARAMS_RULES": PARAMS_RULES,
+    })
+    return rulesets
+
+
+def build_rulesets(commodity_filepath=ITEMS_LIST_COMMODITY_CSV, process_filepath=ITEMS_LIST_PROCESS_CSV,
+                   commodity_groups_filepath=ITEMS_LIST_COMMODITY_GROUPS_CSV, base_dd_filepath=BASE_DD_FILEPATH):
+    """
+    Build all rulesets from the Items Lists and base.dd. Nothing is shared between calls, so rulesets built
+    from different inputs can be used side by side.
+
+    :param commodity_filepath: Path to the Items List file for commodities.
+    :param process_filepath: Path to the Items List file for processes.
+    :param commodity_groups_filepath: Path to the Items List file for commodity groups.
+    :param base_dd_filepath: Path to the TIMES base.dd file.
+    :return: Dictionary mapping ruleset names to rules. It holds every ruleset in RULESET_ORDER, and also
+             'process_enduse_rules', which is only used for the allocated rows of the combined DataFrame.
+    """
+    filepaths = {"commodity": commodity_filepath, "process": process_filepath}
+    items_list_rulesets = {name: build_items_list_ruleset(name, filepaths[spec[0]])
+                           for name, spec in ITEMS_LIST_RULESETS.items()}
+    enduse_rulesets = build_enduse_rulesets(items_list_rulesets["commodity_description_enduse_rules"], commodity_groups_filepath)
+    return assemble_rulesets(items_list_rulesets, enduse_rulesets, build_base_dd_rulesets(base_dd_filepath))
+
+
+def ordered_rulesets(rulesets):
+    """
+    Return the rulesets to apply to the schema DataFrame as (name, rules) tuples, in RULESET_ORDER.
+
+    :param rulesets: Dictionary returned by build_rulesets.
+    """
+    return [(name, rulesets[name]) for name in RULESET_ORDER]
+
+
+# Legacy module-level names of the rulesets built from the default input files, and the ruleset names they refer to.
+# They are only built when first accessed (see __getattr__), so that importing this module does not read the inputs.
+LEGACY_RULESET_NAMES = {
+    "commodity_set_rules": "commodity_set_rules",
+    "process_set_rules": "process_set_rules",
+    "process_rules": "process_rules",
+    "process_fuel_rules": "process_fuel_rules",
+    "process_enduse_rules": "process_enduse_rules",
+    "process_input_enduse_rules": "process_input_enduse_rules",
+    "process_capacity_enduse_rules": "process_capacity_enduse_rules",
+    "commodity_enduse_rules": "commodity_enduse_rules",
+    "commodity_fuel_rules": "commodity_fuel_rules",
+    "commodity_unit_rules": "commodity_unit_rules",
+    "emissions_rules": "EMISSIONS_RULES",
+}
+
+
+@functools.lru_cache(maxsize=None)
+def default_rulesets():
+    """
+    Return the rulesets built from the default input files, building them on the first call.
+    """
+    return build_rulesets()
+
+
+@functools.lru_cache(maxsize=None)
+def reference_schema():
+    """
+    Return the distinct rows of the reference schema, reading it on the first call.
+    """
+    schema = pd.read_csv(REFERENCE_SCHEMA_FILEPATH).drop_duplicates()
+    return schema[OUT_COLS].dropna().drop_duplicates().sort_values(by=OUT_COLS)
+
+
+def __getattr__(name):
+    # Called for the names not defined in the module: the legacy rulesets, RULESETS and schema
+    if name in LEGACY_RULESET_NAMES:
+        return default_rulesets()[LEGACY_RULESET_NAMES[name]]
+    if name == "RULESETS":
+        return ordered_rulesets(default_rulesets())
+    if name == "schema":
+        return reference_schema()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 MISSING_ROWS = pd.DataFrame([
     {'Attribute':  'VAR_FIn', 'Process': 'R_DDW-SH_MSHP-ELC',           'Commodity':   'RESELC', 'Sector': 'Residential', 'Subsector': 'Detached Dwellings',       'Technology':    'Heat Pump (Multi-Split)', 'Fuel':    'Electricity', 'Enduse':          'Space Cooling', 'Unit':     'PJ', 'Parameters': 'Fuel Consumption', 'FuelGroup': 'Electricity'},
@@ -0,0 +1,93 @@
+"""
+Builds precomputed delta and ratio tables between pairs of scenarios in the combined DataFrame.
+
+For each configured (scenario, baseline) pair, the two scenario slices are aligned in a single keyed
+join on the group columns (excluding Scenario). A category missing from one side counts as zero.
+Only categories whose values differ by more than a tolerance are kept, so the table stays small. A pair with a
+scenario that is not in the DataFrame (e.g. in a single-scenario run) is skipped with a warning.
+Scenario-comparison views and regression reviews can read it directly.
+
+Usage (build the tables from the existing output CSV):
+python scripts/scenario_deltas.py
+
+See the README for the overall workflow.
+"""
+
+import csv
+import logging
+import numpy as np
+import pandas as pd
+
+from constants import *
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def build_scenario_deltas(df, pairs=None, group_columns=None, tolerance=1e-9):
+    """
+    Compute the differences between pairs of scenarios, keeping only the non-zero ones.
+
+    :param df: The combined DataFrame (e.g. complete_df).
+    :param pairs: List of (scenario, baseline scenario) tuples. Defaults to SCENARIO_COMPARISON_PAIRS. Pairs with a
+                  scenario missing from df are skipped with a warning.
+    :param group_columns: Columns identifying a category, including 'Scenario'. Defaults to GROUP_COLUMNS.
+    :param tolerance: Absolute differences at or below this value are treated as zero.
+    :return: DataFrame with 'Scenario', 'BaselineScenario', the key columns, 'Value', 'BaselineValue',
+             'Delta' (Value - BaselineValue) and 'Ratio' (Value / BaselineValue, NaN where the baseline is zero).
+    """
+    pairs = pairs if pairs is not None else SCENARIO_COMPARISON_PAIRS
+    group_columns = group_columns or GROUP_COLUMNS
+    key_columns = [c for c in group_columns if c != 'Scenario']
+    scenarios = set(df['Scenario'].unique())
+    for scenario, baseline in pairs:
+        missing = [name for name in (scenario, baseline) if name not in scenarios]
+        if missing:
+            logging.warning("Skipping the scenario pair %s vs %s: %s not in the DataFrame (scenarios: %s)",
+                            scenario, baseline, ", ".join(missing), ", ".join(sorted(map(str, scenarios))))
+    pairs = [(scenario, baseline) for scenario, baseline in pairs if scenario in scenarios and baseline in scenarios]
+    values = df.groupby(group_columns, dropna=False)['Value'].sum()
+    tables = []
+    for scenario, baseline in pairs:
+        scenario_values = values.xs(scenario, level='Scenario')
+        baseline_values = values.xs(baseline, level='Scenario')
+        # One keyed alignment of the two slices; categories missing from either side are zero
+        aligned = pd.concat(
+            [scenario_values, baseline_values], axis=1, keys=['Value', 'BaselineValue'], join='outer'
+        ).fillna(0.0)
+        aligned['Delta'] = aligned['Value'] - aligned['BaselineValue']
+        aligned = aligned[aligned['Delta'].abs() > tolerance]
+        baseline_nonzero = aligned['BaselineValue'] != 0
+        aligned['Ratio'] = np.where(
+            baseline_nonzero, aligned['Value'] / aligned['BaselineValue'].where(baseline_nonzero, 1.0), np.nan
+        )
+        aligned = aligned.reset_index()
+        aligned.insert(0, 'BaselineScenario', baseline)
+        aligned.insert(0, 'Scenario', scenario)
+        logging.info(
+            "Scenario %s vs %s: %s of %s categories differ",
+            scenario, baseline, len(aligned), len(scenario_values.index.union(baseline_values.index)),
+        )
+        tables.append(aligned)
+    columns = ['Scenario', 'BaselineScenario'] + key_columns + ['Value', 'BaselineValue', 'Delta', 'Ratio']
+    if not tables:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(tables, ignore_index=True)[columns]
+
+
+def save_scenario_deltas(deltas, path):
+    """
+    Write a scenario delta table to CSV, formatted like the combined DataFrame output.
+
+    :param deltas: DataFrame returned by build_scenario_deltas.
+    :param path: Path of the CSV file to write.
+    """
+    _deltas = deltas.copy()
+    _deltas['Period'] = _deltas['Period'].astype(int)
+    _deltas.to_csv(path, index=False, quoting=csv.QUOTE_ALL, float_format="%.6f")
+
+
+if __name__ == "__main__":
+    combined_df = pd.read_csv(OUTPUT_COMBINED_DF_FILEPATH, low_memory=False)
+    deltas = build_scenario_deltas(combined_df)
+    save_scenario_deltas(deltas, OUTPUT_SCENARIO_DELTAS_FILEPATH)
+    logging.info("The scenario delta tables have been saved to %s", OUTPUT_SCENARIO_DELTAS_FILEPATH)
@@ -0,0 +1,120 @@
+"""
+Sharded rule application: the rows are hash-partitioned by Process and the rulesets applied to each shard in a
+process pool.
+
+Most rules test the Process or the Commodity of a row. A rule testing the Process is routed to the one shard
+holding that process. Every other rule, e.g. one testing only the Attribute or the Sector, spans the shards and is
+sent to all of them, where prune_rules drops it if it cannot match. Every rule type sets, adds or drops rows based
+on the values of the row alone, so applying the rulesets to each shard gives the same rows as applying them to the
+whole frame.
+
+The shards are recombined in the order apply_rules would have produced: the rows that were not dropped in their
+original order, followed by the rows added by each ruleset, in the order of the rules that added them and of the
+rows they were added from. The result is therefore identical to that of apply_rulesets.
+
+See the README for the overall workflow.
+"""
+
+import logging
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+from constants import *
+from helpers import *
+
+SHARD_COLUMN = "Process"
+
+# Helper columns tracking the order of the rows
+_ORDER = "_Order"
+_NEW_ROW_RULE = "_NewRowRule"
+
+
+def shard_ids(values, shards):
+    """
+    Return the shard of each Process value, from a hash that does not change between runs.
+    """
+    return pd.util.hash_array(pd.Series(values, dtype=object).astype(str).to_numpy(dtype=object)) % np.uint64(shards)
+
+
+def route_rules(rules, shards):
+    """
+    Split a ruleset between the shards: rules testing the Process go to the shard of that process, and the
+    others to every shard.
+
+    :return: A list with the rules for each shard, in the order of the ruleset.
+    """
+    routed = [[] for _ in range(shards)]
+    processes = [condition[SHARD_COLUMN] for condition, rule_type, _ in rules
+                 if SHARD_COLUMN in rule_condition_keys(condition, rule_type)]
+    process_shards = iter(shard_ids(processes, shards)) if processes else iter(())
+    for rule in rules:
+        condition, rule_type, _ = rule
+        if SHARD_COLUMN in rule_condition_keys(condition, rule_type):
+            routed[int(next(process_shards))].append(rule)
+        else:
+            for shard_rules in routed:
+                shard_rules.append(rule)
+    return routed
+
+
+def _tagged(rules):
+    # Newrow rules also record their position in the sorted ruleset on the rows they add
+    rules = sort_rules_by_specificity(rules)
+    return [(condition, rule_type, dict(actions, **{_NEW_ROW_RULE: position}) if rule_type == "newrow" else actions)
+            for position, (condition, rule_type, actions) in enumerate(rules)]
+
+
+def _apply_in_order(df, rulesets, first_position):
+    # Apply the rulesets in order, keeping track of the order in which apply_rules would place each row.
+    # The order of a row added by a ruleset is (ruleset position, rule position, order of the row it was added from)
+    for position, (name, rules) in enumerate(rulesets, start=first_position):
+        logging.info("Applying ruleset: %s", name)
+        df = apply_rules(df, prune_rules(rules, df, name), name)
+        if _NEW_ROW_RULE in df.columns:
+            added = df[_NEW_ROW_RULE].notna().to_numpy()
+            df[_ORDER] = pd.Series([(position, int(rule), order) if is_added else order
+                                    for is_added, rule, order in zip(added, df[_NEW_ROW_RULE], df[_ORDER])],
+                                   index=df.index, dtype=object)
+            df = df.drop(columns=[_NEW_ROW_RULE])
+    return df
+
+
+def apply_rulesets_sharded(df, rulesets, shards, jobs=None):
+    """
+    Apply rulesets in order, as apply_rulesets does, to shards of the rows partitioned by Process, in parallel.
+
+    :param df: The DataFrame to apply the rulesets to.
+    :param rulesets: List of (name, rules) tuples.
+    :param shards: Number of shards.
+    :param jobs: Number of worker processes; defaults to the number of shards.
+    :return: The DataFrame with the rulesets applied, identical to that returned by apply_rulesets.
+    """
+    if any(SHARD_COLUMN in actions for _, rules in rulesets for _, _, actions in rules):
+        raise ValueError(f"Cannot shard rulesets that set the {SHARD_COLUMN} column")
+    columns = list(df.columns)
+    df = df.copy()
+    df[_ORDER] = pd.Series([(0, position) for position in range(len(df))], index=df.index, dtype=object)
+    rulesets = [(name, _tagged(rules)) for name, rules in rulesets]
+    first_position = 1
+    if not df.index.is_unique:
+        # apply_rules sets values by index label, so the first ruleset also sets the rows sharing a label with a
+        # matched row, whatever their shard. It is applied to the whole frame, which leaves a unique index.
+        df = _apply_in_order(df, rulesets[:1], first_position)
+        rulesets, first_position = rulesets[1:], 2
+
+    ids = shard_ids(df[SHARD_COLUMN], shards)
+    routed_rulesets = [(name, route_rules(rules, shards)) for name, rules in rulesets]
+    routed = [[(name, shard_rules[shard]) for name, shard_rules in routed_rulesets] for shard in range(shards)]
+    with ProcessPoolExecutor(max_workers=jobs or shards) as pool:
+        # Each shard is a copy, so that apply_rules sets values on it rather than on a slice of df
+        futures = [pool.submit(_apply_in_order, df[ids == shard].copy(), routed[shard], first_position)
+                   for shard in range(shards)]
+        results = [future.result() for future in futures]
+    for shard, result in enumerate(results):
+        logging.info("Shard %d: %d rows in, %d rows out", shard, int((ids == shard).sum()), len(result))
+
+    df = pd.concat(results, ignore_index=True)
+    order = sorted(range(len(df)), key=df[_ORDER].__getitem__)
+    df = df.iloc[order].drop(columns=[_ORDER]).reset_index(drop=True)
+    return df[columns + [column for column in df.columns if column not in columns]]
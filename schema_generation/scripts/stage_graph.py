@@ -0,0 +1,575 @@
+"""
+Runs the pipeline stages defined in pipeline.py as a graph, with checkpoints, so that a rerun only recomputes the
+stages affected by what changed.
+
+Each stage declares the input files it reads, the stages whose outputs it takes, and the options it depends on.
+Its checkpoint key is a hash of the contents of those files, the keys of those stages, the option values and the
+code version (a hash of the pipeline source files). When a stage is needed, its checkpoint is loaded if one exists
+for its current key. Otherwise it is computed from its dependencies, which are themselves loaded or computed in the
+same way, and its output is saved as a new checkpoint in CHECKPOINT_DIR.
+
+A change only invalidates the stages downstream of it. For example, after editing Schema_Technology.xlsx, only the
+schema_technology, combine, complete, write and compare stages rerun, and the flows are not traced again.
+Stages that take the PipelineContext also depend on the rulesets stage, since the context is built from the rulesets.
+
+With --jobs N, up to N stages whose dependencies are available are computed concurrently, e.g. the rulesets and
+the VD files are parsed at the same time, and the four allocation branches and the two comparisons run in parallel.
+The stages run in a process pool by default: most of the time is spent in pandas code that holds the GIL, so a
+thread pool (--executor thread) gives little speedup. Checkpoints are written by the main process, and the outputs
+do not depend on the number of jobs or the order in which stages finish.
+
+With --incremental, a new model run whose TIMES output differs only in some processes or periods does not trace
+every flow again. The allocation, combine and complete stages are given their output from the previous run, along
+with the previous outputs of their dependencies, and update it for the changed (Scenario, Period) partitions only
+(see incremental.py). The last output saved for each stage is recorded in latest.json in CHECKPOINT_DIR, with
+the hash of each checkpoint: a dependency that was recomputed with an identical output (e.g. the schema, after a
+change to a VD file that does not add any process) does not prevent the update.
+
+With --trace, each computed stage, and each ruleset it applies, is recorded as in pipeline.py --trace, including the
+stages computed in worker processes. Stages loaded from a checkpoint are not recorded.
+
+Usage:
+python scripts/stage_graph.py [--target STAGE ...] [--force STAGE ...] [--no-checkpoints] [--incremental]
+                              [--jobs N] [--executor {process,thread}] [--trace]
+
+See the README for the overall workflow.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from functools import partial
+from typing import Callable
+import pandas as pd
+
+from constants import *
+from pipeline import *
+from flow_tables import build_flow_tables, write_flow_tables
+from incremental import (incremental_apply_schema_rulesets, incremental_allocate_emissions,
+                         incremental_allocate_renewable_fuel, incremental_combine, incremental_complete)
+from instrumentation import active_trace, row_count, span, tracing, trace_filepath
+from rulesets import ITEMS_LIST_RULESETS, build_items_list_ruleset, build_enduse_rulesets, build_base_dd_rulesets, assemble_rulesets
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Source files whose contents make up the code version of the checkpoints
+CODE_FILES = ["constants.py", "helpers.py", "rulesets.py", "sharding.py", "pipeline.py", "incremental.py", "stage_graph.py",
+              "instrumentation.py", "rule_telemetry.py", "trace_cache.py", "flow_tables.py", "validation.py"]
+
+
+def code_version():
+    """
+    Return a hash of the pipeline source files, so that checkpoints written by other code are not reused.
+    """
+    digest = hashlib.sha256()
+    script_dir = os.path.dirname(os.path.realpath(__file__))
+    for filename in CODE_FILES:
+        with open(os.path.join(script_dir, filename), "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+@dataclass(frozen=True)
+class Stage:
+    """
+    A pipeline stage.
+
+    function: called with the PipelineContext (or the PipelineInputs if context is False), followed by the
+              outputs of the dependencies in order.
+    dependencies: names of the stages whose outputs the function takes.
+    files: function of the PipelineInputs returning a dictionary of the input files the stage reads, by name.
+    options: names of the PipelineOptions the stage depends on.
+    context: whether the function takes the PipelineContext, which depends on the rulesets stage.
+    checkpoint: whether the output is saved as a checkpoint. Stages with side effects always run.
+    incremental: in incremental mode, called instead of function with the PipelineContext, the previous output of
+                 the stage, the list of the previous outputs of the dependencies (followed by the previous rulesets
+                 for context stages), and the current outputs of the dependencies. It updates the previous output for the changes in the incremental_on dependencies.
+    incremental_on: names of the dependencies whose changes the incremental function handles. The previous output
+                    is only used if everything else in the checkpoint key (code version, files, options and the
+                    other dependencies) is unchanged.
+    """
+    name: str
+    function: Callable
+    dependencies: tuple = ()
+    files: Callable = None
+    options: tuple = ()
+    context: bool = True
+    checkpoint: bool = True
+    incremental: Callable = None
+    incremental_on: tuple = ()
+
+
+def _items_list_ruleset(name):
+    # Stage building one ruleset from its Items List
+    def files(inputs):
+        return {ITEMS_LIST_RULESETS[name][0]: _items_list_filepath(inputs, name)}
+    return Stage(f"ruleset:{name}", partial(_build_items_list_ruleset, name=name), files=files, context=False)
+
+
+def _items_list_filepath(inputs, name):
+    return inputs.commodity_filepath if ITEMS_LIST_RULESETS[name][0] == "commodity" else inputs.process_filepath
+
+
+def _build_items_list_ruleset(inputs, name):
+    return build_items_list_ruleset(name, _items_list_filepath(inputs, name))
+
+
+def _build_enduse_rulesets(inputs, commodity_description_enduse_rules):
+    return build_enduse_rulesets(commodity_description_enduse_rules, inputs.commodity_groups_filepath)
+
+
+def _build_base_dd_rulesets(inputs):
+    return build_base_dd_rulesets(inputs.base_dd_filepath)
+
+
+def _assemble_rulesets(inputs, enduse_rulesets, base_dd_rulesets, *items_list_rulesets):
+    return assemble_rulesets(dict(zip(ITEMS_LIST_RULESETS, items_list_rulesets)), enduse_rulesets, base_dd_rulesets)
+
+
+def _aggregate_raw_df(inputs, vd_df):
+    return aggregate_raw_df(vd_df)
+
+
+def _finalise_schema(inputs, main_df):
+    return finalise_schema(main_df)
+
+
+def _assemble_allocations(inputs, emissions_allocation, *fuel_allocations):
+    return assemble_allocations(emissions_allocation, list(fuel_allocations))
+
+
+def _write_outputs(inputs, schema_df, complete_df):
+    return write_outputs(schema_df, complete_df)
+
+
+def _build_flow_tables(ctx, raw_df, schema_df):
+    return build_flow_tables(raw_df, schema_df, ctx.commodity_units)
+
+
+def _write_flow_tables(inputs, flow_tables):
+    return write_flow_tables(*flow_tables, OUTPUT_FLOW_TABLES_DIR)
+
+
+def _compare(inputs, schema_comparison, combined_comparison):
+    return {"schema": schema_comparison, "combined": combined_comparison}
+
+
+def _scenario_files(inputs):
+    return inputs.scenario_files
+
+
+def _commodity_groups_file(inputs):
+    return {"commodity_groups": inputs.commodity_groups_filepath}
+
+
+STAGES = [
+    # Ingest: the input files are parsed, and the rulesets built, in independent stages
+    *[_items_list_ruleset(name) for name in ITEMS_LIST_RULESETS],
+    Stage("ruleset:enduse", _build_enduse_rulesets, ("ruleset:commodity_description_enduse_rules",),
+          files=_commodity_groups_file, context=False),
+    Stage("ruleset:base_dd", _build_base_dd_rulesets, context=False,
+          files=lambda inputs: {"base_dd": inputs.base_dd_filepath}),
+    Stage("rulesets", _assemble_rulesets,
+          ("ruleset:enduse", "ruleset:base_dd") + tuple(f"ruleset:{name}" for name in ITEMS_LIST_RULESETS), context=False),
+    # The VD files are parsed once, for both the schema rows and raw_df
+    Stage("vd", read_vd_files, files=_scenario_files, context=False),
+    Stage("raw_df", _aggregate_raw_df, ("vd",), context=False),
+    Stage("schema_technology", read_schema_technology, context=False,
+          files=lambda inputs: {"schema_technology": inputs.schema_technology_filepath}),
+    # Schema
+    Stage("schema_rows", prepare_schema_rows, ("vd",), files=_commodity_groups_file),
+    Stage("schema_rules", apply_schema_rulesets, ("schema_rows",),
+          incremental=incremental_apply_schema_rulesets, incremental_on=("rulesets",)),
+    Stage("schema", _finalise_schema, ("schema_rules",), context=False),
+    # Combined DataFrame: the allocation branches are independent
+    Stage("allocation:emissions", allocate_emissions, ("raw_df",), options=("zero_biofuel_emissions",),
+          incremental=incremental_allocate_emissions, incremental_on=("raw_df",)),
+    *[Stage(f"allocation:{commodity}", partial(allocate_renewable_fuel, commodity=commodity), ("raw_df",),
+            incremental=partial(incremental_allocate_renewable_fuel, commodity=commodity), incremental_on=("raw_df",))
+      for commodity in RENEWABLE_FUEL_ALLOCATIONS],
+    Stage("allocation", _assemble_allocations,
+          ("allocation:emissions",) + tuple(f"allocation:{commodity}" for commodity in RENEWABLE_FUEL_ALLOCATIONS),
+          context=False),
+    Stage("combine", combine, ("raw_df", "schema", "schema_technology", "allocation"), options=("fix_multiple_fout",),
+          incremental=incremental_combine, incremental_on=("raw_df", "allocation")),
+    Stage("complete", complete, ("raw_df", "combine", "allocation"), options=("zero_biofuel_emissions",),
+          incremental=incremental_complete, incremental_on=("raw_df", "combine", "allocation")),
+    # Outputs
+    Stage("write", _write_outputs, ("schema", "complete"), context=False, checkpoint=False),
+    Stage("flow_tables", _build_flow_tables, ("raw_df", "schema")),
+    Stage("write:flow_tables", _write_flow_tables, ("flow_tables",), context=False, checkpoint=False),
+    Stage("compare:schema", compare_schema, ("schema",), context=False,
+          files=lambda inputs: {"reference_schema": inputs.reference_schema_filepath}),
+    Stage("compare:combined", compare_combined, ("complete",), context=False,
+          files=lambda inputs: {"reference_combined": inputs.reference_combined_filepath}),
+    Stage("compare", _compare, ("compare:schema", "compare:combined"), context=False),
+]
+
+
+class FileHashes:
+    """
+    Content hashes of input files, cached in a JSON file and reused while a file's size and mtime are unchanged.
+    Without a cache path, the hashes are only kept in memory.
+    """
+
+    def __init__(self, cache_path=None):
+        self.cache_path = cache_path
+        self._lock = threading.Lock()
+        self._entries = {}
+        if cache_path is not None and os.path.exists(cache_path):
+            with open(cache_path, "r", encoding="utf-8") as file:
+                self._entries = json.load(file)
+
+    def get(self, path):
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            return entry["sha256"]
+        digest = hashlib.sha256()
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                digest.update(block)
+        with self._lock:
+            self._entries[path] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": digest.hexdigest()}
+            if self.cache_path is not None:
+                _atomic_write(self.cache_path, json.dumps(self._entries, indent=1).encode("utf-8"))
+        return digest.hexdigest()
+
+
+def _atomic_write(path, data):
+    # Write to a temporary file and rename it, so that a checkpoint is never read half-written
+    handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(handle, "wb") as file:
+        file.write(data)
+    os.replace(tmp_path, path)
+
+
+def output_hash(output):
+    """
+    Return a hash of the contents of a stage output. Pickles of equal DataFrames can differ, so DataFrames are
+    hashed from their columns, dtypes and values.
+    """
+    digest = hashlib.sha256()
+
+    def update(value):
+        if isinstance(value, (pd.DataFrame, pd.Series)):
+            digest.update(repr((list(value.columns), [str(d) for d in value.dtypes]) if isinstance(value, pd.DataFrame)
+                               else (value.name, str(value.dtype))).encode("utf-8"))
+            digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+        elif isinstance(value, dict):
+            for key in value:
+                update(key)
+                update(value[key])
+        elif isinstance(value, (list, tuple)):
+            digest.update(f"{type(value).__name__}{len(value)}".encode("utf-8"))
+            for item in value:
+                update(item)
+        else:
+            digest.update(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+    update(output)
+    return digest.hexdigest()
+
+
+def _run_stage(name, function, first_argument, arguments, traced=False):
+    # Module-level so that it can be sent to a process pool. If traced, the stage is recorded in a trace of its own,
+    # whose spans are returned with its start time, to be merged into the trace of the run by the main process
+    with tracing(enabled=traced) as trace:
+        with span(f"stage:{name}", rows_in=row_count(arguments)) as record:
+            start = time.perf_counter()
+            output = function(first_argument, *arguments)
+            seconds = time.perf_counter() - start
+            if record is not None:
+                record.rows_out = row_count(output)
+    return output, seconds, (trace.spans, trace.started) if trace is not None else None
+
+
+class StageGraph:
+    """
+    The pipeline stages for one set of inputs and options, with their checkpoints.
+    """
+
+    def __init__(self, inputs=None, options=None, stages=None, checkpoint_dir=CHECKPOINT_DIR,
+                 use_checkpoints=True, force=(), incremental=False, memo=None):
+        """
+        :param inputs: PipelineInputs; defaults to the standard input files.
+        :param options: PipelineOptions; defaults to the standard options.
+        :param stages: List of Stage; defaults to STAGES.
+        :param checkpoint_dir: Directory where checkpoints are stored.
+        :param use_checkpoints: If False, every stage is computed, no checkpoints are read or written, and
+                                checkpoint_dir is not created.
+        :param force: Names of stages to recompute even if a checkpoint exists.
+        :param incremental: If True, stages with an incremental function update the output of the previous run
+                            instead of computing it from scratch, when only their incremental_on dependencies changed.
+        :param memo: Dictionary of stage outputs by checkpoint key, shared by the graphs of a sweep (see sweep.py).
+                     A stage whose key is in it is taken from it rather than loaded or computed, and the outputs
+                     of the stages this graph loads or computes are added to it.
+        """
+        self.inputs = inputs or PipelineInputs()
+        self.options = options or PipelineOptions()
+        self.stages = {stage.name: stage for stage in (stages or STAGES)}
+        self.checkpoint_dir = checkpoint_dir
+        self.use_checkpoints = use_checkpoints
+        self.force = set(force)
+        self.incremental = incremental
+        self.memo = memo
+        self.code_version = code_version()
+        # The checkpoint keys are still computed without checkpoints, e.g. for the memo of a sweep, but the file
+        # hashes are then only kept in memory
+        if use_checkpoints:
+            os.makedirs(checkpoint_dir, exist_ok=True)
+        self.file_hashes = FileHashes(os.path.join(checkpoint_dir, "file_hashes.json") if use_checkpoints else None)
+        # For incremental mode: the checkpoint key payload of the last output saved for each stage, and the hash
+        # of each checkpoint, so that a dependency recomputed with the same output does not count as changed
+        self.latest_path = os.path.join(checkpoint_dir, "latest.json")
+        self.latest = {"stages": {}, "output_hashes": {}}
+        if use_checkpoints and os.path.exists(self.latest_path):
+            with open(self.latest_path, "r", encoding="utf-8") as file:
+                self.latest = json.load(file)
+        self.outputs = {}
+        self.keys = {}
+        self.payloads = {}
+        # (stage name, 'checkpoint', 'computed', 'incremental' or 'shared', seconds) for each stage run, in order of completion
+        self.history = []
+        self._context = None
+
+    def dependencies(self, name):
+        """
+        Return the names of the stages a stage depends on, including the rulesets stage for context stages.
+        """
+        stage = self.stages[name]
+        return list(stage.dependencies) + (["rulesets"] if stage.context and "rulesets" not in stage.dependencies else [])
+
+    def key(self, name):
+        """
+        Return the checkpoint key of a stage.
+        """
+        if name not in self.keys:
+            stage = self.stages[name]
+            files = stage.files(self.inputs) if stage.files else {}
+            self.payloads[name] = {
+                "stage": name,
+                "code_version": self.code_version,
+                "files": {label: self.file_hashes.get(path) for label, path in files.items()},
+                "options": {option: getattr(self.options, option) for option in stage.options},
+                "dependencies": {dependency: self.key(dependency) for dependency in self.dependencies(name)},
+            }
+            self.keys[name] = hashlib.sha256(json.dumps(self.payloads[name], sort_keys=True).encode("utf-8")).hexdigest()
+        return self.keys[name]
+
+    def checkpoint_path(self, name, key=None):
+        return os.path.join(self.checkpoint_dir, f"{name.replace(':', '-')}-{(key or self.key(name))[:16]}.pkl")
+
+    def previous_keys(self, name):
+        """
+        Return the checkpoint keys of the previous output of a stage and of its dependencies, if the stage can
+        be updated incrementally from it, or None.
+        """
+        stage = self.stages[name]
+        previous = self.latest["stages"].get(name)
+        if not (self.incremental and stage.incremental and previous):
+            return None
+        self.key(name)
+        current, previous_payload = self.payloads[name], previous["payload"]
+        if ({k: v for k, v in current.items() if k != "dependencies"} != {k: v for k, v in previous_payload.items() if k != "dependencies"}
+                or set(current["dependencies"]) != set(previous_payload["dependencies"])):
+            return None
+        output_hashes = self.latest["output_hashes"]
+        for dependency, key in current["dependencies"].items():
+            previous_key = previous_payload["dependencies"][dependency]
+            if dependency not in stage.incremental_on and previous_key != key and (
+                    output_hashes.get(previous_key) is None or output_hashes.get(previous_key) != output_hashes.get(key)):
+                return None
+        keys = [(name, previous["key"])] + [(dependency, previous_payload["dependencies"][dependency]) for dependency in self.dependencies(name)]
+        if not all(os.path.exists(self.checkpoint_path(n, key)) for n, key in keys):
+            return None
+        return keys
+
+    def context(self):
+        """
+        Return the PipelineContext, built from the output of the rulesets stage.
+        """
+        if self._context is None:
+            self._context = build_context(self.inputs, self.options, self.output("rulesets"))
+        return self._context
+
+    def _from_memo(self, name):
+        # Take the output of a stage from the memo, if it holds the output for the current key
+        if (self.memo is None or name in self.force or not self.stages[name].checkpoint
+                or self.key(name) not in self.memo):
+            return False
+        self.outputs[name] = self.memo[self.key(name)]
+        self._record(name, "shared", 0.0)
+        return True
+
+    def _has_checkpoint(self, name):
+        return (self.use_checkpoints and name not in self.force and self.stages[name].checkpoint
+                and os.path.exists(self.checkpoint_path(name)))
+
+    def _load(self, name):
+        start = time.perf_counter()
+        with open(self.checkpoint_path(name), "rb") as file:
+            self.outputs[name] = pickle.load(file)
+        if self.memo is not None:
+            self.memo[self.key(name)] = self.outputs[name]
+        self._record(name, "checkpoint", time.perf_counter() - start)
+
+    def _store(self, name, output, seconds, status="computed"):
+        if self.use_checkpoints and self.stages[name].checkpoint:
+            data = pickle.dumps(output, protocol=pickle.HIGHEST_PROTOCOL)
+            _atomic_write(self.checkpoint_path(name), data)
+            self.latest["stages"][name] = {"key": self.key(name), "payload": self.payloads[name]}
+            self.latest["output_hashes"][self.key(name)] = output_hash(output)
+            _atomic_write(self.latest_path, json.dumps(self.latest, indent=1).encode("utf-8"))
+        self.outputs[name] = output
+        if self.memo is not None:
+            self.memo[self.key(name)] = output
+        self._record(name, status, seconds)
+
+    def _record(self, name, status, seconds):
+        self.history.append((name, status, seconds))
+        logging.info("Stage %s: %s (%.2fs)", name, status, seconds)
+
+    def plan(self, targets):
+        """
+        Return the stages that have to be computed to bring the targets up to date, in dependency order.
+        Stages with a checkpoint are not computed, and neither are their dependencies (unless needed elsewhere).
+        """
+        to_compute = []
+
+        def visit(name):
+            if name in self.outputs or name in to_compute or self._from_memo(name) or self._has_checkpoint(name):
+                return
+            for dependency in self.dependencies(name):
+                visit(dependency)
+            to_compute.append(name)
+
+        for name in targets:
+            visit(name)
+        return to_compute
+
+    def _task(self, name):
+        # The function computing a stage, its arguments, and the status to record
+        stage = self.stages[name]
+        for dependency in self.dependencies(name):
+            if dependency not in self.outputs:
+                self._load(dependency)
+        first_argument = self.context() if stage.context else self.inputs
+        arguments = [self.outputs[dependency] for dependency in stage.dependencies]
+        previous_keys = self.previous_keys(name)
+        if previous_keys is None:
+            return stage.function, first_argument, arguments, "computed"
+        previous = []
+        for previous_name, key in previous_keys:
+            with open(self.checkpoint_path(previous_name, key), "rb") as file:
+                previous.append(pickle.load(file))
+        return stage.incremental, first_argument, [previous[0], previous[1:]] + arguments, "incremental"
+
+    def output(self, name):
+        """
+        Return the output of a stage, loading its checkpoint or computing it (and its dependencies) as needed.
+        """
+        if name not in self.outputs:
+            self.run([name])
+        return self.outputs[name]
+
+    def run(self, targets=("write", "compare"), jobs=1, executor="process"):
+        """
+        Bring the target stages up to date.
+
+        :param targets: Names of the stages to run.
+        :param jobs: Number of stages to compute concurrently. Independent stages, e.g. the allocation branches,
+                     run in parallel once their dependencies are available. Outputs do not depend on the order.
+        :param executor: 'process' or 'thread'; the kind of pool used when jobs > 1.
+        :return: Dictionary mapping each target to its output.
+        """
+        to_compute = self.plan(targets)
+        if jobs > 1 and len(to_compute) > 1:
+            pool_class = ProcessPoolExecutor if executor == "process" else ThreadPoolExecutor
+            with pool_class(max_workers=jobs) as pool:
+                self._run_parallel(to_compute, pool, jobs)
+        else:
+            for name in to_compute:
+                function, first_argument, arguments, status = self._task(name)
+                result = _run_stage(name, function, first_argument, arguments, active_trace() is not None)
+                self._finish(name, *result, status)
+        for name in targets:
+            if name not in self.outputs:
+                self._load(name)
+        return {name: self.outputs[name] for name in targets}
+
+    def _run_parallel(self, to_compute, pool, jobs):
+        pending = list(to_compute)
+        running = {}
+        while pending or running:
+            # Submit the stages whose dependencies are all available, in plan order
+            for name in list(pending):
+                if len(running) >= jobs:
+                    break
+                if all(d in self.outputs or d not in to_compute for d in self.dependencies(name)):
+                    pending.remove(name)
+                    function, first_argument, arguments, status = self._task(name)
+                    running[pool.submit(_run_stage, name, function, first_argument, arguments,
+                                        active_trace() is not None)] = (name, status)
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            # Store completed stages in plan order, so that the history does not depend on timing within a batch
+            for future in sorted(done, key=lambda f: to_compute.index(running[f][0])):
+                name, status = running.pop(future)
+                self._finish(name, *future.result(), status)
+
+    def _finish(self, name, output, seconds, trace, status):
+        # Merge the trace of a computed stage into the trace of the run, and store its output
+        if trace is not None and active_trace() is not None:
+            active_trace().merge(*trace)
+        self._store(name, output, seconds, status)
+
+    def summary(self):
+        """
+        Return a table of the stages run, whether they were loaded from a checkpoint or computed, and the time taken.
+        """
+        return "\n".join(f"{name:<45} {status:<11} {seconds:8.2f}s" for name, status, seconds in self.history)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the pipeline stages, reusing checkpoints of unchanged stages.")
+    parser.add_argument('--target', nargs='+', default=["write", "compare"], help="Stages to run")
+    parser.add_argument('--force', nargs='+', default=[], help="Stages to recompute even if a checkpoint exists")
+    parser.add_argument('--no-checkpoints', action='store_true', help="Compute every stage without reading or writing checkpoints")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Update the outputs of the previous run for the changed partitions of the TIMES output")
+    parser.add_argument('--jobs', type=int, default=1, help="Number of independent stages to run concurrently")
+    parser.add_argument('--executor', choices=["process", "thread"], default="process",
+                        help="Run concurrent stages in a process pool or a thread pool")
+    parser.add_argument('--no-fix-multiple-fout', action='store_true', help="Do not split VAR_FIn rows across multiple VAR_FOut end-uses")
+    parser.add_argument('--zero-biofuel-emissions', action='store_true', help="Attribute negative emissions to the fossil fuel")
+    parser.add_argument('--rule-shards', type=int, default=1, help="Apply the schema rulesets to this many shards of the rows in parallel")
+    parser.add_argument('--trace', action='store_true', help="Write a JSON trace of the time, memory and rows of each computed stage")
+    args = parser.parse_args()
+
+    graph = StageGraph(
+        options=PipelineOptions(
+            fix_multiple_fout=not args.no_fix_multiple_fout,
+            zero_biofuel_emissions=args.zero_biofuel_emissions,
+            rule_shards=args.rule_shards,
+        ),
+        use_checkpoints=not args.no_checkpoints,
+        force=args.force,
+        incremental=args.incremental,
+    )
+    start = time.perf_counter()
+    with tracing(trace_filepath("stage_graph"), enabled=args.trace):
+        outputs = graph.run(args.target, jobs=args.jobs, executor=args.executor)
+    if "compare" in outputs:
+        logging.info("Schema comparison:\n%s", outputs["compare"]["schema"][0])
+        logging.info("Combined DataFrame comparison:\n%s", outputs["compare"]["combined"][0])
+    logging.info("Stages:\n%s\nTotal: %.2fs", graph.summary(), time.perf_counter() - start)
@@ -0,0 +1,241 @@
+"""
+Bounded-memory comparison of large output and reference CSV files.
+
+compare_tables and keyed_diff load both tables into memory, which fails once multi-scenario outputs
+reach several GB. Here both files are first sorted on disk by their key columns, using an external merge sort:
+sorted runs of at most `chunk_rows` rows are written to temporary files and then merged. The two sorted files are
+then merge-compared in a single pass. Memory use is fixed by `chunk_rows` and the sample size, not by the file size.
+
+The comparison follows keyed_diff: duplicate rows are ignored, rows are paired by key, values are compared
+numerically within a tolerance where both are numeric, and counts are reported per column. Only a capped
+sample of mismatches is kept for each column.
+
+Usage:
+python scripts/compare_combined_df.py --streaming
+
+See the README for the overall workflow.
+"""
+
+import csv
+import heapq
+import itertools
+import logging
+import os
+import tempfile
+
+from constants import *
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def _read_header(filepath, renames=None):
+    with open(filepath, "r", newline="", encoding="utf-8") as file:
+        header = next(csv.reader(file))
+    renames = renames or {}
+    return [renames.get(column.strip(), column.strip()) for column in header]
+
+
+def _projected_rows(filepath, columns, renames=None):
+    """
+    Yield the rows of a CSV file as lists of stripped strings, projected onto the given columns.
+    """
+    header = _read_header(filepath, renames)
+    positions = [header.index(column) for column in columns]
+    with open(filepath, "r", newline="", encoding="utf-8") as file:
+        reader = csv.reader(file)
+        next(reader)
+        for row in reader:
+            yield [row[i].strip() for i in positions]
+
+
+def _write_run(rows, directory):
+    handle, path = tempfile.mkstemp(suffix=".csv", dir=directory)
+    with os.fdopen(handle, "w", newline="", encoding="utf-8") as file:
+        csv.writer(file).writerows(rows)
+    return path
+
+
+def _read_run(path):
+    with open(path, "r", newline="", encoding="utf-8") as file:
+        yield from csv.reader(file)
+
+
+def external_sort_csv(filepath, columns, output_path, chunk_rows=STREAMING_CHUNK_ROWS, renames=None, tmp_dir=None):
+    """
+    Sort a CSV file on disk, projecting it onto the given columns and dropping duplicate rows.
+    Rows are sorted as whole rows, so with the key columns first they are sorted by key.
+
+    :param filepath: Path of the CSV file to sort.
+    :param columns: Columns to keep, key columns first.
+    :param output_path: Path of the sorted CSV file to write (without a header).
+    :param chunk_rows: Maximum number of rows held in memory at once.
+    :param renames: Optional mapping of column names in the file to the names used in `columns`.
+    :param tmp_dir: Directory for the temporary sorted runs.
+    :return: The number of distinct rows written.
+    """
+    run_paths = []
+    rows = _projected_rows(filepath, columns, renames)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_rows))
+        if not chunk:
+            break
+        chunk.sort()
+        run_paths.append(_write_run(chunk, tmp_dir))
+    written = 0
+    previous = None
+    with open(output_path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        for row in heapq.merge(*[_read_run(path) for path in run_paths]):
+            if row != previous:
+                writer.writerow(row)
+                written += 1
+            previous = row
+    for path in run_paths:
+        os.remove(path)
+    logging.info("Sorted %s into %s runs (%s distinct rows)", filepath, len(run_paths), written)
+    return written
+
+
+def _key_groups(path, key_count):
+    """
+    Yield (key, rows) for each run of consecutive rows sharing a key in a sorted file.
+    """
+    for key, rows in itertools.groupby(_read_run(path), key=lambda row: tuple(row[:key_count])):
+        yield key, list(rows)
+
+
+def _value_differs(output_value, reference_value, tolerance):
+    """
+    Compare two string values numerically within the tolerance if both parse as numbers, otherwise as strings.
+    """
+    if output_value == reference_value:
+        return False
+    try:
+        return abs(float(output_value) - float(reference_value)) > tolerance
+    except ValueError:
+        return True
+
+
+class _StreamingSummary:
+    """
+    Counts and capped samples accumulated during a streaming comparison.
+    """
+
+    def __init__(self, columns, key_count, sample_size):
+        self.columns = columns
+        self.key_count = key_count
+        self.sample_size = sample_size
+        self.counts = {"correct": 0, "changed": 0, "missing": 0, "extra": 0}
+        self.column_change_counts = {column: 0 for column in columns[key_count:]}
+        self.column_samples = {column: [] for column in columns[key_count:]}
+        self.missing_sample = []
+        self.extra_sample = []
+
+    def unpaired(self, label, rows):
+        self.counts[label] += len(rows)
+        sample = self.missing_sample if label == "missing" else self.extra_sample
+        sample.extend(dict(zip(self.columns, row)) for row in rows[:max(0, self.sample_size - len(sample))])
+
+    def pair(self, output_row, reference_row, tolerance):
+        changed = False
+        for i in range(self.key_count, len(self.columns)):
+            if _value_differs(output_row[i], reference_row[i], tolerance):
+                column = self.columns[i]
+                changed = True
+                self.column_change_counts[column] += 1
+                if len(self.column_samples[column]) < self.sample_size:
+                    sample = dict(zip(self.columns[:self.key_count], output_row))
+                    sample.update({"Output": output_row[i], "Reference": reference_row[i]})
+                    self.column_samples[column].append(sample)
+        self.counts["changed" if changed else "correct"] += 1
+
+
+def streaming_compare(output_sorted_path, reference_sorted_path, columns, key_count,
+                      tolerance=COMPARE_TOLERANCE, sample_size=STREAMING_SAMPLE_SIZE):
+    """
+    Merge-compare two files sorted by external_sort_csv in a single pass.
+
+    :param output_sorted_path: Sorted output file.
+    :param reference_sorted_path: Sorted reference file.
+    :param columns: Columns of both files, key columns first.
+    :param key_count: Number of key columns.
+    :param tolerance: Absolute tolerance for numeric comparisons.
+    :param sample_size: Maximum number of mismatches kept per column (and of missing and extra rows).
+    :return: A _StreamingSummary with the counts and samples.
+    """
+    summary = _StreamingSummary(columns, key_count, sample_size)
+    output_groups = _key_groups(output_sorted_path, key_count)
+    reference_groups = _key_groups(reference_sorted_path, key_count)
+    output_group = next(output_groups, None)
+    reference_group = next(reference_groups, None)
+    while output_group is not None or reference_group is not None:
+        if reference_group is None or (output_group is not None and output_group[0] < reference_group[0]):
+            summary.unpaired("extra", output_group[1])
+            output_group = next(output_groups, None)
+        elif output_group is None or reference_group[0] < output_group[0]:
+            summary.unpaired("missing", reference_group[1])
+            reference_group = next(reference_groups, None)
+        else:
+            output_rows, reference_rows = output_group[1], reference_group[1]
+            # Identical rows pair first, then the remainder pair up in sorted order
+            identical = set(map(tuple, output_rows)) & set(map(tuple, reference_rows))
+            summary.counts["correct"] += len(identical)
+            output_rest = [row for row in output_rows if tuple(row) not in identical]
+            reference_rest = [row for row in reference_rows if tuple(row) not in identical]
+            for output_row, reference_row in zip(output_rest, reference_rest):
+                summary.pair(output_row, reference_row, tolerance)
+            summary.unpaired("extra", output_rest[len(reference_rest):])
+            summary.unpaired("missing", reference_rest[len(output_rest):])
+            output_group = next(output_groups, None)
+            reference_group = next(reference_groups, None)
+    return summary
+
+
+def compare_tables_streaming(output_filepath, reference_filepath, key_columns, value_columns=None,
+                             tolerance=COMPARE_TOLERANCE, sample_size=STREAMING_SAMPLE_SIZE,
+                             chunk_rows=STREAMING_CHUNK_ROWS, reference_renames=None):
+    """
+    Compare two CSV files with bounded memory: sort both on disk by key, then merge-compare them in one pass.
+
+    :param output_filepath: Path to the output CSV file.
+    :param reference_filepath: Path to the reference CSV file.
+    :param key_columns: Columns identifying a row.
+    :param value_columns: Columns to compare. Defaults to all shared columns that are not key columns.
+    :param tolerance: Absolute tolerance for numeric comparisons.
+    :param sample_size: Maximum number of mismatches kept per column.
+    :param chunk_rows: Maximum number of rows held in memory while sorting.
+    :param reference_renames: Optional mapping of reference column names to output column names.
+    :return: A tuple of (message, summary), where summary holds the counts and capped samples.
+    """
+    output_header = _read_header(output_filepath)
+    reference_header = _read_header(reference_filepath, reference_renames)
+    missing_key_columns = [c for c in key_columns if c not in output_header or c not in reference_header]
+    if missing_key_columns:
+        raise ValueError(f"Key columns not present in both tables: {', '.join(missing_key_columns)}")
+    if value_columns is None:
+        value_columns = [c for c in output_header if c in reference_header and c not in key_columns]
+    columns = key_columns + value_columns
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_sorted = os.path.join(tmp_dir, "output_sorted.csv")
+        reference_sorted = os.path.join(tmp_dir, "reference_sorted.csv")
+        external_sort_csv(output_filepath, columns, output_sorted, chunk_rows, tmp_dir=tmp_dir)
+        external_sort_csv(reference_filepath, columns, reference_sorted, chunk_rows,
+                          renames=reference_renames, tmp_dir=tmp_dir)
+        summary = streaming_compare(output_sorted, reference_sorted, columns, len(key_columns), tolerance, sample_size)
+
+    differences = []
+    missing_columns = set(reference_header) - set(output_header)
+    extra_columns = set(output_header) - set(reference_header)
+    if missing_columns:
+        differences.append(f"Missing columns: {', '.join(missing_columns)}")
+    if extra_columns:
+        differences.append(f"Extra columns: {', '.join(extra_columns)}")
+    differences.append(f"Number of correct rows: {summary.counts['correct']}")
+    differences.append(f"Number of changed rows: {summary.counts['changed']}")
+    differences.append(f"Number of missing rows: {summary.counts['missing']}")
+    differences.append(f"Number of extra rows: {summary.counts['extra']}")
+    changed_columns = {c: n for c, n in summary.column_change_counts.items() if n > 0}
+    if changed_columns:
+        differences.append("\nChanged rows per column:")
+        differences.extend(f"{column}: {count}" for column, count in changed_columns.items())
+    return "\n".join(differences), summary
@@ -0,0 +1,153 @@
+"""
+Generates the combined DataFrame for every combination of a grid of option values in one run, computing the stages
+the variants have in common only once.
+
+Each variant runs the stage graph of stage_graph.py with its options, and the graphs share a memo of the stage
+outputs by checkpoint key. Since the key of a stage only includes the options it declares, the stages that do not
+depend on the varied options (reading the VD files, the rulesets, the schema, the renewable fuel allocations, which
+trace the flows) are computed by the first variant and shared by the others. Only the stages affected by an option
+are computed again: for zero_biofuel_emissions, the emissions allocation and everything downstream of it, and for
+fix_multiple_fout, the combine and complete stages.
+
+The schema, which no option affects, and the combined DataFrame of each variant are written to SWEEP_OUTPUT_DIR,
+with their fingerprint manifests. Checkpoints are read and written as by stage_graph.py, so a later sweep also
+reuses the stages of previous runs.
+
+Usage:
+python scripts/sweep.py [--grid OPTION=VALUE,VALUE ...] [--output-dir DIR] [--no-checkpoints] [--jobs N]
+
+e.g. python scripts/sweep.py --grid zero_biofuel_emissions=false,true fix_multiple_fout=false,true
+
+See the README for the overall workflow.
+"""
+
+import argparse
+import itertools
+import logging
+import os
+import time
+from dataclasses import fields, replace
+
+from constants import *
+from helpers import *
+from pipeline import PipelineInputs, PipelineOptions
+from stage_graph import StageGraph
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# The options varied when no grid is given
+DEFAULT_SWEEP_GRID = {"zero_biofuel_emissions": [False, True], "fix_multiple_fout": [False, True]}
+
+
+def option_variants(grid, base=None):
+    """
+    Return the PipelineOptions of every combination of the option values of a grid.
+
+    :param grid: Dictionary of the values of each option, e.g. {"zero_biofuel_emissions": [False, True]}.
+    :param base: PipelineOptions giving the options that are not varied; defaults to the standard options.
+    """
+    base = base or PipelineOptions()
+    names = list(grid)
+    return [replace(base, **dict(zip(names, values))) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def variant_label(options, names):
+    """
+    Return a label of the varied options of a variant, for file names, e.g. 'zero_biofuel_emissions-on'.
+    """
+    def value(option):
+        value = getattr(options, option)
+        return ("on" if value else "off") if isinstance(value, bool) else str(value)
+    return "_".join(f"{name}-{value(name)}" for name in names)
+
+
+def parse_grid(settings):
+    """
+    Parse grid settings of the form 'option=value,value' into a dictionary of option values, converted to the
+    type of the option's default (true/false for flags).
+    """
+    defaults = PipelineOptions()
+    option_names = [option.name for option in fields(PipelineOptions)]
+    grid = {}
+    for setting in settings:
+        name, _, values = setting.partition("=")
+        if name not in option_names:
+            raise ValueError(f"Unknown option: {name} (options: {', '.join(option_names)})")
+        kind = type(getattr(defaults, name))
+        if kind is bool:
+            grid[name] = [value.strip().lower() in ("true", "1", "yes", "on") for value in values.split(",")]
+        else:
+            grid[name] = [kind(value) for value in values.split(",")]
+    return grid
+
+
+def run_sweep(variants, inputs=None, targets=("schema", "complete"), use_checkpoints=True, jobs=1):
+    """
+    Run the stage graph for each variant, sharing the outputs of the stages the variants have in common.
+
+    :param variants: List of PipelineOptions.
+    :param inputs: PipelineInputs; defaults to the standard input files.
+    :param targets: Stages to run for each variant.
+    :param use_checkpoints: If False, no checkpoints are read or written.
+    :param jobs: Number of stages of a variant to compute concurrently.
+    :return: List of (options, outputs of the targets, StageGraph) for each variant.
+    """
+    memo = {}
+    results = []
+    for options in variants:
+        graph = StageGraph(inputs, options, use_checkpoints=use_checkpoints, memo=memo)
+        outputs = graph.run(targets, jobs=jobs)
+        results.append((options, outputs, graph))
+    return results
+
+
+def sweep_summary(results, names):
+    """
+    Return a table of the number of stages each variant computed, loaded from a checkpoint or shared, and the time
+    spent computing them.
+    """
+    lines = [f"{'Variant':<60} {'Computed':>9} {'Checkpoint':>11} {'Shared':>7} {'Seconds':>9}"]
+    for options, _, graph in results:
+        statuses = [status for _, status, _ in graph.history]
+        lines.append(f"{variant_label(options, names):<60} {statuses.count('computed'):>9} "
+                     f"{statuses.count('checkpoint'):>11} {statuses.count('shared'):>7} "
+                     f"{sum(seconds for _, _, seconds in graph.history):>9.2f}")
+    return "\n".join(lines)
+
+
+def write_sweep_outputs(results, names, output_dir=SWEEP_OUTPUT_DIR):
+    """
+    Write the schema of the first variant, and the combined DataFrame of each variant, with their manifests.
+
+    :return: The paths written.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    schema_filepath = os.path.join(output_dir, "schema_df.csv")
+    schema_df = results[0][1]["schema"]
+    schema_df.to_csv(schema_filepath, index=False)
+    write_manifest(schema_df, schema_filepath)
+    paths = [schema_filepath]
+    for options, outputs, _ in results:
+        paths.append(os.path.join(output_dir, f"combined_df_{variant_label(options, names)}.csv"))
+        save(outputs["complete"], paths[-1], manifest=True)
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--grid', nargs='+', metavar="OPTION=VALUE,VALUE",
+                        help="Values of each option to sweep (default: every combination of zero_biofuel_emissions "
+                             "and fix_multiple_fout)")
+    parser.add_argument('--output-dir', default=SWEEP_OUTPUT_DIR, help="Directory to write the outputs to")
+    parser.add_argument('--no-checkpoints', action='store_true', help="Compute every stage without reading or writing checkpoints")
+    parser.add_argument('--jobs', type=int, default=1, help="Number of independent stages to run concurrently")
+    args = parser.parse_args()
+
+    grid = parse_grid(args.grid) if args.grid else DEFAULT_SWEEP_GRID
+    variants = option_variants(grid)
+    start = time.perf_counter()
+    results = run_sweep(variants, PipelineInputs(), use_checkpoints=not args.no_checkpoints, jobs=args.jobs)
+    paths = write_sweep_outputs(results, list(grid), args.output_dir)
+    logging.info("Outputs written:\n%s", "\n".join(paths))
+    logging.info("Stages of each variant:\n%s\nTotal: %.2fs for %d variants",
+                 sweep_summary(results, list(grid)), time.perf_counter() - start, len(variants))
@@ -0,0 +1,296 @@
+"""
+Generates synthetic TIMES inputs at a configurable scale, for benchmarks: a VD file per scenario, the three Items
+Lists (Commodity, Process and Commodity Groups), the sections of base.dd read by the pipeline (the COM_UNIT set
+and the VDA_EMCB emissions factors) and the Technology_Group of each technology (Schema_Technology.xlsx).
+
+The synthetic model has:
+* fuel commodities, each in a sector, emitting the CO2 commodity of that sector (e.g. INDCO2) when burnt,
+* end-use processes, each consuming a fuel, producing its own demand commodity and emitting CO2,
+* a blending chain starting at SYNTHETIC_BLEND_SOURCE, a biodiesel process with negative CO2 emissions (TOTCO2),
+  whose output and negative emissions are allocated to the end-use processes of the blend: blending_depth levels
+  of two processes, each level consuming the blend produced by the level before. The last blend is also consumed by one in four end-use processes, so
+  tracing the source with trace_commodities follows 2**blending_depth paths to each of them.
+
+The VD files hold the VAR_FIn, VAR_FOut and VAR_Cap rows of every process for every period and timeslice, in two
+regions, and the objective value of each region. The files can be read with PipelineInputs(**paths) in place of the real inputs.
+
+Usage:
+python scripts/synthetic_inputs.py OUTPUT_DIR [--processes N] [--commodities N] [--scenarios N] [--periods N]
+                                   [--timeslices N] [--blending-depth N] [--seed N]
+
+See the README for the overall workflow.
+"""
+
+import argparse
+import logging
+import os
+import random
+from dataclasses import asdict, dataclass, fields
+import numpy as np
+import pandas as pd
+
+from constants import *
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# The biofuel process and commodity at the start of the blending chain, named after the biodiesel plant of the model
+# so that the renewable fuel allocation rules apply to them
+SYNTHETIC_BLEND_SOURCE = "CT_COILBDS"
+SYNTHETIC_BLEND_COMMODITY = "BDSL"
+
+# Sectors of the synthetic fuels and processes, with their emissions commodity and Items List sector code
+SYNTHETIC_SECTORS = {
+    "Industry": ("INDCO2", "IND"),
+    "Residential": ("RESCO2", "RES"),
+    "Commercial": ("COMCO2", "COM"),
+    "Agriculture": ("AGRCO2", "AGR"),
+    "Transport": ("TRACO2", "TRA"),
+}
+SYNTHETIC_FUELS = ["Coal", "Diesel", "Fuel Oil", "LPG", "Natural Gas", "Petrol", "Electricity", "Wood"]
+SYNTHETIC_REGIONS = ["NI", "SI"]
+
+VD_HEADER = """*ImportID- Scenario:{scenario}
+*VEDAFlavor- Standard
+*Dimensions- Attribute;Commodity;Process;Period;Region;Vintage;TimeSlice;UserConstraint;PV
+*ParentDimension- Region;Region;Region;Region
+*Units- ; ; ; ; ; ; ; ;
+*Scenario- {scenario}
+*DataBase- synthetic
+*MyRegion- NI
+*CurrencyCode- NZD
+*Date- synthetic
+*Comment- synthetic benchmark inputs
+*VEDAVersion- 1
+
+"""
+
+
+@dataclass(frozen=True)
+class SyntheticScale:
+    """
+    The size of a synthetic model.
+
+    processes: number of end-use processes.
+    commodities: number of fuel commodities.
+    scenarios: number of scenarios, each with its own VD file.
+    periods: number of periods, from 2018 and then every five years from 2025.
+    timeslices: number of timeslices (1: ANNUAL only).
+    blending_depth: number of blending levels between SYNTHETIC_BLEND_SOURCE and the end-use processes.
+    seed: seed of the random flow values.
+    """
+    processes: int = 200
+    commodities: int = 40
+    scenarios: int = 2
+    periods: int = 8
+    timeslices: int = 1
+    blending_depth: int = 2
+    seed: int = 0
+
+    def replace(self, **changes):
+        """
+        Return a copy of the scale with some of its fields changed.
+        """
+        return SyntheticScale(**dict(asdict(self), **changes))
+
+    @property
+    def scenario_names(self):
+        return [f"S{i + 1}" for i in range(self.scenarios)]
+
+    @property
+    def period_values(self):
+        return [2018] + [2025 + 5 * i for i in range(self.periods - 1)]
+
+    @property
+    def timeslice_names(self):
+        return ["ANNUAL"] if self.timeslices == 1 else [f"TS{i + 1:02d}" for i in range(self.timeslices)]
+
+
+def synthetic_model(scale):
+    """
+    Build the commodities and processes of a synthetic model.
+
+    :param scale: The SyntheticScale.
+    :return: A tuple of (commodities, processes). Each commodity is a dictionary with its Name, Sector, Set, Unit,
+             Description and emissions commodity (Emissions, for fuels). Each process is a dictionary with its Name,
+             Sector, Set, Description, and its input, output, demand, emissions and removals (negative
+             emissions) commodities.
+    """
+    sectors = list(SYNTHETIC_SECTORS)
+    commodities, processes = [], []
+    for emissions, code in SYNTHETIC_SECTORS.values():
+        commodities.append({"Name": emissions, "Sector": code, "Set": ".ENV.", "Unit": "kt", "Description": "-:- "})
+    commodities.append({"Name": "TOTCO2", "Sector": "ELC", "Set": ".ENV.", "Unit": "kt", "Description": "-:- "})
+    fuels = []
+    for i in range(scale.commodities):
+        sector = sectors[i % len(sectors)]
+        emissions, code = SYNTHETIC_SECTORS[sector]
+        fuel = {"Name": f"{code}F{i + 1:04d}", "Sector": code, "Set": ".NRG.", "Unit": "PJ",
+                "Description": f"{SYNTHETIC_FUELS[i % len(SYNTHETIC_FUELS)]} -:- ", "Emissions": emissions,
+                "EndUseSector": sector}
+        commodities.append(fuel)
+        fuels.append(fuel)
+    # The biodiesel is blended into diesel, as in the model, so the end-use processes consume diesel
+    blends = [{"Name": SYNTHETIC_BLEND_COMMODITY, "Sector": "TRA", "Set": ".NRG.", "Unit": "PJ",
+               "Description": "Biodiesel -:- "}]
+    blends += [{"Name": f"SYNB{level}", "Sector": "TRA", "Set": ".NRG.", "Unit": "PJ", "Description": "Diesel -:- "}
+               for level in range(1, scale.blending_depth + 1)]
+    commodities += blends
+
+    processes.append({"Name": SYNTHETIC_BLEND_SOURCE, "Sector": "PRI", "Set": ".PRE.", "Inputs": [],
+                      "Outputs": [blends[0]["Name"]], "Demands": [], "Emissions": [], "Removals": ["TOTCO2"],
+                      "Description": "Primary Fuel Supply -:- Biofuel Production -:- Synthetic Refinery -:- Biodiesel"})
+    for level in range(1, scale.blending_depth + 1):
+        for branch in "AB":
+            processes.append({"Name": f"SYN_BLEND_{level}{branch}", "Sector": "PRI", "Set": ".PRE.",
+                              "Inputs": [blends[level - 1]["Name"]], "Outputs": [blends[level]["Name"]],
+                              "Demands": [], "Emissions": [], "Removals": [],
+                              "Description": "Primary Fuel Supply -:- Blending -:- Synthetic Blender -:- Biodiesel"})
+    for i in range(scale.processes):
+        fuel = fuels[i % len(fuels)]
+        sector, code = fuel["EndUseSector"], fuel["Sector"]
+        demand = f"{code}D{i + 1:05d}"
+        commodities.append({"Name": demand, "Sector": code, "Set": ".DEM.", "Unit": "PJ",
+                            "Description": f"-:- Enduse {i % 25 + 1}"})
+        inputs = [fuel["Name"]] + ([blends[-1]["Name"]] if i % 4 == 0 else [])
+        processes.append({"Name": f"{code}P{i + 1:05d}", "Sector": code, "Set": ".DMD.", "Inputs": inputs,
+                          "Outputs": [], "Demands": [demand], "Emissions": [fuel["Emissions"]], "Removals": [],
+                          "Description": f"{sector} -:- Subsector {i % 7 + 1} -:- Technology {i % 11 + 1} -:- "
+                                         f"{fuel['Description'].split('-:-')[0].strip()}"})
+    return commodities, processes
+
+
+def _vd_rows(scale, scenario_index, processes):
+    # The VD rows of one scenario, as tuples of the VD dimensions and PV
+    rng = np.random.default_rng(scale.seed + scenario_index)
+    # The objective rows have no period, as in the VD files written by VEDA, so Period is read as text
+    rows = [("Reg_obj", "-", "-", "-", region, "-", "-", "-", rng.uniform(1e5, 1e6)) for region in SYNTHETIC_REGIONS]
+    for period in scale.period_values:
+        for region in SYNTHETIC_REGIONS:
+            for timeslice in scale.timeslice_names:
+                values = rng.uniform(0.5, 10, size=len(processes))
+                for process, value in zip(processes, values):
+                    name = process["Name"]
+                    for commodity in process["Inputs"]:
+                        rows.append(("VAR_FIn", commodity, name, period, region, period, timeslice, "-", value))
+                    for commodity in process["Outputs"] + process["Demands"]:
+                        rows.append(("VAR_FOut", commodity, name, period, region, period, timeslice, "-", value * 0.9))
+                    for commodity in process["Emissions"]:
+                        rows.append(("VAR_FOut", commodity, name, period, region, period, timeslice, "-", value * 0.07))
+                    for commodity in process["Removals"]:
+                        rows.append(("VAR_FOut", commodity, name, period, region, period, timeslice, "-", -value * 0.07))
+                    rows.append(("VAR_Cap", "-", name, period, region, period, timeslice, "-", value / 5))
+    return rows
+
+
+def write_vd_file(path, scenario, rows):
+    """
+    Write VD rows as a VD file, with the header read by read_vd.
+    """
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(VD_HEADER.format(scenario=scenario))
+        for attribute, commodity, process, period, region, vintage, timeslice, constraint, value in rows:
+            file.write(f'"{attribute}","{commodity}","{process}","{period}","{region}","{vintage}",'
+                       f'"{timeslice}","{constraint}",{value:.6f}\n')
+
+
+def write_synthetic_inputs(scale, directory):
+    """
+    Write the input files of a synthetic model.
+
+    :param scale: The SyntheticScale.
+    :param directory: Directory to write the files to; created if needed.
+    :return: Dictionary of paths, with the keyword arguments of PipelineInputs: scenario_files, commodity_filepath,
+             process_filepath, commodity_groups_filepath, base_dd_filepath and schema_technology_filepath.
+    """
+    os.makedirs(directory, exist_ok=True)
+    commodities, processes = synthetic_model(scale)
+
+    scenario_files = {}
+    for index, scenario in enumerate(scale.scenario_names):
+        scenario_files[scenario] = os.path.join(directory, f"{scenario.lower()}.vd")
+        write_vd_file(scenario_files[scenario], scenario, _vd_rows(scale, index, processes))
+
+    commodity_filepath = os.path.join(directory, "Items-List-Commodity.csv")
+    pd.DataFrame([{
+        "Scenario": "BASE", "Region": "NI", "Sector": c["Sector"], "Set": c["Set"], "Name": c["Name"],
+        "Description": c["Description"], "Unit": c["Unit"], "Type": c["Set"].strip("."), "Sub type": "",
+        "Lim type": "FX", "Time slice level": "ANNUAL", "Peak time slice": "",
+    } for c in commodities]).to_csv(commodity_filepath, index=False)
+
+    process_filepath = os.path.join(directory, "Items-List-Process.csv")
+    pd.DataFrame([{
+        "Scenario": "BASE", "Region": "NI", "Sector": p["Sector"], "Set": p["Set"], "Name": p["Name"],
+        "Description": p["Description"], "Activity unit": "PJ", "Capacity unit": "GW", "Type": p["Set"].strip("."),
+        "Sub type": "-", "Primary commodity group": (p["Outputs"] + p["Demands"])[0], "Time slice level": "ANNUAL",
+        "Vintage": 0.0,
+    } for p in processes]).to_csv(process_filepath, index=False)
+
+    commodity_groups_filepath = os.path.join(directory, "Items-List-Commodity-Groups.csv")
+    groups = []
+    for p in processes:
+        for suffix, members in [("NRGI", p["Inputs"]), ("NRGO", p["Outputs"]), ("DEMO", p["Demands"]),
+                                ("ENVO", p["Emissions"] + p["Removals"])]:
+            groups += [{"Scenario": "BASE", "Region": "NI", "Sector": p["Sector"], "Process": p["Name"],
+                        "Name": f"{p['Name']}_{suffix}", "Description": "-", "Member": member} for member in members]
+    pd.DataFrame(groups).to_csv(commodity_groups_filepath, index=False)
+
+    schema_technology_filepath = os.path.join(directory, "Schema_Technology.xlsx")
+    technologies = sorted({p["Description"].split("-:-")[2].strip() for p in processes})
+    pd.DataFrame({"Technology": technologies, "Technology_Group": [f"{t} Group" for t in technologies]}).to_excel(
+        schema_technology_filepath, index=False)
+
+    base_dd_filepath = os.path.join(directory, "base.dd")
+    with open(base_dd_filepath, "w", encoding="utf-8") as file:
+        file.write("SET COM_UNIT\n\n/\n")
+        file.writelines(f"'NI'.'{c['Name']}'.'{c['Unit']}'\n" for c in commodities)
+        file.write("/;\n\nPARAMETER\n\nVDA_EMCB ' '/\n")
+        file.writelines(f"'NI'.2018.'{c['Name']}'.'{c['Emissions']}' {60 + i % 30}\n"
+                        for i, c in enumerate(commodities) if "Emissions" in c)
+        file.write("/;\n")
+
+    return {
+        "scenario_files": scenario_files,
+        "commodity_filepath": commodity_filepath,
+        "process_filepath": process_filepath,
+        "commodity_groups_filepath": commodity_groups_filepath,
+        "base_dd_filepath": base_dd_filepath,
+        "schema_technology_filepath": schema_technology_filepath,
+    }
+
+
+def synthetic_combined_df(scale, missing_period_fraction=0.2):
+    """
+    Build a DataFrame shaped like the combined DataFrame (GROUP_COLUMNS and Value), with a category for each
+    end-use process input and output in each scenario, and some periods missing in each category.
+    """
+    rng = random.Random(scale.seed)
+    _, processes = synthetic_model(scale)
+    rows = []
+    for scenario in scale.scenario_names:
+        for process in processes:
+            if not process["Demands"]:
+                continue
+            sector, subsector, technology, fuel = [part.strip() for part in process["Description"].split("-:-")]
+            for parameters in ["Fuel Consumption", "End Use Demand", "Emissions"]:
+                for period in scale.period_values:
+                    if rng.random() < missing_period_fraction:
+                        continue
+                    rows.append({
+                        "Scenario": scenario, "Sector": sector, "Subsector": subsector, "Technology": technology,
+                        "Enduse": process["Demands"][0], "Unit": "kt CO2" if parameters == "Emissions" else "PJ",
+                        "Parameters": parameters, "Fuel": fuel, "Period": period, "FuelGroup": "Fossil Fuels",
+                        "Technology_Group": technology, "Value": rng.uniform(0, 10),
+                    })
+    return pd.DataFrame(rows, columns=GROUP_COLUMNS + ["Value"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("output_dir", help="Directory to write the synthetic inputs to")
+    for scale_field in fields(SyntheticScale):
+        parser.add_argument(f"--{scale_field.name.replace('_', '-')}", type=int, default=scale_field.default)
+    args = parser.parse_args()
+
+    scale = SyntheticScale(**{scale_field.name: getattr(args, scale_field.name) for scale_field in fields(SyntheticScale)})
+    write_synthetic_inputs(scale, args.output_dir)
+    logging.info("Synthetic inputs for %s written to %s", scale, args.output_dir)
@@ -0,0 +1,138 @@
+"""
+Reuse of the end-use fractions of identical flow tracing subproblems across scenarios and periods.
+
+The allocations trace the output of a source process (e.g. biodiesel blending) through the flow graph of one
+(Scenario, Period) partition of raw_df to the end-use processes (see pipeline.end_use_fractions). Many of these
+subproblems are identical: the base-year periods are the same in every scenario, and sensitivities often differ
+only in later periods. A trace only reads the non-CO2 output flows of the processes it reaches and the input flows
+of the commodities it reaches, so its result is determined by the traced process and those flows.
+
+TraceCache computes, for each trace, a canonical key: the traced process and the (Attribute, Process, Commodity,
+Value) of every flow the trace reads, in the order of raw_df (the tracer's results depend on the order in which it
+meets the flows, so the order is part of the key). A trace whose key, and commodity filter, were already solved
+reuses the fractions of that solution, with the Scenario and Period of the new trace. Keys are compared by
+equality, so two subproblems share a solution only if their flows are exactly the same.
+
+The number of traces solved and reused is logged by the allocation functions.
+
+See the README for the overall workflow.
+"""
+
+from collections import Counter
+
+from constants import *
+
+
+def flow_closure(graph, process):
+    """
+    Return the processes whose output flows, and the commodities whose input flows, are read when tracing
+    the outputs of a process to the end-uses.
+
+    :param graph: Tuple of (output commodities by process, consuming processes by commodity) for one partition.
+    :param process: The process traced from.
+    """
+    outputs, consumers = graph
+    processes, commodities = set(), set()
+    frontier = [process]
+    while frontier:
+        process = frontier.pop()
+        if process in processes:
+            continue
+        processes.add(process)
+        for commodity in outputs.get(process, ()):
+            if commodity not in commodities:
+                commodities.add(commodity)
+                frontier.extend(consumers.get(commodity, ()))
+    return processes, commodities
+
+
+class _PartitionFlows:
+    """
+    The flows of one partition read by the tracer: the position in raw_df and record of each non-CO2 output flow
+    by process, and of each input flow by commodity.
+    """
+
+    def __init__(self, df):
+        self.records = {}
+        self.outputs, self.consumers = {}, {}
+        self.output_rows, self.input_rows = {}, {}
+        columns = [df.index, df['Attribute'], df['Process'], df['Commodity'], df['Value']]
+        for position, attribute, process, commodity, value in zip(*columns):
+            if attribute == 'VAR_FOut' and 'CO2' not in str(commodity):
+                self.outputs.setdefault(process, set()).add(commodity)
+                self.output_rows.setdefault(process, []).append(position)
+            elif attribute == 'VAR_FIn':
+                self.consumers.setdefault(commodity, set()).add(process)
+                self.input_rows.setdefault(commodity, []).append(position)
+            else:
+                continue
+            self.records[position] = (attribute, process, commodity, value)
+
+    def subgraph(self, process):
+        """
+        Return the records of the flows read when tracing from a process, in the order of raw_df.
+        """
+        processes, commodities = flow_closure((self.outputs, self.consumers), process)
+        positions = [row for p in processes for row in self.output_rows.get(p, ())]
+        positions += [row for c in commodities for row in self.input_rows.get(c, ())]
+        return tuple(self.records[position] for position in sorted(positions))
+
+
+class TraceCache:
+    """
+    The end-use fractions of the traces solved on one raw_df, by canonical key of their flow subgraph.
+    """
+
+    def __init__(self, raw_df):
+        """
+        :param raw_df: The DataFrame the traces read, as passed to end_use_fractions.
+        """
+        df = raw_df.reset_index(drop=True)
+        self._partition_rows = df.groupby(PARTITION_COLUMNS, sort=False).indices
+        self._df = df
+        self._partitions = {}
+        self._fractions = {}
+        self.solved = Counter()
+        self.reused = Counter()
+
+    def _flows(self, scenario, period):
+        if (scenario, period) not in self._partitions:
+            positions = self._partition_rows.get((scenario, period), [])
+            self._partitions[(scenario, period)] = _PartitionFlows(self._df.iloc[positions])
+        return self._partitions[(scenario, period)]
+
+    def key(self, process, scenario, period):
+        """
+        Return the canonical key of the trace from a process in a partition.
+        """
+        return process, self._flows(scenario, period).subgraph(process)
+
+    def end_use_fractions(self, solve, process, scenario, period, filter_to_commodities=None, label="traces"):
+        """
+        Return the end-use fractions of a trace, reusing those of an identical trace if one was solved.
+
+        :param solve: Function computing the fractions, called without arguments if the trace was not solved,
+                      e.g. a partial application of pipeline.end_use_fractions.
+        :param filter_to_commodities: The commodity filter of the trace, part of the key.
+        :param label: Name of the allocation, for the counts of traces solved and reused.
+        :return: A new DataFrame, which the caller may modify.
+        """
+        key = (self.key(process, scenario, period),
+               tuple(filter_to_commodities) if filter_to_commodities is not None else None)
+        if key in self._fractions:
+            self.reused[label] += 1
+            fractions = self._fractions[key].copy()
+            fractions['Scenario'] = scenario
+            fractions['Period'] = period
+            return fractions
+        self.solved[label] += 1
+        fractions = solve()
+        self._fractions[key] = fractions.copy()
+        return fractions
+
+    def summary(self, label="traces"):
+        """
+        Return a description of the number of traces solved and reused for a label.
+        """
+        total = self.solved[label] + self.reused[label]
+        return f"{label}: {total} traces, {self.solved[label]} solved, {self.reused[label]} reused"
@@ -0,0 +1,189 @@
+"""
+Validation of the rows of the VD files as they are read, so that data problems are reported before the
+expensive stages start, rather than deep in the tracing or as rows silently dropped by the schema join.
+
+read_vd passes each file it parses to a VDValidator, which counts, for each file:
+* unknown processes: processes missing from the Items List of processes,
+* commodities without a unit: commodities missing from the COM_UNIT set of base.dd (units_consistent fails on
+  these when they are traced),
+* unexpected periods: periods missing from the MODLYEAR set of base.dd,
+* null values: rows with no PV,
+* non-numeric values: rows whose PV is not a number.
+
+The key checks work on the distinct values of each column, counted in one pass by value_counts, and compared with
+sets prebuilt from the Items List and base.dd; the rows are only scanned again to take the samples of a check that
+found a problem. For each check, the report gives the number of rows, the offending keys with their row counts
+(up to VALIDATION_SAMPLE_SIZE keys) and the first VALIDATION_SAMPLE_SIZE offending rows.
+
+read_vd_files, which reads the VD files once for both the schema and the combined DataFrame, validates them and
+logs a summary. If a trace is active (e.g. with --trace, see instrumentation.py), it also writes the report as JSON
+to TRACE_DIR. The known processes, commodities and periods are read once for each version of the Items List and
+base.dd, and reused by the later validators. A stage loaded from a checkpoint does not read the files, and so does
+not validate them again.
+
+See the README for the overall workflow.
+"""
+
+import functools
+import json
+import logging
+import os
+import time
+from collections import Counter
+import pandas as pd
+
+from constants import *
+from helpers import base_dd_commodity_unit_rules, base_dd_set_elements
+
+# Value of a VD dimension that does not apply to a row
+NOT_APPLICABLE = '-'
+
+
+def _key(value):
+    # Periods may be parsed as numbers or strings, and as floats if the column has missing values
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+@functools.lru_cache(maxsize=8)
+def _known_keys(process_file, base_dd_file):
+    # Each file is given as (path, size, mtime), so that an edited file is read again
+    processes = tuple(pd.read_csv(process_file[0])['Name'])
+    commodities = tuple(condition['Commodity'] for condition, _, _ in
+                        base_dd_commodity_unit_rules(base_dd_file[0], rule_type="inplace"))
+    periods = tuple(base_dd_set_elements(base_dd_file[0], "MODLYEAR"))
+    return processes, commodities, periods
+
+
+def _file_version(path):
+    stat = os.stat(path)
+    return path, stat.st_size, stat.st_mtime
+
+
+class VDValidator:
+    """
+    Counters and samples of the problems found in the VD files read, by file.
+    """
+
+    def __init__(self, processes, commodities_with_units, periods, sample_size=VALIDATION_SAMPLE_SIZE):
+        """
+        :param processes: The known processes.
+        :param commodities_with_units: The commodities with a unit.
+        :param periods: The expected periods, as numbers or strings.
+        :param sample_size: Number of offending keys and rows kept for each check.
+        """
+        known = {
+            'unknown_process': ('Process', {_key(process) for process in processes}),
+            'commodity_without_unit': ('Commodity', {_key(commodity) for commodity in commodities_with_units}),
+            'unexpected_period': ('Period', {_key(period) for period in periods}),
+        }
+        # A check with nothing to compare with (e.g. a base.dd without MODLYEAR) would flag every row
+        self.known = {check: (column, keys) for check, (column, keys) in known.items() if keys}
+        self.sample_size = sample_size
+        self.rows = Counter()
+        self.counts = Counter()
+        self.keys = {}
+        self.samples = {}
+
+    @classmethod
+    def from_inputs(cls, inputs):
+        """
+        Build a validator from the Items List of processes and base.dd of the PipelineInputs. The files are only
+        read again if they have changed since the last validator was built from them.
+        """
+        return cls(*_known_keys(_file_version(inputs.process_filepath), _file_version(inputs.base_dd_filepath)))
+
+    def _record(self, source, check, count, offending_rows, keys=None):
+        # offending_rows is only called, to take the samples, if the check found a problem
+        if not count:
+            return
+        self.counts[(source, check)] += count
+        if keys is not None:
+            self.keys.setdefault((source, check), Counter()).update(keys)
+        samples = self.samples.setdefault((source, check), [])
+        if len(samples) < self.sample_size:
+            samples += offending_rows().head(self.sample_size - len(samples)).to_dict('records')
+
+    def observe(self, df, source):
+        """
+        Count the problems in the rows of a VD file, as parsed by read_vd.
+
+        :param df: The rows of the file, with the VD dimension columns and PV.
+        :param source: Name of the file, for the report.
+        """
+        self.rows[source] += len(df)
+        for check, (column, known) in self.known.items():
+            if column not in df.columns:
+                continue
+            counts = df[column].value_counts()
+            unknown = counts[[key != NOT_APPLICABLE and _key(key) not in known for key in counts.index]]
+            self._record(source, check, int(unknown.sum()), lambda: df[df[column].isin(unknown.index)],
+                         keys={_key(key): int(rows) for key, rows in unknown.items()})
+        if 'PV' in df.columns:
+            null = df['PV'].isna()
+            self._record(source, 'null_value', int(null.sum()), lambda: df[null])
+            if not pd.api.types.is_numeric_dtype(df['PV']):
+                non_numeric = pd.to_numeric(df['PV'], errors='coerce').isna() & ~null
+                self._record(source, 'non_numeric_value', int(non_numeric.sum()), lambda: df[non_numeric])
+
+    def report(self):
+        """
+        Return the structured report: for each file, its number of rows and, for each check that found a problem,
+        the number of rows, the offending keys and the sample rows.
+        """
+        report = {}
+        for source, rows in self.rows.items():
+            checks = {}
+            for (check_source, check), count in self.counts.items():
+                if check_source == source:
+                    keys = self.keys.get((source, check), Counter()).most_common(self.sample_size)
+                    checks[check] = {'rows': count,
+                                     'keys': dict(keys),
+                                     'samples': self.samples.get((source, check), [])}
+            report[source] = {'rows': rows, 'checks': checks}
+        return report
+
+    def problems(self):
+        """
+        Return the number of rows with each problem, over all files.
+        """
+        problems = Counter()
+        for (_, check), count in self.counts.items():
+            problems[check] += count
+        return problems
+
+    def summary(self):
+        """
+        Return a description of the problems found in each file.
+        """
+        lines = []
+        for source, entry in self.report().items():
+            lines.append(f"{source}: {entry['rows']} rows" + ("" if entry['checks'] else ", no problems found"))
+            for check, result in entry['checks'].items():
+                keys = f", e.g. {', '.join(list(result['keys'])[:5])}" if result['keys'] else ""
+                lines.append(f"  {check}: {result['rows']} row(s){keys}")
+        return "\n".join(lines)
+
+    def log(self):
+        """
+        Log the summary, as a warning if a problem was found.
+        """
+        level = logging.WARNING if self.counts else logging.INFO
+        logging.log(level, "Validation of the VD files:\n%s", self.summary())
+
+    def write(self, path):
+        """
+        Write the report as JSON to path.
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as file:
+            json.dump(self.report(), file, indent=2, default=str)
+        logging.info("Validation report written to %s", path)
+
+
+def validation_filepath(label):
+    """
+    Return the path of the validation report of a run of a stage, from its name and the time.
+    """
+    return os.path.join(TRACE_DIR, f"vd_validation_{label}_{time.strftime('%Y%m%d_%H%M%S')}.json")
@@ -0,0 +1,99 @@
+"""
+Converts the combined DataFrame between the long layout (one row per category and Period) and a wide,
+period-major layout (one row per category, with one float column per Period).
+
+complete_df has every category filled in for every model period. In the long layout each dimension string
+is therefore repeated once per period. The wide layout stores each category key once, alongside a contiguous
+float64 block of values (`wide[period_columns].to_numpy()`). This cuts the row count by the number of periods.
+The conversion is lossless in both directions, up to row order: to_long returns the rows sorted by the group columns.
+
+Usage (convert the existing output CSV into the wide layout):
+python scripts/wide_format.py
+
+See the README for the overall workflow.
+"""
+
+import csv
+import logging
+import pandas as pd
+
+from constants import *
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def to_wide(df, group_columns=None):
+    """
+    Convert a long-format combined DataFrame to the wide layout.
+
+    :param df: Long-format DataFrame with the group columns (including 'Period') and 'Value'.
+               Rows must be unique over the group columns, as they are in complete_df.
+    :param group_columns: Columns identifying a row, including 'Period'. Defaults to GROUP_COLUMNS.
+    :return: DataFrame with the key columns followed by one float column per Period, in sorted order.
+             Categories with no row for a Period have NaN in that column.
+    """
+    group_columns = group_columns or GROUP_COLUMNS
+    key_columns = [c for c in group_columns if c != 'Period']
+    if df.duplicated(subset=group_columns).any():
+        raise ValueError("Rows are not unique over the group columns; aggregate them before converting to wide.")
+    wide = df.set_index(key_columns + ['Period'])['Value'].astype(float).unstack('Period')
+    wide = wide[sorted(wide.columns)]
+    wide.columns.name = None
+    return wide.reset_index()
+
+
+def to_long(wide, group_columns=None):
+    """
+    Convert a wide-layout DataFrame back to the long format.
+
+    :param wide: DataFrame returned by to_wide (or read with read_wide).
+    :param group_columns: Columns identifying a row, including 'Period'. Defaults to GROUP_COLUMNS.
+    :return: Long-format DataFrame with the group columns and 'Value', sorted by the group columns.
+             NaN cells (periods a category had no row for) are not returned.
+    """
+    group_columns = group_columns or GROUP_COLUMNS
+    key_columns = [c for c in group_columns if c != 'Period']
+    period_columns = [c for c in wide.columns if c not in key_columns]
+    long_df = wide.melt(id_vars=key_columns, value_vars=period_columns, var_name='Period', value_name='Value')
+    long_df = long_df.dropna(subset=['Value'])
+    # Restore the dtype of the Period labels, which melt returns as objects
+    long_df['Period'] = long_df['Period'].astype(pd.Index(period_columns).dtype)
+    return long_df[group_columns + ['Value']].sort_values(by=group_columns).reset_index(drop=True)
+
+
+def save_wide(wide, path, group_columns=None):
+    """
+    Write a wide-layout DataFrame to CSV, formatted like the combined DataFrame output.
+
+    :param wide: DataFrame returned by to_wide.
+    :param path: Path of the CSV file to write.
+    :param group_columns: Columns identifying a row, including 'Period'. Defaults to GROUP_COLUMNS.
+    """
+    group_columns = group_columns or GROUP_COLUMNS
+    key_columns = [c for c in group_columns if c != 'Period']
+    _wide = wide.rename(columns={c: str(int(c)) for c in wide.columns if c not in key_columns})
+    _wide.to_csv(path, index=False, quoting=csv.QUOTE_ALL, float_format="%.6f")
+
+
+def read_wide(path, group_columns=None):
+    """
+    Read a wide-layout CSV file written by save_wide.
+
+    :param path: Path of the CSV file.
+    :param group_columns: Columns identifying a row, including 'Period'. Defaults to GROUP_COLUMNS.
+    :return: DataFrame with string key columns and float period columns named by the Period as a string,
+             matching the Period values in complete_df.
+    """
+    group_columns = group_columns or GROUP_COLUMNS
+    key_columns = [c for c in group_columns if c != 'Period']
+    header = pd.read_csv(path, nrows=0).columns
+    dtypes = {c: (str if c in key_columns else float) for c in header}
+    return pd.read_csv(path, dtype=dtypes)
+
+
+if __name__ == "__main__":
+    combined_df = pd.read_csv(OUTPUT_COMBINED_DF_FILEPATH, low_memory=False)
+    wide = to_wide(combined_df)
+    save_wide(wide, OUTPUT_COMBINED_WIDE_FILEPATH)
+    logging.info("Converted %s long rows to %s wide rows, saved to %s",
+                 len(combined_df), len(wide), OUTPUT_COMBINED_WIDE_FILEPATH)